@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""Compare the ``rtree`` and ``bulk`` intersection engines.
+
+Builds two synthetic polygon grids which don't line up, and calculates their intersections with ``intersection_worker`` using each engine. The ``bulk`` engine requires shapely 2.
+
+Usage:
+
+    python benchmarks/overlay.py [from grid size] [to grid size]
+
+"""
+from pandarus.geometry import BULK_AVAILABLE
+from pandarus.intersections import intersection_worker, release_to_map
+from pandarus.projection import WGS84
+from fiona.crs import from_string
+from shapely.geometry import Polygon, mapping
+import fiona
+import numpy as np
+import os
+import sys
+import tempfile
+import time
+
+
+def write_grid(filepath, size, offset=0., seed=0):
+    """Write a ``size`` by ``size`` grid of polygons over (-60, -30, 60, 30), with randomly perturbed vertices along the cell edges."""
+    rng = np.random.RandomState(seed)
+    xs = np.linspace(-60, 60, size + 1) + offset
+    ys = np.linspace(-30, 30, size + 1) + offset
+    schema = {'geometry': 'Polygon', 'properties': {'name': 'str'}}
+    with fiona.open(filepath, 'w', driver='GPKG', crs=from_string(WGS84),
+                    schema=schema) as sink:
+        for i in range(size):
+            for j in range(size):
+                # Ten vertices per edge, to have realistic overlay costs
+                t = np.linspace(0, 1, 10, endpoint=False)
+                x0, x1, y0, y1 = xs[i], xs[i + 1], ys[j], ys[j + 1]
+                coords = (
+                    [(x0 + (x1 - x0) * k, y0) for k in t] +
+                    [(x1, y0 + (y1 - y0) * k) for k in t] +
+                    [(x1 - (x1 - x0) * k, y1) for k in t] +
+                    [(x0, y1 - (y1 - y0) * k) for k in t]
+                )
+                coords = np.array(coords) + rng.uniform(-1e-4, 1e-4, (len(coords), 2))
+                sink.write({
+                    'geometry': mapping(Polygon(coords)),
+                    'properties': {'name': '{}-{}'.format(i, j)},
+                })
+
+
+def run(from_fp, to_fp, engine):
+    start = time.time()
+    results = intersection_worker(from_fp, None, to_fp, engine=engine)
+    elapsed = time.time() - start
+    release_to_map(to_fp)
+    return results, elapsed
+
+
+if __name__ == '__main__':
+    from_size = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    to_size = int(sys.argv[2]) if len(sys.argv) > 2 else 23
+
+    if not BULK_AVAILABLE:
+        sys.exit("The ``bulk`` engine requires shapely 2")
+
+    with tempfile.TemporaryDirectory() as dirpath:
+        from_fp = os.path.join(dirpath, "from.gpkg")
+        to_fp = os.path.join(dirpath, "to.gpkg")
+        write_grid(from_fp, from_size)
+        write_grid(to_fp, to_size, offset=0.1, seed=1)
+
+        print("From features: {}, to features: {}".format(
+            from_size ** 2, to_size ** 2
+        ))
+        timings = {}
+        for engine in ('rtree', 'bulk'):
+            results, timings[engine] = run(from_fp, to_fp, engine)
+            print("{}: {} intersections in {:.2f} seconds".format(
+                engine, len(results), timings[engine]
+            ))
+            if engine == 'rtree':
+                expected = results
+            else:
+                assert results.keys() == expected.keys()
+                assert np.allclose(
+                    [results[key]['measure'] for key in expected],
+                    [expected[key]['measure'] for key in expected]
+                )
+        print("Speedup: {:.1f}x".format(timings['rtree'] / timings['bulk']))
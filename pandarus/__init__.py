@@ -2,10 +2,12 @@ __version__ = (1, 0, 4)
 
 __all__ = (
     "Map",
+    "Session",
     'clean_raster',
     'convert_to_vector',
     'calculate_remaining',
     'intersect',
+    'intersect_many',
     'intersections_from_intersection',
     'raster_statistics',
     'round_raster',
@@ -14,8 +16,10 @@ __all__ = (
 from .calculate import (
     calculate_remaining,
     intersect,
+    intersect_many,
     intersections_from_intersection,
     raster_statistics,
 )
 from .maps import Map
+from .session import Session
 from .conversion import convert_to_vector, clean_raster, round_raster
@@ -1,19 +1,38 @@
 # -*- coding: utf-8 -*-
 from .conversion import check_type
-from .filesystem import json_exporter, get_appdirs_path, sha256, json_importer
+from .filesystem import (
+    get_appdirs_path,
+    json_exporter,
+    json_importer,
+    JSONStreamWriter,
+    sha256,
+)
 from .maps import Map
-from .intersections import intersection_dispatcher
-from .geometry import get_remaining
-from .projection import project
+from .intersections import intersection_dispatcher, merge_shards
+from .tiles import tiled_dispatcher
+from .cascade import cascade_dispatcher
+from .geometry import (
+    BULK_AVAILABLE,
+    get_remaining,
+    kind_mapping,
+    MEASURE_ENGINES,
+    OVERLAY_ENGINES,
+)
 from .rasters import gen_zonal_stats
 from fiona.crs import from_string
-from functools import partial
+from glob import glob
+from itertools import islice
+from queue import Queue
 from shapely.geometry import mapping, shape
 import datetime
 import fiona
 import multiprocessing
 import os
 import rasterio
+import rtree
+import shutil
+import tempfile
+import threading
 import warnings
 
 
@@ -25,6 +44,21 @@ MISMATCHED_CRS = """Possible coordinate reference systems (CRS) mismatch. The ra
 
 CPU_COUNT = multiprocessing.cpu_count()
 
+# Geometry type of the ``intersect_many`` output file for each kind of geometry
+MULTI_TYPES = {
+    'point': 'MultiPoint',
+    'line': 'MultiLineString',
+    'polygon': 'MultiPolygon',
+}
+
+# Number of features written to the output file in one transaction
+WRITE_BATCH_SIZE = 1000
+
+# Number of job results waiting for the writer thread in ``intersect``. The
+# calculation waits when the writer falls behind, so that results don't pile
+# up in memory.
+WRITE_QUEUE_SIZE = 8
+
 
 def get_map(fp, field, kwargs):
     obj = Map(fp, field, **kwargs)
@@ -134,11 +168,38 @@ def raster_statistics(vector_fp, identifying_field, raster, output=None,
     return json_exporter({'data': results, 'metadata': metadata}, output, compress)
 
 
-def as_features(dct):
-    for index, key in enumerate(dct):
+def output_schema(first, first_field, second, second_field):
+    """Schema of the geospatial file written by ``intersect`` for ``Map`` objects ``first`` and ``second``."""
+    return {
+        'properties': {
+            'id': 'int',
+            'from_label': first.file.meta['schema']['properties'][first_field],
+            'to_label': second.file.meta['schema']['properties'][second_field],
+            'measure': 'float',
+        },
+        'geometry': 'MultiPolygon',
+    }
+
+
+def output_metadata(first_metadata, second_metadata, first_mapping, failures=None):
+    """Metadata of the JSON data file written by ``intersect``. ``failures`` are listed under ``failed`` with their labels, if there are any."""
+    metadata = {
+        'first': first_metadata,
+        'second': second_metadata,
+        'when': datetime.datetime.now().isoformat(),
+    }
+    if failures:
+        metadata['failed'] = [
+            dict(row, id=first_mapping[row['index']]) for row in failures
+        ]
+    return metadata
+
+
+def as_features(dct, start=0):
+    for index, key in enumerate(dct, start):
         row = dct[key]
         gj = {
-            'geometry': mapping(row['geom']),
+            'geometry': mapping(row['geom']) if 'geom' in row else None,
             'properties': {
                 'id': index,
                 'from_label': key[0],
@@ -148,9 +209,159 @@ def as_features(dct):
         yield gj
 
 
+def shard_features(shards, first_mapping, second_mapping, start=0):
+    """Like ``as_features``, but for the shards written by ``intersection_dispatcher``.
+
+    Features are numbered in order of ``from`` and ``to`` feature index, so the numbering doesn't depend on how the work was split between jobs."""
+    for index, (from_index, to_index, measure, geometry) in enumerate(merge_shards(shards), start):
+        yield {
+            'geometry': geometry,
+            'properties': {
+                'id': index,
+                'from_label': first_mapping[from_index],
+                'to_label': second_mapping[to_index],
+                'measure': measure},
+        }
+
+
+def label_hashes(obj, labels):
+    """Hashes of the geometries of the features of ``Map`` ``obj``, as ``[label, hash]`` pairs.
+
+    ``labels`` is a dictionary of feature index to label, as given by ``Map.get_fieldnames_dictionary``."""
+    return [[labels[index], value] for index, value in obj.feature_hashes().items()]
+
+
+def find_previous(dirpath, first_metadata, second_metadata, options):
+    """Find the most recent ``intersect`` run in ``dirpath`` with the same input filepaths, identifying fields and ``options``, from the feature hashes files written by ``incremental`` runs.
+
+    Returns the filepath of the feature hashes file, and its contents, or ``(None, None)``."""
+    candidates = sorted(
+        glob(os.path.join(dirpath, "*.hashes.json*")),
+        key=os.path.getmtime,
+        reverse=True
+    )
+    for filepath in candidates:
+        previous = json_importer(filepath)
+        if (previous['options'] == options and
+                all(previous[key]['path'] == metadata['path'] and
+                    previous[key]['field'] == metadata['field']
+                    for key, metadata in (('first', first_metadata),
+                                          ('second', second_metadata))) and
+                all(os.path.exists(os.path.join(dirpath, previous[key]))
+                    for key in ('data', 'vector') if previous[key])):
+            return filepath, previous
+    return None, None
+
+
+def changed_features(previous, first, second, first_hashes, second_hashes,
+                     rows):
+    """Find the features of ``first`` whose intersections could differ from the ``previous`` run described by a feature hashes file.
+
+    These are the features of ``first`` which are new or whose geometry changed, the features which intersected a feature of ``second`` which was changed or removed, and the features whose bounds intersect a new or changed feature of ``second``. ``rows`` are the ``[from label, to label, measure]`` rows of the previous run.
+
+    Returns a set of labels of ``first``."""
+    old_first = {label: value for label, value in previous['first']['hashes']}
+    old_second = {label: value for label, value in previous['second']['hashes']}
+    new_second = {label: value for label, value in second_hashes}
+
+    changed = {label for label, value in first_hashes if old_first.get(label) != value}
+    changed_to = {label for label, value in second_hashes if old_second.get(label) != value}
+    removed_to = set(old_second).difference(new_second)
+    changed.update(row[0] for row in rows if row[1] in changed_to or row[1] in removed_to)
+
+    if changed_to:
+        second_labels = second.get_fieldnames_dictionary()
+        index = rtree.Rtree()
+        for i, geom in second.iter_latlong(
+                [i for i, label in second_labels.items() if label in changed_to]):
+            index.insert(i, geom.bounds)
+        first_labels = first.get_fieldnames_dictionary()
+        for i, geom in first.iter_latlong():
+            if first_labels[i] not in changed and \
+                    next(index.intersection(geom.bounds), None) is not None:
+                changed.add(first_labels[i])
+    return changed
+
+
+def previous_features(dirpath, previous, rows, keep):
+    """Features of the ``previous`` run whose ``from`` label is in ``keep``, in the format of ``as_features``.
+
+    Geometries are read from the previous geospatial file if there is one; otherwise they are ``None``, and ``rows`` of the previous JSON data file are used."""
+    if previous['vector']:
+        with fiona.open(os.path.join(dirpath, previous['vector'])) as source:
+            for feature in source:
+                if feature['properties']['from_label'] in keep:
+                    yield {
+                        'geometry': feature['geometry'],
+                        'properties': {
+                            'from_label': feature['properties']['from_label'],
+                            'to_label': feature['properties']['to_label'],
+                            'measure': feature['properties']['measure']},
+                    }
+    else:
+        for from_label, to_label, measure in rows:
+            if from_label in keep:
+                yield {
+                    'geometry': None,
+                    'properties': {
+                        'from_label': from_label,
+                        'to_label': to_label,
+                        'measure': measure},
+                }
+
+
+def numbered(features, start=0):
+    """Set the ``id`` of ``features``, counting from ``start``."""
+    for index, feature in enumerate(features, start):
+        feature['properties']['id'] = index
+        yield feature
+
+
+def write_features(features, sink, table, batch_size=WRITE_BATCH_SIZE,
+                   labels=('from_label', 'to_label')):
+    """Write ``features`` to the fiona ``sink`` in batches of ``batch_size``, and their ``labels`` properties and measures to the ``JSONStreamWriter`` ``table``. ``sink`` can be ``None`` if only ``table`` is written.
+
+    Returns the number of features written."""
+    features, count = iter(features), 0
+    while True:
+        batch = list(islice(features, batch_size))
+        if not batch:
+            return count
+        if sink is not None:
+            sink.writerecords(batch)
+        table.write(
+            tuple(f['properties'][label] for label in labels) +
+            (f['properties']['measure'],)
+            for f in batch
+        )
+        count += len(batch)
+
+
+def feature_writer(queue, sink, table, errors, start=0):
+    """Write the intersection results put on ``queue`` with ``write_features``, until ``None`` is received.
+
+    Meant to run in its own thread while the results are being calculated. Each item in ``queue`` is a results dictionary as given by ``intersection_dispatcher``, with labels instead of feature indices. Exceptions are appended to ``errors``; after an error, the remaining results are discarded. Features are numbered from ``start``."""
+    count = start
+    while True:
+        results = queue.get()
+        if results is None:
+            break
+        if errors:
+            continue
+        try:
+            count += write_features(as_features(results, count), sink, table)
+        except Exception as e:
+            errors.append(e)
+
+
 def intersect(first_fp, first_field, second_fp, second_field,
         first_kwargs={}, second_kwargs={}, dirpath=None, cpus=CPU_COUNT,
-        driver='GeoJSON', compress=True, log_dir=None):
+        driver='GeoJSON', compress=True, log_dir=None,
+        measure_engine='mollweide', projected=False, early_stop=False,
+        shard_driver=None, geometries=True, engine='rtree',
+        backend='processes', session=None, start_method=None,
+        checkpoint_dir=None, feature_timeout=None, incremental=False,
+        max_vertices=None, tile_size=None):
     """Calculate the intersection of two vector spatial datasets.
 
     The first spatial input file **must** have only one type of geometry, i.e. points, lines, or polygons, and excluding geometry collections. Any of the following are allowed: Point, MultiPoint, LineString, LinearRing, MultiLineString, Polygon, MultiPolygon.
@@ -170,15 +381,31 @@ def intersect(first_fp, first_field, second_fp, second_field,
         * ``driver``: String, default is ``GeoJSON``. Fiona driver name to use when writing geospatial output file. Common values are ``GeoJSON`` or ``GPKG``.
         * ``compress``: Boolean, default is True. Compress JSON output file.
         * ``log_dir``: String, optional.
-
-    Returns filepaths for two created files.
+        * ``measure_engine``: String, default is ``mollweide``. How areas and lengths are calculated. ``mollweide`` projects intersected geometries to the Mollweide projection; ``geodesic`` calculates them directly on the WGS84 ellipsoid, which skips the projection step and is more accurate near the poles.
+        * ``projected``: Boolean, default is False. Project both datasets once into a working CRS, and calculate intersections and measures in that CRS instead of in WGS84. The working CRS is the CRS of the input datasets if they share the same projected CRS, and Mollweide otherwise. Measures are taken in the working CRS only if it is equal-area; see ``measure``. Only the output geometries are projected back to WGS84.
+        * ``early_stop``: Boolean, default is False. For each feature in the first dataset, stop testing features of the second dataset once the intersections found account for the whole feature. Relies on the features of the second dataset not overlapping.
+        * ``shard_driver``: String, optional. Fiona driver name, such as ``GPKG`` or ``FlatGeobuf``. If given, each job writes its intersections to its own temporary shard with this driver, instead of returning them to the main process. The shards are then merged into the output files, one feature at a time, so memory use doesn't grow with the size of the output.
+        * ``geometries``: Boolean, default is True. If False, only measures are calculated: intersected geometries are not returned by the workers, and no geospatial file is written. ``shard_driver`` is then ignored.
+        * ``engine``: String, default is ``rtree``. How intersections are found. ``rtree`` tests each feature of the first dataset against its candidates in a spatial index. ``bulk`` queries all features of a job at once, and calculates intersections and measures with the vectorized functions of shapely 2; it is usually faster, but requires shapely 2 and ignores ``early_stop``.
+        * ``backend``: String, default is ``processes``. Run jobs in a pool of ``processes``, or of ``threads`` which share one copy of the second dataset and its spatial index. Threads use much less memory, but only run in parallel while shapely releases the GIL, i.e. mostly with the ``bulk`` engine.
+        * ``start_method``: String, optional. ``multiprocessing`` start method of the worker processes, such as ``fork``, ``spawn``, or ``forkserver``. With ``forkserver``, GIS libraries are imported once by the server process instead of by each worker.
+        * ``session``: ``Session``, optional. Use the warm workers and logging of this session, instead of starting new ones; see ``Session.intersect``.
+        * ``checkpoint_dir``: String, optional. Directory where the results of each finished job are saved. If a calculation fails or is interrupted, running it again with the same inputs and options only calculates the jobs which didn't finish. Checkpoints are deleted once the output files are written. Calculations with the same inputs and options use the same checkpoints, so they shouldn't run at the same time with the same ``checkpoint_dir``. Ignored if ``cpus`` is falsey.
+        * ``feature_timeout``: Float, optional. Time limit for the intersections of each feature of the first dataset, in seconds; not used by the ``bulk`` engine. It is checked before each overlay with a feature of the second dataset. A worker process which spends more than twice ``feature_timeout`` on one feature, e.g. in a single overlay which stalls, is stopped and replaced, and the feature is skipped; this needs ``cpus``, and isn't done by the ``threads`` backend. A feature which fails with a shapely error or goes over the limit is tried again with a simplified geometry, and if that fails too, it is left out of the results and listed under ``failed`` in the metadata of the JSON data file, with the errors and some diagnostics. Features which fail are handled this way with or without ``feature_timeout``.
+        * ``incremental``: Boolean, default is False. Store a hash of the geometry of each input feature next to the output files, in ``<hashes>.hashes.json``, and reuse the results of the most recent incremental run in ``dirpath`` with the same input filepaths, identifying fields, ``measure_engine``, ``projected`` and ``geometries``. Only the features of the first dataset which were added or changed, or which may intersect features of the second dataset which were added, changed or removed, are calculated again. The outputs of the previous run are replaced by the new outputs.
+        * ``max_vertices``: Integer, optional. Split lines and polygons of the first dataset with more vertices than this on a quadtree grid before calculating their intersections, which is much faster for very large geometries. Measures of the pieces are summed, and their geometries merged before being written.
+        * ``tile_size``: Float, optional. Out of core mode for datasets which don't fit in memory. Both datasets are first split into square tiles of ``tile_size`` degrees, written to a temporary directory in ``dirpath``, and the tiles are then calculated one at a time; see ``tiled_dispatcher``. ``shard_driver`` is ignored, and ``session`` can't be used.
+
+    Results are written by a separate thread as soon as each job is finished, in batches of ``WRITE_BATCH_SIZE`` features, so that writing and compressing the output files overlaps with the calculation.
+
+    Returns filepaths for two created files. If ``geometries`` is False, the first filepath is ``None``.
 
     The first is a geospatial file that has the geometry of each possible intersection of spatial units from the two input files. The geometry type of this file will depend on the geometry type of the first input file, but will always be a multi geometry, i.e. one of MultiPoint, MultiLineString, MultiPolygon. This file will also always have the `WGS 84 CRS <http://spatialreference.org/ref/epsg/wgs-84/>`__. The output file has the following schema:
 
         * ``id``: Integer. Auto-increment field starting from zero.
         * ``from_label``: String. The value for the uniquely identifying field from the first input file.
         * ``to_label``: String. The value for the uniquely identifying field from the second input file.
-        * ``measure``: Float. A measure of the intersected shape. For polygons, this is the area of the feature in square meters. For lines, this is the length in meters. For points, this is the number of points. Area and length calculations are made using the `Mollweide projection <https://en.wikipedia.org/wiki/Mollweide_projection>`__.
+        * ``measure``: Float. A measure of the intersected shape. For polygons, this is the area of the feature in square meters. For lines, this is the length in meters. For points, this is the number of points. Area and length calculations are made using the `Mollweide projection <https://en.wikipedia.org/wiki/Mollweide_projection>`__, unless ``measure_engine`` is ``geodesic``. With ``projected``, they are made directly in the working CRS if it is an equal-area projection, such as the shared CRS of both datasets, and in Mollweide otherwise.
 
     The second file is an extract of some of the feature fields in the JSON data format. This is used by programs that don't need to depend on GIS data libraries. The JSON format is:
 
@@ -210,6 +437,15 @@ def intersect(first_fp, first_field, second_fp, second_field,
         }
 
     """
+    if measure_engine not in MEASURE_ENGINES:
+        raise ValueError("Unknown measure engine: {}".format(measure_engine))
+    if engine not in OVERLAY_ENGINES:
+        raise ValueError("Unknown overlay engine: {}".format(engine))
+    if engine == 'bulk' and not BULK_AVAILABLE:
+        raise ValueError("The ``bulk`` engine requires shapely 2")
+    if tile_size and session is not None:
+        raise ValueError("``session`` can't be used with ``tile_size``")
+
     first, first_metadata = get_map(first_fp, first_field, first_kwargs)
     second, second_metadata = get_map(second_fp, second_field, second_kwargs)
 
@@ -223,59 +459,314 @@ def intersect(first_fp, first_field, second_fp, second_field,
     fiona_fp = base_filepath + driver.lower()
     data_fp = base_filepath + "json"
 
-    if os.path.exists(fiona_fp):
+    first_mapping = first.get_fieldnames_dictionary()
+    second_mapping = second.get_fieldnames_dictionary()
+
+    # Outputs of the previous run are moved to ``previous_dir`` while the new
+    # outputs are written, and put back if the calculation fails
+    previous, previous_dir = None, None
+    if incremental:
+        options = {
+            'measure_engine': measure_engine,
+            'projected': projected,
+            'geometries': geometries,
+        }
+        first_hashes = label_hashes(first, first_mapping)
+        second_hashes = label_hashes(second, second_mapping)
+        hashes_fp, previous = find_previous(
+            dirpath, first_metadata, second_metadata, options
+        )
+        if previous is not None:
+            previous_dir = tempfile.mkdtemp(dir=dirpath)
+            for filename in (os.path.basename(hashes_fp), previous['data'],
+                             previous['vector']):
+                if filename:
+                    shutil.move(os.path.join(dirpath, filename), previous_dir)
+
+    if geometries and os.path.exists(fiona_fp):
         os.remove(fiona_fp)
     if os.path.exists(data_fp):
         os.remove(data_fp)
 
-    data = intersection_dispatcher(first_fp, second_fp, cpus=cpus, log_dir=log_dir)
+    schema = output_schema(first, first_field, second, second_field)
+
+    metrics = {}
+    kwargs = dict(
+        cpus=cpus,
+        log_dir=log_dir,
+        measure_engine=measure_engine,
+        projected=projected,
+        early_stop=early_stop,
+        geometries=geometries,
+        engine=engine,
+        backend=backend,
+        session=session,
+        start_method=start_method,
+        checkpoint_dir=checkpoint_dir,
+        keep_checkpoints=bool(checkpoint_dir),
+        feature_timeout=feature_timeout,
+        max_vertices=max_vertices,
+        metrics=metrics
+    )
 
-    first_mapping = first.get_fieldnames_dictionary()
-    second_mapping = second.get_fieldnames_dictionary()
-    data = {
-        (first_mapping[k[0]], second_mapping[k[1]]): v
-        for k, v in data.items()
-    }
+    def relabel(results):
+        return {
+            (first_mapping[k[0]], second_mapping[k[1]]): v
+            for k, v in results.items()
+        }
+
+    def write(sink, start=0):
+        queue, errors = Queue(maxsize=WRITE_QUEUE_SIZE), []
+        writer = threading.Thread(
+            target=feature_writer,
+            args=(queue, sink, table, errors, start)
+        )
+        writer.start()
+
+        def put(results):
+            # Stop the calculation as soon as the writer fails
+            if errors:
+                raise errors[0]
+            queue.put(relabel(results))
+
+        try:
+            if calculate and tile_size:
+                tiled_dispatcher(
+                    first_fp,
+                    second_fp,
+                    tile_size,
+                    tile_dir=dirpath,
+                    callback=put,
+                    **kwargs
+                )
+            elif calculate:
+                intersection_dispatcher(
+                    first_fp,
+                    second_fp,
+                    callback=put,
+                    **kwargs
+                )
+        finally:
+            queue.put(None)
+            writer.join()
+            if errors:
+                raise errors[0]
+
+    def reuse(sink):
+        """Write the results of the previous run which are still valid."""
+        if previous is None:
+            return 0
+        data = json_importer(os.path.join(previous_dir, previous['data']))
+        rows = data['data']
+        changed = changed_features(
+            previous, first, second, first_hashes, second_hashes, rows
+        )
+        # Features which failed are always tried again
+        changed.update(row['id'] for row in data['metadata'].get('failed', []))
+        keep = set(first_mapping.values()).difference(changed)
+        kwargs['from_objs'] = sorted(
+            index for index, label in first_mapping.items() if label in changed
+        )
+        return write_features(
+            numbered(previous_features(previous_dir, previous, rows, keep)),
+            sink,
+            table
+        )
+
+    table = JSONStreamWriter(data_fp, compress)
+    try:
+        if not geometries:
+            count = reuse(None)
+            calculate = previous is None or kwargs['from_objs']
+            write(None, count)
+            fiona_fp = None
+        else:
+            with fiona.drivers():
+                with fiona.open(
+                        fiona_fp, 'w',
+                        crs=WGS84,
+                        driver=driver,
+                        schema=schema,
+                    ) as sink:
+                    count = reuse(sink)
+                    calculate = previous is None or kwargs['from_objs']
+                    if shard_driver and not tile_size:
+                        with tempfile.TemporaryDirectory(dir=dirpath) as shard_dir:
+                            shards = intersection_dispatcher(
+                                first_fp,
+                                second_fp,
+                                shard_dir=shard_dir,
+                                shard_driver=shard_driver,
+                                **kwargs
+                            ) if calculate else []
+                            write_features(
+                                shard_features(shards, first_mapping,
+                                               second_mapping, count),
+                                sink,
+                                table
+                            )
+                    else:
+                        write(sink, count)
+
+        data_fp = table.close(metadata=output_metadata(
+            first_metadata, second_metadata, first_mapping,
+            metrics.get('failures')
+        ))
+
+        if incremental:
+            json_exporter({
+                'first': dict(first_metadata, hashes=first_hashes),
+                'second': dict(second_metadata, hashes=second_hashes),
+                'options': options,
+                'data': os.path.basename(data_fp),
+                'vector': os.path.basename(fiona_fp) if fiona_fp else None,
+            }, base_filepath + "hashes.json", compress)
+
+        # Only deleted now, so that a failure while writing doesn't lose them
+        for run_dir in metrics.get('checkpoints', []):
+            shutil.rmtree(run_dir, ignore_errors=True)
+    except BaseException:
+        if previous_dir:
+            for filename in os.listdir(previous_dir):
+                os.replace(os.path.join(previous_dir, filename),
+                           os.path.join(dirpath, filename))
+        raise
+    finally:
+        if previous_dir:
+            shutil.rmtree(previous_dir, ignore_errors=True)
+
+    return fiona_fp, data_fp
 
-    schema = {
-        'properties': {
-            'id': 'int',
-            'from_label': first.file.meta['schema']['properties'][first_field],
-            'to_label': second.file.meta['schema']['properties'][second_field],
-            'measure': 'float',
-        },
-        'geometry': 'MultiPolygon',
-    }
 
-    with fiona.drivers():
-        with fiona.open(
-                fiona_fp, 'w',
-                crs=WGS84,
-                driver=driver,
-                schema=schema,
-            ) as sink:
-            for f in as_features(data):
-                sink.write(f)
-
-    data_fp = json_exporter(
+def intersect_many(datasets, dirpath=None, cpus=CPU_COUNT, driver='GeoJSON',
+                   compress=True, log_dir=None, measure_engine='mollweide',
+                   projected=False, early_stop=False, geometries=True):
+    """Calculate the intersection of several vector spatial datasets in one pass.
+
+    ``datasets`` is a list of at least two ``(filepath, field)`` or ``(filepath, field, kwargs)`` tuples, with the same meaning as ``first_fp``, ``first_field`` and ``first_kwargs`` in ``intersect``. The first dataset has the same requirements as the first dataset of ``intersect``, and all others those of the second: they must have polygons, which are assumed not to overlap.
+
+    Each feature of the first dataset is intersected with the second dataset, each of the pieces with the third dataset, and so on, in memory (see ``cascade_dispatcher``). This gives the same results as chaining ``intersect`` and ``intersections_from_intersection``, but each dataset is only read, indexed and projected once, and no intermediate files are written.
+
+    Other input parameters are as in ``intersect``. As there, a feature of the first dataset which fails is tried again with a simplified geometry, and if that fails too, it is left out and listed under ``failed`` in the metadata of the JSON data file.
+
+    Returns filepaths for two created files, named from the hashes of all datasets. If ``geometries`` is False, the first filepath is ``None``.
+
+    The first is a geospatial file with the geometry of each intersection of spatial units from all datasets, in WGS 84. Its schema is:
+
+        * ``id``: Integer. Auto-increment field starting from zero.
+        * ``label_1``, ``label_2``, ...: The value for the uniquely identifying field of each dataset, in the order of ``datasets``.
+        * ``measure``: Float. A measure of the intersected shape, as in ``intersect``.
+
+    The second file is in the JSON data format of ``intersect``, but its metadata lists the metadata of each dataset in ``datasets``, and each row has the labels of all datasets, followed by the measure:
+
+    .. code-block:: python
+
         {
-            'data': [(k[0], k[1], v['measure']) for k, v in data.items()],
-            'metadata':
-                {
-                    'first': first_metadata,
-                    'second': second_metadata,
-                    'when': datetime.datetime.now().isoformat(),
-                }
-        },
-        data_fp,
-        compress=compress
+            'metadata': {
+                'datasets': [
+                    {
+                        'field': 'name of uniquely identifying field',
+                        'path': 'path to input file',
+                        'filename': 'name of input file',
+                        'sha256': 'sha256 hash of input file'
+                    },
+                    ...
+                ],
+                'when': 'datetime this calculation finished, ISO format'
+            },
+            'data': [
+                [
+                    'identifying field for first file',
+                    'identifying field for second file',
+                    ...
+                    'measure value'
+                ]
+            ]
+        }
+
+    """
+    if len(datasets) < 2:
+        raise ValueError("At least two datasets are needed")
+    if measure_engine not in MEASURE_ENGINES:
+        raise ValueError("Unknown measure engine: {}".format(measure_engine))
+
+    maps, metadata = zip(*[
+        get_map(dataset[0], dataset[1], dataset[2] if len(dataset) > 2 else {})
+        for dataset in datasets
+    ])
+    mappings = [obj.get_fieldnames_dictionary() for obj in maps]
+    labels = ["label_{}".format(index) for index in range(1, len(maps) + 1)]
+
+    if not dirpath:
+        dirpath = get_appdirs_path("intersections")
+
+    base_filepath = os.path.join(dirpath, ".".join(obj.hash for obj in maps) + ".")
+    data_fp = base_filepath + "json"
+
+    metrics = {}
+    results = cascade_dispatcher(
+        datasets[0][0],
+        [dataset[0] for dataset in datasets[1:]],
+        cpus=cpus,
+        log_dir=log_dir,
+        metrics=metrics,
+        measure_engine=measure_engine,
+        projected=projected,
+        early_stop=early_stop,
+        geometries=geometries,
     )
 
+    def features():
+        for index, key in enumerate(sorted(results)):
+            row = results[key]
+            properties = {'id': index}
+            properties.update({
+                label: names[obj_index]
+                for label, names, obj_index in zip(labels, mappings, key)
+            })
+            properties['measure'] = row['measure']
+            yield {
+                'geometry': mapping(row['geom']) if 'geom' in row else None,
+                'properties': properties,
+            }
+
+    table = JSONStreamWriter(data_fp, compress)
+    if geometries:
+        fiona_fp = base_filepath + driver.lower()
+        if os.path.exists(fiona_fp):
+            os.remove(fiona_fp)
+        properties = {'id': 'int'}
+        properties.update({
+            label: obj.file.meta['schema']['properties'][obj.fieldname]
+            for label, obj in zip(labels, maps)
+        })
+        properties['measure'] = 'float'
+        schema = {
+            'properties': properties,
+            'geometry': MULTI_TYPES[kind_mapping[maps[0].geometry]],
+        }
+        with fiona.open(fiona_fp, 'w', crs=WGS84, driver=driver,
+                        schema=schema) as sink:
+            write_features(features(), sink, table, labels=labels)
+    else:
+        fiona_fp = None
+        write_features(features(), None, table, labels=labels)
+
+    output = {
+        'datasets': list(metadata),
+        'when': datetime.datetime.now().isoformat(),
+    }
+    if metrics['failures']:
+        output['failed'] = [
+            dict(row, id=mappings[0][row['index']]) for row in metrics['failures']
+        ]
+    data_fp = table.close(metadata=output)
     return fiona_fp, data_fp
 
 
 def calculate_remaining(source_fp, source_field, intersection_fp,
-        source_kwargs={}, dirpath=None, compress=True):
+        source_kwargs={}, dirpath=None, compress=True,
+        measure_engine='mollweide'):
     """Calculate the remaining area/length/number of points left out of an intersections file generated by ``intersect``.
 
     Input parameters:
@@ -286,6 +777,7 @@ def calculate_remaining(source_fp, source_field, intersection_fp,
         * ``source_kwargs``: Dictionary, optional. Additional arguments, such as layer name, passed to fiona when opening the input spatial dataset.
         * ``dirpath``: String, optional. Directory where the output file will be saved.
         * ``compress``: Boolean. Whether or not to compress the output file.
+        * ``measure_engine``: String, default is ``mollweide``. How remaining areas and lengths are calculated; see ``intersect``.
 
     .. warning:: ``source_fp`` must be the first file provided to the ``intersect`` function, **not** the second!
 
@@ -332,22 +824,23 @@ def calculate_remaining(source_fp, source_field, intersection_fp,
     output = os.path.join(dirpath, "{}.{}.json".format(source.hash, intersections.hash)
     )
 
-    _ = partial(project, from_proj=source.crs, to_proj='')
-
-    def get_geoms(feat):
+    def get_geoms(label):
         return [
             shape(x['geometry'])
             for x in intersections
-            if (x['properties']['from_label'] ==
-                feat['properties'][source_field])
+            if x['properties']['from_label'] == label
         ]
 
+    # Source features are projected to WGS84 in batches
+    labels = source.get_fieldnames_dictionary(source_field)
     data = [(
-            feat['properties'][source_field],
+            labels[index],
             get_remaining(
-                _(shape(feat['geometry'])), get_geoms(feat)
+                geom,
+                get_geoms(labels[index]),
+                measure_engine=measure_engine
             )
-        ) for feat in source
+        ) for index, geom in source.iter_latlong()
     ]
 
     metadata = {
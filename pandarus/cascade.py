@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+from .geometry import get_intersection, kind_mapping
+from .intersections import (
+    borrow_to_maps,
+    close_pool,
+    create_pool,
+    feature_summary,
+    get_jobs,
+    isolate_feature,
+    load_to_map,
+    logger_init,
+    logger_stop,
+    partition_jobs,
+    release_to_map,
+    spatial_order,
+)
+from .maps import Map, CACHE_SIZE
+from .projection import get_working_crs, project_many
+import logging
+
+
+def cascade_worker(from_map, from_objs, to_maps, worker_id=1,
+                   measure_engine='mollweide', projected=False,
+                   cache_size=CACHE_SIZE, early_stop=False, geometries=True,
+                   failures=None):
+    """Multiprocessing worker for the overlay of ``from_map`` with each map in the list ``to_maps`` in turn.
+
+    Each feature of ``from_map`` is intersected with the first map in ``to_maps``; each of the resulting pieces is then intersected with the second map, and so on, all in memory. Every map in ``to_maps`` and its spatial index are loaded with ``load_to_map``, i.e. only once per process, and released on return if the worker loaded them itself outside of a pool; see ``borrow_to_maps``. Only the pieces left after the last map are measured.
+
+    ``measure_engine``, ``projected``, ``cache_size``, ``early_stop``, ``geometries`` and ``failures`` are as in ``intersection_worker``. With ``projected``, the working CRS is chosen from the CRS of all maps. A feature of ``from_map`` which fails is retried and skipped as a whole; see ``isolate_feature``.
+
+    Returns a dictionary of form:
+
+    .. code-block:: python
+
+        {
+            (from index, first to index, second to index, ...): {
+                'measure': measure of area or length,
+                'geom': intersected geometry # if geometries
+            }
+        }
+
+    """
+    logging.info("""Starting cascade_worker:
+    from map: {}
+    from objs: {}
+    to maps: {}
+    worker id: {}""".format(from_map, len(from_objs or []) or 'all',
+                            to_maps, worker_id))
+
+    from_map = Map(from_map)
+    try:
+        kind = kind_mapping[from_map.geometry]
+    except KeyError:
+        raise ValueError("No valid geometry type in map {}".format(from_map))
+
+    with borrow_to_maps(to_maps):
+        if projected:
+            working_crs = get_working_crs(from_map.crs, *[
+                load_to_map(fp, None, cache_size)[0].crs for fp in to_maps
+            ])
+        else:
+            working_crs = None
+        stages = [load_to_map(fp, working_crs or '', cache_size) for fp in to_maps]
+
+        logging.info("Worker {}: Loaded maps.".format(worker_id))
+
+        def cascade(from_index, from_geom):
+            if from_geom.is_empty:
+                return {}
+            pieces = {(from_index,): from_geom}
+            for stage, (to_map, rtree_index) in enumerate(stages):
+                last = stage == len(stages) - 1
+                found = {}
+                for key, piece in pieces.items():
+                    with to_map.lock:
+                        candidates = list(rtree_index.intersection(piece.bounds))
+
+                    for index, value in get_intersection(
+                        piece,
+                        kind,
+                        to_map,
+                        candidates,
+                        to_meters=last,
+                        return_geoms=geometries or not last,
+                        measure_engine=measure_engine,
+                        working_crs=working_crs,
+                        early_stop=early_stop,
+                    ).items():
+                        found[key + (index,)] = value if last else value['geom']
+                pieces = found
+            return pieces
+
+        results = {}
+        for from_index, from_geom in from_map.iter_projected(working_crs or '', from_objs or None):
+            results.update(isolate_feature(
+                cascade, from_index, from_geom, failures, worker_id
+            ))
+
+        if working_crs is not None and geometries:
+            geoms = project_many(
+                (v['geom'] for v in results.values()), working_crs, ''
+            )
+            for v, geom in zip(results.values(), geoms):
+                v['geom'] = geom
+
+        return results
+
+
+def _cascade_job(args):
+    from_map, from_objs, to_maps, kwargs = args
+    failures = []
+    results = cascade_worker(from_map, from_objs, to_maps, failures=failures, **kwargs)
+    return results, failures
+
+
+def cascade_dispatcher(from_map, to_maps, from_objs=None, cpus=None,
+                       log_dir=None, start_method=None, metrics=None, **kwargs):
+    """Calculate the overlay of ``from_map`` with all of ``to_maps`` using a pool of ``cpus`` workers.
+
+    Features of ``from_map`` are sorted along a Hilbert curve, and split into jobs of similar estimated cost against the first of ``to_maps``, as in ``intersection_dispatcher``. Each job runs ``cascade_worker``. All ``to_maps`` and their spatial indices are loaded before the pool is started, so forked workers share them; workers started with another ``start_method`` load them when they start.
+
+    Features which fail are retried with a simplified geometry, and skipped if they fail again, without stopping the other features; see ``isolate_feature``. They are logged, and returned as ``metrics['failures']``.
+
+    If ``metrics`` is a dictionary, it is updated with the number of jobs and the features which failed.
+
+    Additional ``kwargs`` are passed to ``cascade_worker``. Returns its results for all features."""
+    failures = []
+    if not cpus:
+        try:
+            results = cascade_worker(
+                from_map, from_objs, to_maps, failures=failures, **kwargs
+            )
+        finally:
+            for fp in to_maps:
+                release_to_map(fp)
+        if metrics is not None:
+            metrics['failures'] = failures
+        return results
+
+    if from_objs:
+        ids = from_objs
+    else:
+        ids = range(len(Map(from_map)))
+    _, num_jobs = get_jobs(len(ids))
+
+    if kwargs.get('projected'):
+        working_crs = get_working_crs(Map(from_map).crs, *[
+            load_to_map(fp, None)[0].crs for fp in to_maps
+        ])
+    else:
+        working_crs = None
+
+    results = {}
+    queue_listener, logging_queue = logger_init(log_dir, start_method)
+    try:
+        # Load the ``to`` maps and indices before starting the pool; forked
+        # workers then share them instead of building their own
+        indices = [load_to_map(fp, working_crs or '')[1] for fp in to_maps]
+        centers, costs = feature_summary(from_map, ids, working_crs or '', indices[0])
+        costs = dict(zip(ids, costs))
+        ids = spatial_order(from_map, ids, centers=centers)
+        jobs = partition_jobs(ids, [costs[index] for index in ids], num_jobs)
+        logging.info("""Starting `intersect_many` calculation.
+    From map: {}
+    To maps: {}
+    Map size: {}
+    Number of jobs: {}""".format(from_map, to_maps, len(ids), len(jobs)))
+
+        pool = create_pool('processes', cpus, logging_queue, start_method,
+                           [(fp, working_crs or '') for fp in to_maps])
+        done = False
+        try:
+            for data, job_failures in pool.imap_unordered(_cascade_job, [
+                (from_map, chunk, to_maps, kwargs) for _, chunk in jobs
+            ]):
+                results.update(data)
+                failures.extend(job_failures)
+            done = True
+        except Exception:
+            logging.exception("Cascade job failed.")
+            raise ValueError("Couldn't complete Pandarus task")
+        finally:
+            close_pool(pool, terminate=not done)
+    finally:
+        logger_stop(queue_listener)
+        for fp in to_maps:
+            release_to_map(fp)
+
+    failures.sort(key=lambda row: row['index'])
+    if failures:
+        logging.warning("{} features failed: {}".format(
+            len(failures), [row['index'] for row in failures]
+        ))
+    if metrics is not None:
+        metrics.update({'jobs': len(jobs), 'failures': failures})
+    return results
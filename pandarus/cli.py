@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""Command line interface to run ``intersect`` calculations split over several machines.
+
+Usage:
+
+    pandarus manifest FIRST FIRST_FIELD SECOND SECOND_FIELD --shards N
+    pandarus run-shard MANIFEST SHARD_ID
+    pandarus merge MANIFEST
+
+See ``pandarus <command> --help`` for the options of each command."""
+from .calculate import CPU_COUNT
+from .geometry import MEASURE_ENGINES, OVERLAY_ENGINES
+from .manifest import (
+    create_manifest,
+    get_shard,
+    load_manifest,
+    merge_manifest,
+    run_shard,
+)
+import argparse
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        prog="pandarus",
+        description="Split an ``intersect`` calculation into shards, run "
+                    "them on any machine, and merge the results."
+    )
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+
+    manifest = commands.add_parser(
+        "manifest", help="Write a manifest which splits the calculation into shards"
+    )
+    manifest.add_argument("first", help="Filepath of the first dataset")
+    manifest.add_argument("first_field", help="Identifying field of the first dataset")
+    manifest.add_argument("second", help="Filepath of the second dataset")
+    manifest.add_argument("second_field", help="Identifying field of the second dataset")
+    manifest.add_argument("--shards", type=int, required=True,
+                          help="Approximate number of shards")
+    manifest.add_argument("--dirpath", help="Directory of the manifest")
+    manifest.add_argument("--driver", default="GeoJSON",
+                          help="Fiona driver of the geospatial output file")
+    manifest.add_argument("--no-compress", dest="compress", action="store_false",
+                          help="Don't compress the JSON data file")
+    manifest.add_argument("--measure-engine", default="mollweide",
+                          choices=MEASURE_ENGINES)
+    manifest.add_argument("--projected", action="store_true")
+    manifest.add_argument("--early-stop", action="store_true")
+    manifest.add_argument("--no-geometries", dest="geometries",
+                          action="store_false",
+                          help="Only calculate measures")
+    manifest.add_argument("--engine", default="rtree", choices=OVERLAY_ENGINES)
+    manifest.add_argument("--feature-timeout", type=float)
+    manifest.add_argument("--max-vertices", type=int)
+
+    shard = commands.add_parser("run-shard", help="Calculate one shard of a manifest")
+    shard.add_argument("manifest", help="Filepath of the manifest")
+    shard.add_argument("shard_id", type=int, help="Shard number")
+    shard.add_argument("--cpus", type=int, default=CPU_COUNT)
+    shard.add_argument("--first", help="Filepath of the first dataset on this machine")
+    shard.add_argument("--second", help="Filepath of the second dataset on this machine")
+    shard.add_argument("--output-dir", help="Directory of the shard results")
+    shard.add_argument("--log-dir")
+
+    merge = commands.add_parser("merge", help="Merge the shards of a manifest")
+    merge.add_argument("manifest", help="Filepath of the manifest")
+    merge.add_argument("--shard-dir", help="Directory of the shard results")
+    merge.add_argument("--dirpath", help="Directory of the output files")
+    merge.add_argument("--first", help="Filepath of the first dataset on this machine")
+    merge.add_argument("--second", help="Filepath of the second dataset on this machine")
+    return parser
+
+
+def main(argv=None):
+    parser = get_parser()
+    args = parser.parse_args(argv)
+    if args.command == "manifest":
+        print(create_manifest(
+            args.first, args.first_field, args.second, args.second_field,
+            args.shards,
+            dirpath=args.dirpath,
+            driver=args.driver,
+            compress=args.compress,
+            measure_engine=args.measure_engine,
+            projected=args.projected,
+            early_stop=args.early_stop,
+            geometries=args.geometries,
+            engine=args.engine,
+            feature_timeout=args.feature_timeout,
+            max_vertices=args.max_vertices,
+        ))
+    elif args.command == "run-shard":
+        try:
+            get_shard(load_manifest(args.manifest), args.shard_id)
+        except ValueError as error:
+            parser.error(str(error))
+        print(run_shard(
+            args.manifest, args.shard_id,
+            cpus=args.cpus,
+            first_fp=args.first,
+            second_fp=args.second,
+            output_dir=args.output_dir,
+            log_dir=args.log_dir,
+        ))
+    else:
+        for filepath in merge_manifest(
+                args.manifest,
+                shard_dir=args.shard_dir,
+                dirpath=args.dirpath,
+                first_fp=args.first,
+                second_fp=args.second):
+            if filepath:
+                print(filepath)
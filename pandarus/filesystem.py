@@ -35,6 +35,41 @@ def json_exporter(data, filepath, compress=True):
     return filepath
 
 
+class JSONStreamWriter(object):
+    """Write a JSON object with a ``data`` list one row at a time, instead of building the whole object in memory first. Compressed with ``bz2`` if ``compress``.
+
+    Rows are encoded and compressed as they are written. Other keys of the object are given to ``close``. The resulting file can be read with ``json_importer``."""
+    def __init__(self, filepath, compress=True):
+        if compress:
+            filepath += ".bz2"
+            self.file = bz2.open(filepath, "wt", encoding="utf-8")
+        else:
+            self.file = codecs.open(filepath, "w", encoding="utf-8")
+        self.filepath = filepath
+        self.count = 0
+        self.file.write('{"data": [')
+
+    def write(self, rows):
+        for row in rows:
+            if self.count:
+                self.file.write(", ")
+            self.file.write(json.dumps(row, ensure_ascii=False))
+            self.count += 1
+
+    def close(self, **kwargs):
+        """Write the other keys of the JSON object, and close the file.
+
+        Returns the filepath of the JSON file, as in ``json_exporter``."""
+        self.file.write("]")
+        for key, value in kwargs.items():
+            self.file.write(", {}: {}".format(
+                json.dumps(key), json.dumps(value, ensure_ascii=False)
+            ))
+        self.file.write("}")
+        self.file.close()
+        return self.filepath
+
+
 def json_importer(fp):
     """Load a JSON file. Can be compressed with ``bz2`` - if so, it should have the extension ``.bz2``.
 
@@ -1,4 +1,5 @@
-from .projection import project
+from .projection import MOLLWEIDE, is_equal_area, project_many
+from pyproj import Geod
 from shapely.geometry import (
     GeometryCollection,
     LinearRing,
@@ -8,8 +9,13 @@ from shapely.geometry import (
     MultiPolygon,
     Point,
     Polygon,
+    box,
 )
-from shapely.ops import cascaded_union
+from shapely.ops import unary_union
+from shapely.prepared import prep
+import numpy as np
+import shapely
+import time
 
 
 kind_mapping = {
@@ -22,12 +28,42 @@ kind_mapping = {
     'MultiPoint': 'point',
 }
 
+# Engines for measuring area and length of geometries in WGS84.
+# ``mollweide`` projects to Mollweide and measures in the plane; ``geodesic``
+# measures directly on the WGS84 ellipsoid.
+MEASURE_ENGINES = ('mollweide', 'geodesic')
+
+GEOD = Geod(ellps='WGS84')
+
+# Engines for finding intersections. ``rtree`` tests each feature against its
+# spatial index candidates with ``get_intersection``; ``bulk`` uses the
+# vectorized functions of shapely 2 in ``get_intersections_bulk``.
+OVERLAY_ENGINES = ('rtree', 'bulk')
+
+BULK_AVAILABLE = int(shapely.__version__.split('.')[0]) >= 2
+
+# Shapely geometry type ids of the single and multi geometries of each kind
+KIND_TYPE_IDS = {
+    'point': (0, 4),
+    'line': (1, 5),
+    'polygon': (3, 6),
+}
+
+
+# Tolerance of ``simplify``, relative to the size of the simplified geometry
+SIMPLIFY_TOLERANCE = 1e-5
+
 
 class IncompatibleTypes(Exception):
     """Geometry comparison across geometry types is meaningless"""
     pass
 
 
+class FeatureTimeout(Exception):
+    """Calculating the intersections of a feature went over its time limit"""
+    pass
+
+
 def clean(geom):
     """Clean invalid geometries using ``buffer(0)`` trick.
 
@@ -37,6 +73,21 @@ def clean(geom):
     return geom if geom.is_valid else GeometryCollection([])
 
 
+def simplify(geom, tolerance=SIMPLIFY_TOLERANCE):
+    """Simplify ``geom``, to retry a calculation which failed or took too long.
+
+    Coordinates are snapped to a grid (only with shapely 2), and ``geom`` is simplified without changing its topology. Both use ``tolerance`` times the largest side of the bounds of ``geom``.
+
+    ``geom`` is a shapely geometry; returns a valid shapely geometry."""
+    if geom.is_empty:
+        return geom
+    minx, miny, maxx, maxy = geom.bounds
+    size = max(maxx - minx, maxy - miny) * tolerance
+    if BULK_AVAILABLE:
+        geom = shapely.set_precision(geom, size)
+    return clean(geom.simplify(size, preserve_topology=True))
+
+
 def recursive_geom_finder(geom, kind):
     """Return all elements of ``geom`` that are of ``kind``. For example, return all linestrings in a geometry collection.
 
@@ -62,7 +113,7 @@ def recursive_geom_finder(geom, kind):
         if isinstance(geom, types):
             yield geom
         elif isinstance(geom, GeometryCollection):
-            for elem in geom:
+            for elem in geom.geoms:
                 for val in recurse(elem, types):
                     yield val
         else:
@@ -73,26 +124,92 @@ def recursive_geom_finder(geom, kind):
     if not elements:
         return None
     else:
-        geom = clean(cascaded_union(elements))
-        if 'Multi' not in geom.type:
+        geom = clean(unary_union(elements))
+        if 'Multi' not in geom.geom_type:
             geom = CONTAINER[kind]([geom])
         return geom
 
 
+def subdivide(geom, kind, max_vertices, max_depth=16):
+    """Split ``geom`` on a quadtree grid until each piece has at most ``max_vertices`` vertices.
+
+    The bounds of ``geom`` are split in four quadrants, or in two halves across its length if ``geom`` is more than twice as long as it is wide, and each piece of ``geom`` which is still too large, but has fewer vertices than ``geom``, is split again, at most ``max_depth`` times. Pieces only share their edges, so the measures of their intersections with another geometry add up to the measure of the intersection with ``geom``, except for lines which lie exactly on a split.
+
+    ``kind`` is ``line`` or ``polygon``. Returns a list of geometries of ``kind``, as given by ``recursive_geom_finder``."""
+    assert kind in ("line", "polygon"), "Invalid ``kind``"
+    return _subdivide(geom, count_vertices(geom), kind, max_vertices, max_depth)
+
+
+def _subdivide(geom, vertices, kind, max_vertices, max_depth):
+    if max_depth == 0 or vertices <= max_vertices:
+        return [geom]
+    minx, miny, maxx, maxy = geom.bounds
+    width, height = maxx - minx, maxy - miny
+    # Outer edges of the pieces are moved out, so that geometries on the
+    # bounds are not lost
+    margin = max(width, height)
+    xs = (minx - margin, maxx + margin)
+    ys = (miny - margin, maxy + margin)
+    # Long and thin geometries are only split across their length
+    if width * 2 >= height:
+        xs = (xs[0], (minx + maxx) / 2, xs[1])
+    if height * 2 >= width:
+        ys = (ys[0], (miny + maxy) / 2, ys[1])
+    pieces = []
+    for i in range(len(xs) - 1):
+        for j in range(len(ys) - 1):
+            piece = clean(geom.intersection(box(xs[i], ys[j], xs[i + 1], ys[j + 1])))
+            # Quadrants which miss ``geom`` give empty geometries, which can't
+            # be parts of a multi geometry
+            if piece.is_empty:
+                continue
+            piece = recursive_geom_finder(piece, kind)
+            if not piece:
+                continue
+            # Pieces which are not smaller than ``geom`` are not split again
+            count = count_vertices(piece)
+            if count < vertices:
+                pieces.extend(_subdivide(piece, count, kind, max_vertices, max_depth - 1))
+            else:
+                pieces.append(piece)
+    return pieces
+
+
+def _engine(to_meters, measure_engine, working_crs):
+    """Engine for ``get_measures`` of geometries in ``working_crs``. The ``mollweide`` engine measures directly in ``working_crs`` if it is equal-area, and projects to Mollweide otherwise."""
+    if not to_meters:
+        return None
+    elif (working_crs is not None and measure_engine == 'mollweide' and
+            is_equal_area(working_crs)):
+        return None
+    return measure_engine
+
+
 def get_intersection(obj, kind, collection, indices,
                      to_meters=True,
-                     return_geoms=True):
+                     return_geoms=True,
+                     measure_engine='mollweide',
+                     working_crs=None,
+                     early_stop=False,
+                     tolerance=1e-6,
+                     deadline=None):
     """Return a dictionary describing the intersection of ``obj`` with ``collection[indices]``.
 
     ``obj`` is a Shapely geometry.
     ``kind`` is one of ``("line", "point", "polygon")`` - the kind of object to be returned.
     ``collection`` is a ``Map``.
     ``indices`` is an iterator of integers; indices into ``collection``.
-    ``projection_func`` is a function to project the results to a new CRS before taking area, etc. If falsey, no projection will take place.
+    ``to_meters``: Measure results with ``measure_engine``. If falsey, measures are taken in the CRS of ``obj``.
     ``return_geoms``: Return intersected geometries in addition to area, etc.
+    ``measure_engine``: One of ``MEASURE_ENGINES``; see ``get_measures``.
+    ``working_crs``: ``PROJ4`` string, optional. If given, ``obj`` is in this CRS, geometries from ``collection`` are projected to it, and returned geometries are also in this CRS. With the ``mollweide`` engine, measures are taken directly in ``working_crs`` if it is an equal-area projection (see ``is_equal_area``), and in Mollweide otherwise.
+    ``early_stop``: Stop testing candidates once the intersections found account for all of ``obj``, within the relative ``tolerance``. Candidates are tested in order of decreasing bounding box overlap with ``obj``, so that this happens as early as possible.
+    ``deadline``: Time, in seconds since the epoch, optional. Raise ``FeatureTimeout`` if still testing candidates after this time. Checked before each candidate, so a single overlay is never interrupted.
 
     Assumes that the polygons in ``collection`` do not overlap.
 
+    ``obj`` is prepared once, and two cases skip the overlay entirely: if a polygon in ``collection`` contains ``obj``, the result is all of ``obj``; if ``obj`` contains a polygon in ``collection``, the result is that polygon, and its measure is stored in ``collection.measures`` for reuse.
+
     Returns a dictionary of form:
 
     .. code-block:: python
@@ -109,27 +226,217 @@ def get_intersection(obj, kind, collection, indices,
     """
     assert kind in ("line", "point", "polygon"), "Invalid ``kind``"
 
-    proj_func = project if to_meters else lambda x: x
     obj = clean(obj)
+    if obj.is_empty:
+        return {}
+    prepared = prep(obj)
+    # Bounds are calculated from all coordinates each time they are accessed
+    bounds = obj.bounds
+    whole = None
 
-    results = {}
+    engine = _engine(to_meters, measure_engine, working_crs)
 
-    for index, geom in collection.iter_latlong(indices):
-        if not geom.intersects(obj):
-            continue
-        g = recursive_geom_finder(
-            clean(obj.intersection(geom)),
-            kind
+    geoms, measures, contained = {}, {}, set()
+
+    if working_crs is None:
+        candidates = collection.iter_latlong(indices)
+    else:
+        candidates = collection.iter_projected(working_crs, indices)
+
+    if early_stop:
+        candidates = sorted(
+            candidates,
+            key=lambda x: _bounds_overlap(x[1].bounds, bounds),
+            reverse=True
         )
+        whole = recursive_geom_finder(obj, kind)
+        # Measures are additive in any CRS, so the check is done in the
+        # CRS of ``obj``, without projection
+        remaining = get_measure(whole, kind) * (1 - tolerance) if whole else 0
+
+    for index, geom in candidates:
+        if early_stop and remaining <= 0:
+            break
+        if deadline is not None and time.time() > deadline:
+            raise FeatureTimeout("Time limit exceeded after {} intersections".format(
+                len(geoms)
+            ))
+        if not prepared.intersects(geom):
+            continue
+        if _bounds_contain(geom.bounds, bounds) and geom.contains(obj):
+            if whole is None:
+                whole = recursive_geom_finder(obj, kind)
+            g = whole
+        elif (kind == 'polygon' and
+                _bounds_contain(bounds, geom.bounds) and
+                prepared.contains(geom)):
+            g = recursive_geom_finder(geom, kind)
+            key = (index, engine, working_crs)
+            if key in collection.measures:
+                measures[index] = collection.measures[key]
+            else:
+                contained.add(index)
+        else:
+            g = recursive_geom_finder(
+                clean(obj.intersection(geom)),
+                kind
+            )
         if not g:
             continue
-        results[index] = {'measure': get_measure(proj_func(g), kind)}
+        geoms[index] = g
+        if early_stop:
+            remaining -= get_measure(g, kind)
+
+    missing = [index for index in geoms if index not in measures]
+    for index, measure in zip(missing, get_measures(
+            (geoms[index] for index in missing), kind, engine, working_crs)):
+        measures[index] = measure
+        if index in contained:
+            collection.measures[(index, engine, working_crs)] = measure
+
+    results = {}
+
+    for index, g in geoms.items():
+        results[index] = {'measure': measures[index]}
         if return_geoms:
             results[index]['geom'] = g
 
     return results
 
 
+def _bounds_overlap(first, second):
+    """Size of the overlap of two bounding boxes, as ``(area, width + height)``."""
+    width = max(0, min(first[2], second[2]) - max(first[0], second[0]))
+    height = max(0, min(first[3], second[3]) - max(first[1], second[1]))
+    return (width * height, width + height)
+
+
+def _bounds_contain(outer, inner):
+    """Test if bounding box ``outer`` contains bounding box ``inner``."""
+    return (outer[0] <= inner[0] and outer[1] <= inner[1] and
+            outer[2] >= inner[2] and outer[3] >= inner[3])
+
+
+def _clean_all(geoms):
+    """Vectorized ``clean`` of a NumPy array of geometries."""
+    invalid = ~shapely.is_valid(geoms)
+    if invalid.any():
+        geoms = geoms.copy()
+        geoms[invalid] = shapely.buffer(geoms[invalid], 0)
+        geoms[~shapely.is_valid(geoms)] = GeometryCollection([])
+    return geoms
+
+
+def _as_kind(geoms, kind):
+    """Vectorized ``recursive_geom_finder``.
+
+    Single geometries of ``kind`` are converted to multi geometries with one call. Geometry collections and linear rings fall back to ``recursive_geom_finder``. Returns a NumPy array with ``None`` where no element of ``kind`` was found."""
+    single_id, multi_id = KIND_TYPE_IDS[kind]
+    type_ids = shapely.get_type_id(geoms)
+    present = ~shapely.is_empty(geoms)
+    result = np.full(len(geoms), None, dtype=object)
+
+    single = present & (type_ids == single_id)
+    if single.any():
+        constructor = {
+            'point': shapely.multipoints,
+            'line': shapely.multilinestrings,
+            'polygon': shapely.multipolygons,
+        }[kind]
+        result[single] = constructor(
+            geoms[single], indices=np.arange(single.sum())
+        )
+    multi = present & (type_ids == multi_id)
+    result[multi] = geoms[multi]
+
+    for index in np.nonzero(present & np.isin(type_ids, (2, 7)))[0]:
+        result[index] = recursive_geom_finder(geoms[index], kind)
+    return result
+
+
+def _bulk_measures(geoms, kind, engine=None, crs=None):
+    """Vectorized ``get_measures`` of a NumPy array of geometries. Returns a NumPy array."""
+    if kind == 'point':
+        return shapely.get_num_geometries(geoms).astype(float)
+    if engine == 'geodesic':
+        return np.array(get_geodesic_measures(project_many(geoms, crs, ''), kind))
+    elif engine == 'mollweide':
+        geoms = np.array(project_many(geoms, crs, MOLLWEIDE), dtype=object)
+    return shapely.area(geoms) if kind == 'polygon' else shapely.length(geoms)
+
+
+def get_intersections_bulk(objs, kind, collection,
+                           to_meters=True,
+                           return_geoms=True,
+                           measure_engine='mollweide',
+                           working_crs=None):
+    """Vectorized version of ``get_intersection`` for many objects at once. Requires shapely 2.
+
+    ``objs`` is an iterable of ``(index, geometry)`` tuples, such as given by ``Map.iter_latlong``. ``kind``, ``collection``, and the other arguments are as in ``get_intersection``.
+
+    All geometries of ``collection`` are indexed in a shapely ``STRtree``, which is built once per CRS and kept in ``collection.bulk_indices``. All ``objs`` are then queried with one call, and intersections, geometry types, and measures are calculated with vectorized functions over the arrays of candidate pairs. Pairs where the ``collection`` geometry contains the object skip the overlay, as in ``get_intersection``.
+
+    Returns a dictionary of form:
+
+    .. code-block:: python
+
+        {
+            (obj_index, collection_index): {
+                'measure': measure of area or length,
+                'geom': intersected geometry # if return_geoms
+            }
+        }
+
+    """
+    assert kind in ("line", "point", "polygon"), "Invalid ``kind``"
+    if not BULK_AVAILABLE:
+        raise ValueError("The ``bulk`` engine requires shapely 2")
+
+    to_proj = working_crs or ''
+    with collection.lock:
+        if to_proj not in collection.bulk_indices:
+            features = list(collection.iter_projected(to_proj))
+            indices = np.array([index for index, _ in features], dtype=np.int64)
+            geoms = np.array([geom for _, geom in features], dtype=object)
+            shapely.prepare(geoms)
+            collection.bulk_indices[to_proj] = (
+                indices, geoms, shapely.STRtree(geoms)
+            )
+        to_indices, to_geoms, tree = collection.bulk_indices[to_proj]
+
+    objs = list(objs)
+    if not objs:
+        return {}
+    obj_indices = np.array([index for index, _ in objs])
+    obj_geoms = _clean_all(np.array([geom for _, geom in objs], dtype=object))
+
+    first, second = tree.query(obj_geoms, predicate='intersects')
+    left, right = obj_geoms[first], to_geoms[second]
+
+    within = shapely.contains(right, left)
+    overlay = np.empty(len(first), dtype=object)
+    overlay[within] = left[within]
+    overlay[~within] = _clean_all(shapely.intersection(left[~within], right[~within]))
+
+    geoms = _as_kind(overlay, kind)
+    found = np.array([geom is not None for geom in geoms], dtype=bool)
+    if not found.any():
+        return {}
+    first, second, geoms = first[found], second[found], geoms[found]
+
+    engine = _engine(to_meters, measure_engine, working_crs)
+    measures = _bulk_measures(geoms, kind, engine, working_crs)
+
+    results = {}
+    for i, (obj_index, index, measure) in enumerate(zip(
+            obj_indices[first].tolist(), to_indices[second].tolist(),
+            measures.tolist())):
+        results[(obj_index, index)] = {'measure': measure}
+        if return_geoms:
+            results[(obj_index, index)]['geom'] = geoms[i]
+    return results
+
+
 def get_measure(geom, kind=None):
     """Get area, length, or number of points in ``geom``.
 
@@ -150,7 +457,7 @@ def get_measure(geom, kind=None):
         return geom.length
     elif kind == 'point':
         if geom.geom_type == 'MultiPoint':
-            return float(len(geom))
+            return float(len(geom.geoms))
         elif geom.geom_type == 'Point':
             return 1.
     raise ValueError(
@@ -158,12 +465,105 @@ def get_measure(geom, kind=None):
     )
 
 
-def get_remaining(original, geoms, to_meters=True):
+def _parts(geom, types):
+    """Yield all elements of ``geom`` whose geometry type is in ``types``."""
+    if geom.is_empty:
+        return
+    if geom.geom_type in types:
+        yield geom
+    elif hasattr(geom, 'geoms'):
+        for part in geom.geoms:
+            yield from _parts(part, types)
+
+
+def count_vertices(geom):
+    """Count the vertices in all the elements of ``geom``."""
+    total = 0
+    for part in _parts(geom, ('Point', 'LineString', 'LinearRing', 'Polygon')):
+        if part.geom_type == 'Polygon':
+            total += len(part.exterior.coords)
+            total += sum(len(ring.coords) for ring in part.interiors)
+        else:
+            total += len(part.coords)
+    return total
+
+
+def _ring_area(ring):
+    lons, lats = ring.xy
+    return abs(GEOD.polygon_area_perimeter(lons, lats)[0])
+
+
+def get_geodesic_measures(geoms, kind):
+    """Get area or length of each of ``geoms`` on the WGS84 ellipsoid.
+
+    * ``geoms``: Iterable of shapely geoms in WGS84 CRS.
+    * ``kind``: One of `polygon` or `line`.
+
+    Line lengths are calculated with a single geodesic call for all the segments of all ``geoms``. Polygon areas are calculated ring by ring, with one ``Geod.polygon_area_perimeter`` call each, as ``pyproj`` has no vectorized polygon area; this is slower than the ``mollweide`` engine for polygons with many parts or holes.
+
+    Returns a list of floats, in square meters or meters."""
+    geoms = list(geoms)
+
+    if kind == 'line':
+        segments, owners = [], []
+        for index, geom in enumerate(geoms):
+            for line in _parts(geom, ('LineString', 'LinearRing')):
+                coords = np.asarray(line.coords)[:, :2]
+                segments.append(np.hstack((coords[:-1], coords[1:])))
+                owners.append(np.full(len(coords) - 1, index))
+        if not segments:
+            return [0.] * len(geoms)
+        segments = np.concatenate(segments)
+        _, _, distances = GEOD.inv(
+            segments[:, 0], segments[:, 1], segments[:, 2], segments[:, 3]
+        )
+        return np.bincount(
+            np.concatenate(owners),
+            weights=distances,
+            minlength=len(geoms)
+        ).tolist()
+    elif kind == 'polygon':
+        return [
+            sum(
+                _ring_area(polygon.exterior) -
+                sum(_ring_area(ring) for ring in polygon.interiors)
+                for polygon in _parts(geom, ('Polygon',))
+            )
+            for geom in geoms
+        ]
+    raise ValueError("No geodesic measure for kind: {}".format(kind))
+
+
+def get_measures(geoms, kind, engine='mollweide', crs=None):
+    """Get area, length, or number of points of each of ``geoms``.
+
+    * ``geoms``: Iterable of shapely geoms.
+    * ``kind``: Geometry type. One of `polygon`, `line`, or `point`.
+    * ``engine``: One of ``MEASURE_ENGINES``, or ``None`` to measure in the CRS of ``geoms``.
+    * ``crs``: ``PROJ4`` string, optional. CRS of ``geoms``; default is WGS84.
+
+    ``mollweide`` projects all ``geoms`` with one call to ``project_many`` and measures them in the plane. ``geodesic`` measures on the WGS84 ellipsoid without projecting, and is more accurate near the poles. Points are always counted.
+
+    Returns a list of floats."""
+    geoms = list(geoms)
+    if engine is not None and engine not in MEASURE_ENGINES:
+        raise ValueError("Unknown measure engine: {}".format(engine))
+
+    if kind != 'point':
+        if engine == 'geodesic':
+            return get_geodesic_measures(project_many(geoms, crs, ''), kind)
+        elif engine == 'mollweide':
+            geoms = project_many(geoms, crs, MOLLWEIDE)
+    return [get_measure(geom, kind) for geom in geoms]
+
+
+def get_remaining(original, geoms, to_meters=True, measure_engine='mollweide'):
     """Get the remaining area/length/number from ``original`` after subtracting the union of ``geoms``.
 
     * ``original``: Shapely geom in WGS84 CRS.
     * ``geoms``: List of shapely geoms in WGS84 CRS.
-    * ``to_meters``: Boolean. Return value calculated in Mollweide projection.
+    * ``to_meters``: Boolean. Return value calculated with ``measure_engine``.
+    * ``measure_engine``: One of ``MEASURE_ENGINES``; see ``get_measures``.
 
     ``original`` and ``geoms`` should have the same geometry type, and ``geoms`` are components of ``original``.
 
@@ -175,18 +575,15 @@ def get_remaining(original, geoms, to_meters=True):
             "Can't use this geometry type: {}".format(original.geom_type)
         )
 
-    if not to_meters or kind == 'point':
-        proj_func = lambda x: x
-    else:
-        proj_func = project
+    engine = measure_engine if to_meters else None
 
     if geoms and {kind_mapping[g.geom_type] for g in geoms} != {kind}:
         raise IncompatibleTypes
 
-    actual = get_measure(proj_func(original))
     if geoms:
-        union_total = get_measure(proj_func(cascaded_union(geoms)), kind)
-        individ_total = sum(get_measure(proj_func(geom), kind) for geom in geoms)
-        return (actual - union_total) * (individ_total / union_total)
+        actual, union_total, *individual = get_measures(
+            [original, unary_union(geoms)] + list(geoms), kind, engine
+        )
+        return (actual - union_total) * (sum(individual) / union_total)
     else:
-        return actual
+        return get_measures([original], kind, engine)[0]
@@ -1,19 +1,143 @@
 # -*- coding: utf-8 -*-
-from .maps import Map
+from .filesystem import sha256
+from .maps import Map, CACHE_SIZE
+from .projection import WGS84, get_working_crs, project_many
 from .geometry import (
+    FeatureTimeout,
     clean,
+    count_vertices,
     get_intersection,
+    get_intersections_bulk,
     kind_mapping,
+    recursive_geom_finder,
+    simplify,
+    subdivide,
 )
-from .projection import project
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import ExitStack, contextmanager
+from fiona.crs import from_string
 from logging.handlers import QueueHandler, QueueListener
-from shapely.geometry import shape
-from shapely.geos import TopologicalError
+from shapely import wkb
+from shapely.geometry import mapping
+from shapely.errors import ShapelyError
+from shapely.ops import unary_union
 import datetime
+import fiona
+import hashlib
+import heapq
+import json
 import logging
 import math
 import multiprocessing
+import numpy as np
 import os
+import shutil
+import signal
+import tempfile
+import threading
+import time
+
+try:
+    from multiprocessing import resource_tracker, shared_memory
+except ImportError:
+    shared_memory = None
+
+
+# Ways of running jobs in parallel; see ``intersection_dispatcher``
+BACKENDS = ('processes', 'threads')
+
+# Modules imported once by the ``forkserver`` server process, so that workers
+# forked from it don't import them and initialize GDAL and PROJ again
+PRELOAD_MODULES = [
+    'fiona',
+    'numpy',
+    'pandarus.calculate',
+    'pandarus.intersections',
+    'pyproj',
+    'rasterio',
+    'rtree',
+    'shapely.geometry',
+]
+
+# Seconds between the creation of the pool and this worker being ready to
+# run jobs; set by ``worker_init``
+_WORKER_STARTUP = None
+
+# Whether this process is a pool worker, which keeps its ``to`` maps loaded
+# between jobs; see ``borrow_to_maps``
+_POOL_WORKER = False
+
+# Errors of one feature which ``isolate_feature`` retries and reports instead
+# of stopping the worker. Other errors, e.g. programming errors or
+# ``MemoryError``, are raised.
+FEATURE_ERRORS = (ShapelyError, FeatureTimeout)
+
+# Progress of the job run by this worker process, as a ``(JobProgress, job
+# ID)`` tuple; set by ``_intersection_job``
+_PROGRESS = None
+
+# Seconds between checks of the progress of jobs by ``watch_jobs``
+WATCH_INTERVAL = 0.1
+
+# File extensions of output shards, by fiona driver
+SHARD_EXTENSIONS = {'GPKG': 'gpkg', 'FlatGeobuf': 'fgb', 'GeoJSON': 'geojson'}
+
+# Layer creation options for output shards. FlatGeobuf reorders features
+# when writing its spatial index, but ``merge_shards`` needs sorted shards.
+SHARD_OPTIONS = {'FlatGeobuf': {'SPATIAL_INDEX': 'NO'}}
+
+# ``to`` maps and their spatial indices, loaded once per process. The
+# dispatcher loads them before starting the pool, so forked workers inherit
+# them instead of building their own.
+_TO_MAPS = {}
+
+
+def load_to_map(filepath, to_proj='', cache_size=CACHE_SIZE):
+    """Load the ``to`` map at ``filepath`` and its spatial index in CRS ``to_proj``.
+
+    Each is only loaded once per process, and reused until ``release_to_map`` is called. The geometry type is checked when the map is first loaded, and the geometries projected to build the index are kept in the map geometry cache, which is at most ``cache_size`` bytes.
+
+    Returns a ``Map`` and an ``Rtree``. The ``Rtree`` is ``None`` if ``to_proj`` is ``None``."""
+    key = (filepath, os.path.getmtime(filepath))
+    if key not in _TO_MAPS:
+        to_map = Map(filepath)
+        if to_map.geometry not in ('Polygon', 'MultiPolygon'):
+            raise ValueError("`to_map` geometry must be polygons")
+        to_map._create_index_map()
+        to_map.enable_cache(cache_size)
+        _TO_MAPS[key] = (to_map, {})
+
+    to_map, indices = _TO_MAPS[key]
+    if to_map.pid != os.getpid():
+        to_map.reopen()
+    if to_proj is None:
+        return to_map, None
+    if to_proj not in indices:
+        indices[to_proj] = to_map.create_rtree_index(to_proj)
+    return to_map, indices[to_proj]
+
+
+def release_to_map(filepath):
+    """Remove the ``to`` map at ``filepath`` from this process."""
+    for key in [key for key in _TO_MAPS if key[0] == filepath]:
+        del _TO_MAPS[key]
+
+
+@contextmanager
+def borrow_to_maps(filepaths):
+    """Context manager for functions which load the ``to`` maps at ``filepaths`` with ``load_to_map``.
+
+    Maps are owned by whoever loaded them first: ``intersection_dispatcher``, a ``Session``, or the workers of a pool (see ``worker_init``), which keep them loaded for the following jobs. Maps which weren't loaded yet, e.g. when ``intersection_worker`` is called directly, are released on exit, so that they don't stay in memory for the life of the process."""
+    if _POOL_WORKER:
+        owned = []
+    else:
+        loaded = {key[0] for key in _TO_MAPS}
+        owned = [filepath for filepath in filepaths if filepath not in loaded]
+    try:
+        yield
+    finally:
+        for filepath in owned:
+            release_to_map(filepath)
 
 
 def chunker(iterable, chunk_size):
@@ -21,9 +145,98 @@ def chunker(iterable, chunk_size):
         yield list(iterable[i:i + chunk_size])
 
 
-def logger_init(dirpath=None):
+def hilbert_index(x, y, order=16):
+    """Position of integer coordinates ``x`` and ``y`` along a Hilbert curve.
+
+    ``x`` and ``y`` are NumPy integer arrays with values in ``[0, 2 ** order)``. Returns a NumPy array."""
+    n = 2 ** order
+    x, y = np.array(x, dtype=np.int64), np.array(y, dtype=np.int64)
+    d = np.zeros_like(x)
+    s = n // 2
+    while s > 0:
+        rx = (x & s) > 0
+        ry = (y & s) > 0
+        d += s * s * ((3 * rx) ^ ry)
+        # Rotate quadrant
+        flip = ~ry & rx
+        x = np.where(flip, n - 1 - x, x)
+        y = np.where(flip, n - 1 - y, y)
+        x, y = np.where(ry, x, y), np.where(ry, y, x)
+        s //= 2
+    return d
+
+
+def feature_summary(map_fp, ids, to_proj='', rtree_index=None):
+    """Get bounding box centers and estimated processing costs of features ``ids`` in map at ``map_fp``.
+
+    Features are projected to ``to_proj``. The cost of a feature is ``1 + vertices * (1 + candidates)``, where ``candidates`` is the number of entries of ``rtree_index`` which intersect its bounding box (zero if no index is given).
+
+    Returns two NumPy arrays: centers with shape ``(len(ids), 2)``, and costs."""
+    ids = list(ids)
+    dataset = Map(map_fp)
+    indices = None if len(ids) == len(dataset) else ids
+
+    summary = {}
+    for index, geom in dataset.iter_projected(to_proj, indices):
+        if geom.is_empty:
+            summary[index] = (0, 0, 1)
+            continue
+        bounds = geom.bounds
+        candidates = rtree_index.count(bounds) if rtree_index is not None else 0
+        summary[index] = (
+            (bounds[0] + bounds[2]) / 2,
+            (bounds[1] + bounds[3]) / 2,
+            1 + count_vertices(geom) * (1 + candidates)
+        )
+
+    array = np.array([summary[index] for index in ids], dtype=float).reshape((-1, 3))
+    return array[:, :2], array[:, 2]
+
+
+def spatial_order(map_fp, ids, order=16, centers=None):
+    """Sort feature indices ``ids`` in map at ``map_fp`` along a Hilbert curve.
+
+    Features are positioned by the center of their bounding box, in WGS84 unless ``centers`` are given (see ``feature_summary``). Features close to each other on the curve are also close in space, so chunks of the sorted indices touch a small part of the map.
+
+    Returns a list of indices."""
+    ids = list(ids)
+    if not ids:
+        return ids
+    if centers is None:
+        centers, _ = feature_summary(map_fp, ids)
+
+    xy = centers - centers.min(axis=0)
+    scale = xy.max(axis=0)
+    scale[scale == 0] = 1
+    xy = (xy / scale * (2 ** order - 1)).astype(np.int64)
+
+    keys = hilbert_index(xy[:, 0], xy[:, 1], order)
+    return [ids[i] for i in np.argsort(keys, kind='stable')]
+
+
+def partition_jobs(ids, costs, num_jobs):
+    """Split ``ids`` into about ``num_jobs`` jobs of similar total cost.
+
+    Jobs are contiguous runs of ``ids``, so that a spatial ordering is kept within each job; a feature which is more expensive than the target cost gets a job of its own.
+
+    Returns a list of ``(cost, ids)`` tuples, most expensive first, for longest processing time first scheduling."""
+    target = sum(costs) / max(num_jobs, 1)
+    jobs, current, current_cost = [], [], 0
+    for index, cost in zip(ids, costs):
+        if current and current_cost + cost > target:
+            jobs.append((current_cost, current))
+            current, current_cost = [], 0
+        current.append(index)
+        current_cost += cost
+    if current:
+        jobs.append((current_cost, current))
+    return sorted(jobs, key=lambda x: x[0], reverse=True)
+
+
+def logger_init(dirpath=None, start_method=None):
     # Adapted from http://stackoverflow.com/a/34964369/164864
-    logging_queue = multiprocessing.Queue()
+    # The queue must come from the same context as the worker processes
+    logging_queue = multiprocessing.get_context(start_method).Queue()
     # this is the handler for all log records
     filepath = "{}-{}.log".format(
         'pandarus-worker', datetime.datetime.now().strftime("%d-%B-%Y-%I-%M%p")
@@ -47,7 +260,21 @@ def logger_init(dirpath=None):
     return queue_listener, logging_queue
 
 
-def worker_init(logging_queue):
+def logger_stop(queue_listener):
+    """Stop a ``queue_listener`` created by ``logger_init``, and remove and close its handlers."""
+    queue_listener.stop()
+    logger = logging.getLogger()
+    for handler in queue_listener.handlers:
+        logger.removeHandler(handler)
+        handler.close()
+
+
+def worker_init(logging_queue, created=None, preload=()):
+    """Initialize a worker process.
+
+    ``preload`` is an iterable of ``(filepath, to_proj)`` tuples of ``to`` maps to load with ``load_to_map``, so that workers which don't inherit them from the parent process load them before their first job. If ``created`` is the time the pool was created, the startup latency of this worker is stored for ``_intersection_job``."""
+    global _POOL_WORKER, _WORKER_STARTUP
+    _POOL_WORKER = True
     # Needed to pass logging messages from child processes to a queue
     # handler which in turn passes them onto queue listener
     queue_handler = QueueHandler(logging_queue)
@@ -55,6 +282,12 @@ def worker_init(logging_queue):
     logger.setLevel(logging.INFO)
     logger.addHandler(queue_handler)
 
+    for filepath, to_proj in preload:
+        load_to_map(filepath, to_proj)
+
+    if created is not None:
+        _WORKER_STARTUP = time.time() - created
+
 
 def get_jobs(map_size):
     # Want a reasonable chunk size
@@ -65,8 +298,99 @@ def get_jobs(map_size):
     return chunk_size, num_jobs
 
 
-def intersection_worker(from_map, from_objs, to_map, worker_id=1):
-    """Multiprocessing worker for map matching"""
+def isolate_feature(func, from_index, from_geom, failures=None, worker_id=1):
+    """Call ``func(from_index, from_geom)``, so that a feature which fails doesn't stop the other features.
+
+    If ``func`` raises an error, it is called again with the feature simplified by ``simplify``. If that also fails, the feature is skipped, and a dictionary describing the failure is appended to ``failures``:
+
+    .. code-block:: python
+
+        {
+            'index': feature index,
+            'error': first error,
+            'retry_error': error with the simplified feature,
+            'vertices': number of vertices,
+            'valid': whether the feature is a valid geometry,
+            'seconds': time spent on the feature,
+            'worker': ``worker_id``,
+        }
+
+    Only ``FEATURE_ERRORS`` are handled this way; other errors are always raised. If ``failures`` is None, all errors are raised.
+
+    In a job run by ``intersection_dispatcher`` with a time limit, the feature being calculated is recorded in the progress of the job; see ``JobProgress``.
+
+    Returns the dictionary returned by ``func``, or an empty dictionary if the feature was skipped."""
+    start = time.time()
+    _report_progress(from_index)
+    try:
+        return func(from_index, from_geom)
+    except FEATURE_ERRORS as error:
+        if failures is None:
+            logging.exception("Intersection worker failed.")
+            raise
+        logging.warning(
+            "Feature {} failed ({}: {}); retrying with simplified geometry."
+            .format(from_index, type(error).__name__, error)
+        )
+        try:
+            return func(from_index, simplify(from_geom))
+        except FEATURE_ERRORS as retry_error:
+            logging.exception("Skipping feature {}.".format(from_index))
+            failures.append({
+                'index': int(from_index),
+                'error': "{}: {}".format(type(error).__name__, error),
+                'retry_error': "{}: {}".format(
+                    type(retry_error).__name__, retry_error
+                ),
+                'vertices': count_vertices(from_geom),
+                'valid': bool(from_geom.is_valid),
+                'seconds': time.time() - start,
+                'worker': worker_id,
+            })
+            return {}
+    finally:
+        _report_progress(None)
+
+
+def _report_progress(from_index):
+    """Record the feature ``from_index`` as started, or the current feature as finished if ``from_index`` is None, in the progress of the job run by this process, if any."""
+    if _PROGRESS is not None:
+        progress, job_id = _PROGRESS
+        progress.update(job_id, from_index)
+
+
+def intersection_worker(from_map, from_objs, to_map, worker_id=1,
+                        measure_engine='mollweide', projected=False,
+                        cache_size=CACHE_SIZE, early_stop=False,
+                        geometries=True, engine='rtree',
+                        feature_timeout=None, failures=None,
+                        max_vertices=None, working_crs=None,
+                        candidate_filter=None, exclusive=False):
+    """Multiprocessing worker for map matching.
+
+    If ``projected``, both maps are projected once to a working CRS, in which intersections are calculated and measured. Only the resulting geometries are projected back to WGS84. The working CRS is ``working_crs`` if given, and otherwise chosen from the CRS of both maps (see ``get_working_crs``).
+
+    ``to_map`` and its spatial index are loaded with ``load_to_map``, i.e. only once per process. If the worker loaded them itself outside of a pool, they are released when it returns; see ``borrow_to_maps``. Geometries from ``to_map`` are kept in a cache of at most ``cache_size`` bytes, so that they are only read and projected once even if they intersect many features of ``from_map``.
+
+    If ``early_stop``, stop testing ``to_map`` candidates for each feature once its whole measure is accounted for; see ``get_intersection``.
+
+    If not ``geometries``, only measures are returned, and intersected geometries are discarded as soon as they are measured.
+
+    ``engine`` is one of ``OVERLAY_ENGINES``. ``rtree`` calls ``get_intersection`` for each feature of ``from_map``; ``bulk`` calls ``get_intersections_bulk`` once for all the features, and ignores ``early_stop``. If the ``bulk`` engine fails with a shapely error, the features are calculated one by one with the ``rtree`` engine instead.
+
+    If ``max_vertices`` is given, line and polygon features of ``from_map`` with more vertices are split into pieces with ``subdivide`` before finding their intersections, as the cost of an overlay grows faster than the number of vertices. The measures of the pieces are summed for each pair of features, and their geometries are only merged once all pieces are done, if ``geometries``. With the ``bulk`` engine, these features are calculated one by one with the ``rtree`` engine.
+
+    If ``feature_timeout`` is a number of seconds, a feature raises ``FeatureTimeout`` if it has taken longer than this when ``get_intersection`` moves on to its next candidate. This check can't interrupt a single overlay which stalls; ``intersection_dispatcher`` stops such workers from outside. The ``bulk`` engine ignores ``feature_timeout``.
+
+    If ``failures`` is a list, a feature whose calculation raises a shapely error or ``FeatureTimeout`` doesn't stop the worker; see ``isolate_feature``. Other errors, and all errors if ``failures`` is None, are raised.
+
+    ``candidate_filter`` is an optional callable, called with the index of a feature of ``from_map`` and the list of indices of its ``to_map`` candidates, which returns the candidates to overlay; e.g. ``TileOwner``. It isn't used by the ``bulk`` engine.
+
+    If ``exclusive``, and this is a pool worker, all other ``to`` maps loaded in this process are released first, so that workers which are reused for many ``to`` maps only keep one in memory."""
+    if exclusive and _POOL_WORKER:
+        for filepath in {key[0] for key in _TO_MAPS}.difference([to_map]):
+            release_to_map(filepath)
+
     logging.info("""Starting intersection_worker:
     from map: {}
     from objs: {} ({} to {})
@@ -75,56 +399,537 @@ def intersection_worker(from_map, from_objs, to_map, worker_id=1):
                             min(from_objs or [0]), max(from_objs or [0]),
                             to_map, worker_id))
 
-    results = {}
+    with borrow_to_maps([to_map]):
+        results = {}
 
-    to_map = Map(to_map)
-    if to_map.geometry not in ('Polygon', 'MultiPolygon'):
-        raise ValueError("`to_map` geometry must be polygons")
-    rtree_index = to_map.create_rtree_index()
+        to_fp = to_map
+        to_map, _ = load_to_map(to_fp, None, cache_size)
 
-    logging.info("Worker {}: Loaded `to` map.".format(worker_id))
+        from_map = Map(from_map)
+        try:
+            kind = kind_mapping[from_map.geometry]
+        except KeyError:
+            raise ValueError("No valid geometry type in map {}".format(from_map))
 
-    from_map = Map(from_map)
-    try:
-        kind = kind_mapping[from_map.geometry]
-    except KeyError:
-        raise ValueError("No valid geometry type in map {}".format(from_map))
+        if not projected:
+            working_crs = None
+        elif working_crs is None:
+            working_crs = get_working_crs(from_map.crs, to_map.crs)
+        to_map, rtree_index = load_to_map(to_fp, working_crs or '', cache_size)
 
-    logging.info("Worker {}: Loaded `from` map.".format(worker_id))
+        logging.info("Worker {}: Loaded maps.".format(worker_id))
 
-    to_shape = lambda x: project(shape(x['geometry']), from_map.crs, '')
+        from_geoms = from_map.iter_projected(working_crs or '', from_objs or None)
 
-    if from_objs:
-        from_gen = ((index, from_map[index]) for index in from_objs)
-    else:
-        from_gen = enumerate(from_map)
+        def is_large(geom):
+            return bool(max_vertices) and kind != 'point' and \
+                count_vertices(geom) > max_vertices
+
+        if engine == 'bulk':
+            from_geoms = list(from_geoms)
+            large = [(index, geom) for index, geom in from_geoms if is_large(geom)]
+            if large:
+                indices = {index for index, _ in large}
+                small = [(index, geom) for index, geom in from_geoms
+                         if index not in indices]
+            else:
+                small = from_geoms
+            try:
+                results = get_intersections_bulk(
+                    small,
+                    kind,
+                    to_map,
+                    return_geoms=geometries,
+                    measure_engine=measure_engine,
+                    working_crs=working_crs,
+                )
+                from_geoms = large
+            except ShapelyError:
+                logging.exception("Bulk engine failed; falling back to ``rtree``.")
+
+        def feature_intersections(from_index, from_geom):
+            geom = clean(from_geom)
+            if geom.is_empty:
+                return {}
+            deadline = time.time() + feature_timeout if feature_timeout else None
+            pieces = subdivide(geom, kind, max_vertices) if is_large(geom) else [geom]
+
+            found = {}
+            for piece in pieces:
+                with to_map.lock:
+                    candidates = list(rtree_index.intersection(piece.bounds))
+                if candidate_filter is not None:
+                    candidates = candidate_filter(from_index, candidates)
+
+                for k, v in get_intersection(
+                    piece,
+                    kind,
+                    to_map,
+                    candidates,
+                    return_geoms=geometries,
+                    measure_engine=measure_engine,
+                    working_crs=working_crs,
+                    early_stop=early_stop,
+                    deadline=deadline,
+                ).items():
+                    found.setdefault(k, []).append(v)
+
+            feature_results = {}
+            for k, values in found.items():
+                if len(values) == 1:
+                    feature_results[(from_index, k)] = values[0]
+                    continue
+                feature_results[(from_index, k)] = {
+                    'measure': sum(v['measure'] for v in values)
+                }
+                if geometries:
+                    feature_results[(from_index, k)]['geom'] = recursive_geom_finder(
+                        unary_union([v['geom'] for v in values]), kind
+                    )
+            return feature_results
+
+        for from_index, from_geom in from_geoms:
+            results.update(isolate_feature(
+                feature_intersections, from_index, from_geom, failures, worker_id
+            ))
+
+        logging.info("Worker {}: Geometry cache hits: {}, misses: {}".format(
+            worker_id, to_map.cache.hits, to_map.cache.misses
+        ))
+
+        if working_crs is not None and geometries:
+            geoms = project_many(
+                (v['geom'] for v in results.values()), working_crs, ''
+            )
+            for v, geom in zip(results.values(), geoms):
+                v['geom'] = geom
+
+        return results
+
+
+def pack_results(results, geoms=True, shared=False):
+    """Convert ``intersection_worker`` results to a compact columnar form.
 
-    for from_index, from_obj in from_gen:
+    Returns a dictionary of NumPy arrays: ``from`` and ``to`` indices, and ``measure``. If ``geoms``, the geometries are stored as one buffer of concatenated WKB in ``wkb``, with ``offsets`` giving the start and end of each geometry. If ``shared`` and ``multiprocessing.shared_memory`` is available, the WKB buffer is written to a shared memory block instead, whose name is in ``shm``; call ``load_packed`` to read it back. If ``shared`` is a string, it is the name of the new block, so that the caller can free it with ``unlink_packed`` if it is never loaded.
+
+    A packed result costs 24 bytes per pair, plus the size of the WKB geometries."""
+    keys = list(results)
+    packed = {
+        'from': np.array([key[0] for key in keys], dtype=np.int64),
+        'to': np.array([key[1] for key in keys], dtype=np.int64),
+        'measure': np.array([results[key]['measure'] for key in keys], dtype=float),
+    }
+    if geoms:
+        buffers = [results[key]['geom'].wkb for key in keys]
+        packed['offsets'] = np.cumsum(
+            [0] + [len(buffer) for buffer in buffers], dtype=np.int64
+        )
+        packed['wkb'] = b''.join(buffers)
+        if shared and shared_memory is not None and packed['wkb']:
+            block = shared_memory.SharedMemory(
+                name=shared if isinstance(shared, str) else None,
+                create=True,
+                size=len(packed['wkb'])
+            )
+            block.buf[:len(packed['wkb'])] = packed['wkb']
+            packed['shm'] = block.name
+            packed['wkb'] = None
+            block.close()
+    return packed
+
+
+def load_packed(packed):
+    """Copy the WKB buffer of ``packed`` out of shared memory, and free the shared memory block.
+
+    Returns ``packed``."""
+    if packed.get('shm'):
+        block = shared_memory.SharedMemory(name=packed.pop('shm'))
+        try:
+            packed['wkb'] = bytes(block.buf[:packed['offsets'][-1]])
+        finally:
+            block.close()
+            block.unlink()
+    return packed
+
+
+def unlink_packed(names):
+    """Free the shared memory blocks ``names`` written by ``pack_results``, if they still exist, e.g. for the results of a failed run which were never loaded."""
+    if shared_memory is None:
+        return
+    for name in names:
         try:
-            geom = clean(to_shape(from_obj))
-
-            for k, v in get_intersection(
-                geom,
-                kind,
-                to_map,
-                rtree_index.intersection(geom.bounds),
-                project
-            ).items():
-                results[(from_index, k)] = v
-
-        except TopologicalError:
-            logging.exception("Skipping topological error.")
+            block = shared_memory.SharedMemory(name=name)
+        except FileNotFoundError:
             continue
-        except:
-            logging.exception("Intersection worker failed.")
-            raise
+        block.close()
+        block.unlink()
+
+
+def merge_packed(blocks):
+    """Concatenate packed results from ``pack_results``.
+
+    Returns a packed result."""
+    blocks = [load_packed(block) for block in blocks]
+    if not blocks:
+        return pack_results({})
+    merged = {
+        key: np.concatenate([block[key] for block in blocks])
+        for key in ('from', 'to', 'measure')
+    }
+    if 'wkb' in blocks[0]:
+        starts = np.cumsum([0] + [block['offsets'][-1] for block in blocks[:-1]])
+        merged['offsets'] = np.concatenate(
+            [block['offsets'][:-1] + start for block, start in zip(blocks, starts)] +
+            [[sum(block['offsets'][-1] for block in blocks)]]
+        ).astype(np.int64)
+        merged['wkb'] = b''.join(block['wkb'] for block in blocks)
+    return merged
 
+
+def unpack_results(packed):
+    """Convert packed results back to the ``intersection_worker`` dictionary format."""
+    packed = load_packed(packed)
+    keys = zip(packed['from'].tolist(), packed['to'].tolist())
+    results = {
+        key: {'measure': measure}
+        for key, measure in zip(keys, packed['measure'].tolist())
+    }
+    if 'wkb' in packed:
+        offsets = packed['offsets'].tolist()
+        for i, row in enumerate(results.values()):
+            row['geom'] = wkb.loads(packed['wkb'][offsets[i]:offsets[i + 1]])
     return results
 
 
-def intersection_dispatcher(from_map, to_map, from_objs=None, cpus=None, log_dir=None):
+def shard_path(dirpath, job_id, driver='GPKG'):
+    """Filepath of the output shard of job ``job_id`` in ``dirpath``."""
+    return os.path.join(dirpath, "shard-{:05d}.{}".format(
+        job_id, SHARD_EXTENSIONS.get(driver, driver.lower())
+    ))
+
+
+def write_shard(results, filepath, driver='GPKG'):
+    """Write ``intersection_worker`` results to the vector file ``filepath``, sorted by ``from`` and ``to`` index.
+
+    Shards have the integer fields ``from`` and ``to`` (feature indices) and the float field ``measure``, and WGS84 geometries, or no geometries if the results have none.
+
+    Returns ``filepath``, or ``None`` if there are no results, in which case no shard is written."""
+    if not results:
+        return None
+    schema = {
+        'properties': {'from': 'int', 'to': 'int', 'measure': 'float'},
+        'geometry': 'Unknown',
+    }
+    with fiona.drivers():
+        with fiona.open(
+                filepath, 'w',
+                crs=from_string(WGS84),
+                driver=driver,
+                schema=schema,
+                **SHARD_OPTIONS.get(driver, {})
+            ) as sink:
+            sink.writerecords(
+                {
+                    'geometry': mapping(results[key]['geom'])
+                                if 'geom' in results[key] else None,
+                    'properties': {
+                        'from': key[0],
+                        'to': key[1],
+                        'measure': results[key]['measure'],
+                    },
+                } for key in sorted(results)
+            )
+    return filepath
+
+
+def merge_shards(filepaths):
+    """Iterate over the features of the shards in ``filepaths``, ordered by ``from`` and ``to`` index.
+
+    Each shard must already be sorted (see ``write_shard``). Shards are read in parallel, so only one feature per shard is in memory at any time.
+
+    Yields tuples of ``(from index, to index, measure, geometry)``, where geometries are GeoJSON-like dictionaries."""
+    def rows(source):
+        for feature in source:
+            properties = feature['properties']
+            yield (properties['from'], properties['to'],
+                   properties['measure'], feature['geometry'])
+
+    with ExitStack() as stack:
+        sources = [stack.enter_context(fiona.open(fp)) for fp in filepaths]
+        yield from heapq.merge(
+            *[rows(source) for source in sources],
+            key=lambda row: row[:2]
+        )
+
+
+def create_pool(backend='processes', cpus=None, logging_queue=None,
+                start_method=None, preload=()):
+    """Create a pool of ``cpus`` workers for ``backend``, one of ``BACKENDS``.
+
+    Process pools use the ``multiprocessing`` ``start_method``, such as ``fork``, ``spawn``, or ``forkserver``; the default is the platform default. With ``forkserver``, the ``PRELOAD_MODULES`` are imported once by the server process instead of by each worker. Worker processes log to ``logging_queue``, and load the ``to`` maps in ``preload`` when they start (see ``worker_init``).
+
+    Returns a ``multiprocessing.Pool`` or a ``ThreadPoolExecutor``."""
+    if backend == 'threads':
+        return ThreadPoolExecutor(cpus or multiprocessing.cpu_count())
+    context = multiprocessing.get_context(start_method)
+    if context.get_start_method() == 'forkserver':
+        context.set_forkserver_preload(PRELOAD_MODULES)
+    if shared_memory is not None:
+        # Workers must share the tracker of this process, which frees the
+        # shared memory blocks they create
+        resource_tracker.ensure_running()
+    return context.Pool(
+        cpus or multiprocessing.cpu_count(),
+        worker_init,
+        [logging_queue, time.time(), list(preload)]
+    )
+
+
+def close_pool(pool, terminate=False):
+    """Stop all workers of a pool created by ``create_pool``.
+
+    Workers are left to finish their jobs and exit, so that they can flush their log records to the logging queue. Killing a worker while it writes to the queue leaves the queue locked, and ``logger_stop`` would then wait forever; workers are therefore only killed if ``terminate``, e.g. after an error or an interrupt."""
+    if isinstance(pool, ThreadPoolExecutor):
+        pool.shutdown(wait=not terminate)
+    elif terminate:
+        pool.terminate()
+        pool.join()
+    else:
+        pool.close()
+        pool.join()
+
+
+class JobProgress(object):
+    """Progress of the jobs of a run in worker processes, so that ``watch_jobs`` can find workers stuck on one feature.
+
+    The progress is kept in the file ``filepath``, which the dispatcher and each worker map into memory. It has one row per job: the ID of the process running the job, the index of the feature being calculated, and the time this feature started, or 0 between features. If ``jobs`` is given, the file is created, with this number of rows."""
+    def __init__(self, filepath, jobs=None):
+        self.filepath = filepath
+        if jobs is not None:
+            np.zeros((max(jobs, 1), 3)).tofile(filepath)
+        self.rows = np.memmap(filepath, dtype=float, mode='r+').reshape(-1, 3)
+
+    def update(self, job_id, from_index):
+        """Record that this process started the feature ``from_index`` of job ``job_id``, or finished its feature if ``from_index`` is None."""
+        row = self.rows[job_id]
+        if from_index is None:
+            row[2] = 0
+        else:
+            # The start time is written last, so a row is never seen as
+            # started with the process or feature of another one
+            row[:2] = os.getpid(), from_index
+            row[2] = time.time()
+
+    def stalled(self, limit):
+        """Find the features which started more than ``limit`` seconds ago.
+
+        Returns a list of ``(job ID, process ID, feature index)`` tuples."""
+        now = time.time()
+        return [
+            (job_id, int(pid), int(from_index))
+            for job_id, (pid, from_index, started) in enumerate(self.rows.tolist())
+            if 0 < started < now - limit
+        ]
+
+
+def watch_jobs(pool, arguments, progress, limit):
+    """Run ``_intersection_job`` for each of ``arguments`` in the process ``pool``, and yield the values it returns as jobs finish, like ``imap_unordered``.
+
+    A worker process which has spent more than ``limit`` seconds on one feature, according to ``progress`` (a ``JobProgress``), is stopped, and the pool starts a new worker in its place. The job is then run again without this feature, which is returned with the failures of the job, as for features which fail in the worker (see ``isolate_feature``)."""
+    pending = {
+        args[0]: (args, pool.apply_async(_intersection_job, (args,)))
+        for args in arguments
+    }
+    while pending:
+        for job_id, (args, result) in list(pending.items()):
+            if result.ready():
+                del pending[job_id]
+                yield result.get()
+
+        stopped = [
+            row for row in progress.stalled(limit)
+            if row[0] in pending and not pending[row[0]][1].ready()
+        ]
+        for job_id, pid, _ in stopped:
+            # A worker stuck in GEOS or GDAL for this long isn't writing to
+            # the logging queue, so it can't leave the queue locked
+            os.kill(pid, signal.SIGTERM)
+            progress.update(job_id, None)
+            # The pool waits for the results of all jobs before it can be
+            # closed, so the job of the stopped worker is marked as failed
+            pending[job_id][1]._set(None, (False, FeatureTimeout(
+                "Worker {} stopped".format(pid)
+            )))
+        for job_id, pid, from_index in stopped:
+            logging.error("Stopped worker {} after {} seconds on feature {}.".format(
+                pid, limit, from_index
+            ))
+            args = pending[job_id][0]
+            _, geom = next(Map(args[1]).iter_latlong([from_index]))
+            failed = args[8] + [{
+                'index': from_index,
+                'error': "FeatureTimeout: worker stopped after {} seconds".format(limit),
+                'retry_error': None,
+                'vertices': count_vertices(geom),
+                # Not checked, as the validity check of a geometry which
+                # stalls GEOS can stall too
+                'valid': None,
+                'seconds': limit,
+                'worker': job_id,
+            }]
+            args = args[:2] + ([index for index in args[2] if index != from_index],) + \
+                args[3:8] + (failed, args[9])
+            pending[job_id] = (args, pool.apply_async(_intersection_job, (args,)))
+
+        if pending:
+            time.sleep(WATCH_INTERVAL)
+
+
+def checkpoint_key(from_map, to_map, kwargs, source=None):
+    """Key of the checkpoints of a run, from the hashes of the ``from_map`` and ``to_map`` files and the ``intersection_worker`` ``kwargs`` that change results.
+
+    If ``source`` is given, it is used instead of the hashes of the files, e.g. for temporary files whose hashes change on every run."""
+    hasher = hashlib.sha256()
+    if source is None:
+        hasher.update(sha256(from_map).encode())
+        hasher.update(sha256(to_map).encode())
+    else:
+        hasher.update(source.encode())
+    options = sorted((k, v) for k, v in kwargs.items() if k != 'cache_size')
+    hasher.update(repr(options).encode())
+    return hasher.hexdigest()
+
+
+def checkpoint_path(dirpath, chunk):
+    """Filepath of the checkpoint of the job with feature indices ``chunk`` in the checkpoint directory ``dirpath`` of a run."""
+    digest = hashlib.sha256(np.asarray(chunk, dtype=np.int64).tobytes())
+    return os.path.join(dirpath, "job-{}.npz".format(digest.hexdigest()))
+
+
+def save_checkpoint(results, filepath, geoms=True, failures=()):
+    """Save ``intersection_worker`` results and ``failures`` to the checkpoint ``filepath``, in the columnar form of ``pack_results``.
+
+    The checkpoint is written to a temporary file first, so that an interrupted write never leaves a partial checkpoint."""
+    packed = pack_results(results, geoms)
+    if geoms:
+        packed['wkb'] = np.frombuffer(packed['wkb'], dtype=np.uint8)
+    if failures:
+        packed['failures'] = np.array([json.dumps(row) for row in failures])
+    with open(filepath + ".tmp", "wb") as f:
+        np.savez(f, **packed)
+    os.replace(filepath + ".tmp", filepath)
+    return filepath
+
+
+def load_checkpoint(filepath):
+    """Load packed results from a checkpoint written by ``save_checkpoint``.
+
+    Returns the packed results and the list of failures."""
+    with np.load(filepath) as data:
+        packed = {key: data[key] for key in data.files}
+    if 'wkb' in packed:
+        packed['wkb'] = packed['wkb'].tobytes()
+    failures = [json.loads(row) for row in packed.pop('failures', [])]
+    return packed, failures
+
+
+def _job_output(results, shard, pack, geoms=True):
+    """Results of a job as returned by ``_intersection_job``."""
+    if shard is not None:
+        return write_shard(results, *shard)
+    elif pack:
+        return pack_results(results, geoms=geoms, shared=pack)
+    return results
+
+
+def _intersection_job(args):
+    """Run ``intersection_worker`` for one job in a pool.
+
+    Returns the job ID, the ID of the process and thread which ran the job, its run time, the results, the startup latency of the worker process, with its first finished job only (``None`` afterwards, and for threads), and the features which failed (see ``intersection_worker``), after the features in ``failed``, which were left out of the job by ``watch_jobs``. If ``shard`` is a ``(filepath, driver)`` tuple, the results are written to a shard, and its filepath is returned instead. If ``pack``, results are packed with ``pack_results``, in the shared memory block named ``pack``. If ``checkpoint`` is a filepath, the results are also saved there with ``save_checkpoint``. If ``progress`` is the filepath of a ``JobProgress``, the progress of the job is recorded there."""
+    global _PROGRESS, _WORKER_STARTUP
+    (job_id, from_map, from_objs, to_map, kwargs, shard, pack, checkpoint,
+     failed, progress) = args
+    start = time.time()
+    failures = list(failed)
+    if progress is not None:
+        _PROGRESS = (JobProgress(progress), job_id)
+    try:
+        # Jobs can be left without features by ``watch_jobs``
+        results = intersection_worker(
+            from_map, from_objs, to_map, job_id, failures=failures, **kwargs
+        ) if from_objs else {}
+    finally:
+        _PROGRESS = None
+    geoms = kwargs.get('geometries', True)
+    if checkpoint is not None:
+        save_checkpoint(results, checkpoint, geoms, failures)
+    data = _job_output(results, shard, pack, geoms)
+    worker = (os.getpid(), threading.get_ident())
+    # Reported once, so workers kept by a ``Session`` don't report it again
+    latency, _WORKER_STARTUP = _WORKER_STARTUP, None
+    return job_id, worker, time.time() - start, data, latency, failures
+
+
+def intersection_dispatcher(from_map, to_map, from_objs=None, cpus=None,
+                            log_dir=None, spatial_sort=True, metrics=None,
+                            packed=False, shard_dir=None, shard_driver='GPKG',
+                            callback=None, backend='processes', session=None,
+                            start_method=None, checkpoint_dir=None,
+                            keep_checkpoints=False, checkpoint_source=None,
+                            **kwargs):
+    """Calculate intersections of ``from_map`` and ``to_map`` using a pool of ``cpus`` workers.
+
+    The cost of each feature in ``from_map`` is estimated from its number of vertices and its number of candidates in the ``to_map`` spatial index. Features are split into jobs of similar total cost, which are handed out to workers as they become free, most expensive first.
+
+    If ``spatial_sort``, the features of ``from_map`` are sorted along a Hilbert curve before being split into jobs (see ``spatial_order``), so that each worker handles features which are close to each other. Results are still indexed by the original feature indices.
+
+    Workers return results in the columnar form of ``pack_results``, which are concatenated once all jobs are finished. If ``packed``, the concatenated arrays are returned; otherwise they are converted to the ``intersection_worker`` dictionary format.
+
+    If ``shard_dir`` is given, each job instead writes its results to its own shard in ``shard_dir``, using the fiona driver ``shard_driver`` (see ``write_shard``), and the list of shard filepaths is returned, ordered by job. Jobs without results don't write a shard. Results are then never held in memory by this process; use ``merge_shards`` to read them.
+
+    ``backend`` is one of ``BACKENDS``. With ``processes``, jobs run in a ``multiprocessing.Pool``. With ``threads``, they run in a thread pool in this process: all threads share the loaded ``to_map``, its spatial index and its geometry cache, and results are collected without being copied. Threads only run in parallel while GEOS or GDAL release the GIL, so this works best with the ``bulk`` engine of ``intersection_worker``.
+
+    Process pools use the ``multiprocessing`` ``start_method``; see ``create_pool``. Workers which don't inherit the loaded ``to_map`` from this process, e.g. with ``spawn`` or ``forkserver``, load it and its index when they start, before their first job.
+
+    If ``checkpoint_dir`` is given, the results of each finished job are saved in a subdirectory of ``checkpoint_dir``, named from the hashes of both maps and the ``intersection_worker`` arguments (see ``checkpoint_key``). The checkpoint of each job is named from its feature indices. If the run fails or is interrupted, running it again loads the jobs that finished from their checkpoints, and only calculates the others. The checkpoints are deleted once all jobs are finished, unless ``keep_checkpoints``; the caller can then delete them once the results are safely written, from the directories listed in ``metrics['checkpoints']``. Runs with the same inputs and options share the same checkpoints, so they shouldn't run at the same time with the same ``checkpoint_dir``. Checkpoints are only used with a pool, i.e. if ``cpus`` is not falsey. If ``checkpoint_source`` is given, it replaces the hashes of the maps in the checkpoint key; see ``tiled_dispatcher``.
+
+    If ``session`` is a ``Session``, its warm pool and logging are used instead of creating new ones: the number of workers and the log file are those of the session, and ``log_dir`` and ``start_method`` are ignored. ``cpus`` only decides whether the pool is used; if it is falsey, the calculation runs in this process, as without a session. ``to_map`` is then kept loaded in this process until the session is closed.
+
+    If ``metrics`` is a dictionary, it is updated with the number of jobs, their estimated costs and run times, the load imbalance between workers (maximum divided by mean busy time), the startup latency of each worker process which finished its first job in this call, in seconds from the creation of the pool until it was ready (warm ``Session`` workers don't report it again), the number of jobs loaded from checkpoints, the checkpoint directories which were kept, and the features which failed.
+
+    Features whose calculation fails with a shapely error, or is still testing candidates after the optional ``feature_timeout`` in seconds, are tried again with a simplified geometry, and skipped if they fail again; they don't stop the other features or jobs. See ``intersection_worker``. With a process pool, ``feature_timeout`` is also a hard limit: a worker which spends more than twice ``feature_timeout`` on one feature, e.g. in a single overlay which never finishes, is stopped and replaced, and its job runs again without this feature, which is skipped; see ``watch_jobs``. Threads can't be stopped, so with the ``threads`` backend, and without a pool, ``feature_timeout`` is only checked between overlays. They are logged, and returned as ``metrics['failures']``.
+
+    Additional ``kwargs`` are passed to ``intersection_worker``."""
+    if backend not in BACKENDS:
+        raise ValueError("Unknown backend: {}".format(backend))
+    if session is not None:
+        session.to_maps.add(to_map)
+
+    failures = []
     if not cpus:
-        return intersection_worker(from_map, None, to_map)
+        try:
+            # Loaded here, so that ``intersection_worker`` doesn't release it
+            # before a session can reuse it
+            load_to_map(to_map, None)
+            results = intersection_worker(
+                from_map, from_objs, to_map, failures=failures, **kwargs
+            )
+        finally:
+            if session is None:
+                release_to_map(to_map)
+        if metrics is not None:
+            metrics['failures'] = failures
+        if shard_dir:
+            filepath = write_shard(
+                results, shard_path(shard_dir, 0, shard_driver), shard_driver
+            )
+            return [filepath] if filepath else []
+        if callback is not None:
+            callback(results)
+            return None
+        if packed:
+            return pack_results(results, geoms=kwargs.get('geometries', True))
+        return results
 
     if from_objs:
         map_size = len(from_objs)
@@ -133,56 +938,200 @@ def intersection_dispatcher(from_map, to_map, from_objs=None, cpus=None, log_dir
         map_size = len(Map(from_map))
         ids = range(map_size)
 
-    chunk_size, num_jobs = get_jobs(map_size)
+    _, num_jobs = get_jobs(map_size)
 
-    queue_listener, logging_queue = logger_init(log_dir)
+    # Load the ``to`` map and index before starting the pool; forked
+    # workers then share them instead of building their own
+    shared, _ = load_to_map(to_map, None)
+    if kwargs.get('projected'):
+        working_crs = kwargs.get('working_crs') or \
+            get_working_crs(Map(from_map).crs, shared.crs)
+    else:
+        working_crs = None
+    _, rtree_index = load_to_map(to_map, working_crs or '')
+
+    centers, costs = feature_summary(from_map, ids, working_crs or '', rtree_index)
+    costs = dict(zip(ids, costs))
+    if spatial_sort:
+        ids = spatial_order(from_map, ids, centers=centers)
+    jobs = partition_jobs(ids, [costs[index] for index in ids], num_jobs)
+
+    threads = backend == 'threads'
+    if session is not None:
+        queue_listener, logging_queue = None, session.logging_queue
+    else:
+        queue_listener, logging_queue = logger_init(log_dir, start_method)
     logging.info("""Starting `intersect` calculation.
     From map: {}
     To map: {}
     Map size: {}
-    Chunk size: {}
-    Number of jobs: {}""".format(
-        from_map, to_map, map_size, chunk_size, num_jobs
+    Number of jobs: {}
+    Largest job cost (relative): {:.3f}""".format(
+        from_map, to_map, map_size, len(jobs),
+        jobs[0][0] / sum(cost for cost, _ in jobs) if jobs else 0
     ))
 
-    results = {}
+    if checkpoint_dir:
+        run_dir = os.path.join(
+            checkpoint_dir,
+            checkpoint_key(from_map, to_map, kwargs, checkpoint_source)
+        )
+        os.makedirs(run_dir, exist_ok=True)
+    else:
+        run_dir = None
 
-    def callback_func(data):
-        results.update(data)
+    blocks, shards, job_times, busy, startup = [], {}, {}, {}, {}
+    arguments, restored = [], []
+    # Shared memory blocks of the job results are named here, so that the
+    # blocks of results which are never loaded can be freed after an error
+    run_id = os.urandom(6).hex()
+    block_names = [] if threads else [
+        "pandarus_{}_{}".format(run_id, index) for index in range(len(jobs))
+    ]
+    for index, (_, chunk) in enumerate(jobs):
+        args = (
+            index, from_map, chunk, to_map, kwargs,
+            (shard_path(shard_dir, index, shard_driver), shard_driver)
+            if shard_dir else None,
+            None if threads else block_names[index],
+            checkpoint_path(run_dir, chunk) if run_dir else None,
+            [],
+            None,
+        )
+        if run_dir and os.path.exists(args[7]):
+            restored.append(args)
+        else:
+            arguments.append(args)
 
-    with multiprocessing.Pool(
-                cpus or multiprocessing.cpu_count(),
-                worker_init,
-                [logging_queue]
-            ) as pool:
-        arguments = [
-            (from_map, chunk, to_map, index)
-            for index, chunk in enumerate(chunker(ids, chunk_size))
-        ]
+    def collect(job_id, data):
+        if shard_dir:
+            shards[job_id] = data
+        elif callback is not None:
+            callback(data if threads else unpack_results(data))
+        elif threads:
+            blocks.append(data)
+        else:
+            blocks.append(load_packed(data))
 
-        function_results = []
+    # Workers which stall on one feature are stopped from here, as a single
+    # overlay can't be interrupted in the worker; see ``watch_jobs``
+    watch = (kwargs.get('feature_timeout') or 0) > 0 and not threads and arguments
+    if watch:
+        handle, progress_fp = tempfile.mkstemp(suffix=".progress")
+        os.close(handle)
+        progress = JobProgress(progress_fp, len(jobs))
+        arguments = [args[:9] + (progress_fp,) for args in arguments]
 
-        for argument_set in arguments:
-            function_results.append(pool.apply_async(
-                intersection_worker,
-                argument_set,
-                callback=callback_func
+    done = False
+    try:
+        if restored:
+            logging.info("Loading {} jobs from checkpoints in {}".format(
+                len(restored), run_dir
             ))
-        for fr in function_results:
-            fr.wait()
+        for job_id, _, _, _, _, shard, pack, checkpoint, _, _ in restored:
+            data, job_failures = load_checkpoint(checkpoint)
+            failures.extend(job_failures)
+            if pack and shard is None:
+                collect(job_id, data)
+            else:
+                collect(job_id, _job_output(
+                    unpack_results(data), shard, pack,
+                    kwargs.get('geometries', True)
+                ))
 
-        if any(not fr.successful() for fr in function_results):
-            raise ValueError("Couldn't complete Pandarus task")
+        if arguments:
+            if session is not None:
+                pool = session.get_pool(backend)
+            else:
+                pool = create_pool(backend, cpus, logging_queue, start_method,
+                                   [(to_map, working_crs or '')])
+            if threads:
+                futures = [pool.submit(_intersection_job, args) for args in arguments]
+                finished = (future.result() for future in as_completed(futures))
+            elif watch:
+                # Twice the limit, as a feature which times out is tried
+                # again with a simplified geometry
+                finished = watch_jobs(pool, arguments, progress,
+                                      2 * kwargs['feature_timeout'])
+            else:
+                finished = pool.imap_unordered(_intersection_job, arguments)
+            try:
+                for job_id, worker, elapsed, data, latency, job_failures in finished:
+                    collect(job_id, data)
+                    failures.extend(job_failures)
+                    job_times[job_id] = elapsed
+                    busy[worker] = busy.get(worker, 0) + elapsed
+                    if latency is not None:
+                        startup[worker] = latency
+                done = True
+            except Exception:
+                logging.exception("Intersection job failed.")
+                if threads:
+                    for future in futures:
+                        future.cancel()
+                raise ValueError("Couldn't complete Pandarus task")
+            finally:
+                if session is None:
+                    close_pool(pool, terminate=not done)
+        if not threads:
+            results = merge_packed(blocks)
+        elif packed:
+            results = merge_packed([
+                pack_results(block, geoms=kwargs.get('geometries', True))
+                for block in blocks
+            ])
+        else:
+            results = {key: value for block in blocks for key, value in block.items()}
+    finally:
+        if session is None:
+            logger_stop(queue_listener)
+            release_to_map(to_map)
+        unlink_packed(block_names)
+        if session is not None and arguments and not done:
+            # Jobs of the failed run can still be running in the warm pool;
+            # their blocks are freed when the session is closed
+            session.shared_blocks.update(block_names)
+        if watch:
+            del progress
+            os.remove(progress_fp)
 
-    queue_listener.stop()
+    if run_dir and not keep_checkpoints:
+        shutil.rmtree(run_dir, ignore_errors=True)
+
+    failures.sort(key=lambda row: row['index'])
+    if failures:
+        logging.warning("{} features failed: {}".format(
+            len(failures), [row['index'] for row in failures]
+        ))
 
+    imbalance = max(busy.values()) / np.mean(list(busy.values())) if busy else 1.
     logging.info("""Finished `intersect` calculation.
     From map: {}
     To map: {}
     Map size: {}
-    Chunk size: {}
-    Number of jobs: {}""".format(
-        from_map, to_map, map_size, chunk_size, num_jobs
+    Number of jobs: {}
+    Worker load imbalance (max / mean busy time): {:.3f}
+    Worker startup latency (max, seconds): {:.3f}""".format(
+        from_map, to_map, map_size, len(jobs), imbalance,
+        max(startup.values()) if startup else 0
     ))
 
-    return results
+    if metrics is not None:
+        metrics.update({
+            'jobs': len(jobs),
+            'estimated_costs': [cost for cost, _ in jobs],
+            'job_times': [job_times.get(index) for index in range(len(jobs))],
+            'imbalance': imbalance,
+            'worker_startup': sorted(startup.values()),
+            'resumed': len(restored),
+            'checkpoints': [run_dir] if run_dir and keep_checkpoints else [],
+            'failures': failures,
+        })
+
+    if shard_dir:
+        return [shards[index] for index in sorted(shards) if shards[index]]
+    if callback is not None:
+        return None
+    if threads and not packed:
+        return results
+    return results if packed else unpack_results(results)
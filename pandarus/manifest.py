@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+from .calculate import (
+    CPU_COUNT,
+    WGS84,
+    get_map,
+    output_metadata,
+    output_schema,
+    shard_features,
+    write_features,
+)
+from .filesystem import JSONStreamWriter, get_appdirs_path, sha256
+from .intersections import (
+    feature_summary,
+    intersection_dispatcher,
+    load_to_map,
+    partition_jobs,
+    release_to_map,
+    spatial_order,
+)
+from .maps import Map
+from .projection import get_working_crs
+import datetime
+import fiona
+import json
+import os
+import shutil
+
+
+def create_manifest(first_fp, first_field, second_fp, second_field, shards,
+                    first_kwargs={}, second_kwargs={}, dirpath=None,
+                    driver='GeoJSON', compress=True,
+                    measure_engine='mollweide', projected=False,
+                    early_stop=False, geometries=True, engine='rtree',
+                    feature_timeout=None, max_vertices=None):
+    """Split an ``intersect`` calculation into ``shards`` which can be run on different machines.
+
+    The features of the first dataset are ordered along a Hilbert curve and split into about ``shards`` parts of similar estimated cost, as the jobs of ``intersection_dispatcher`` are. Other parameters are as in ``intersect``.
+
+    The manifest is a JSON file ``<first hash>.<second hash>.manifest.json`` in ``dirpath``, with the metadata and hashes of both inputs, the calculation options, and for each shard its feature indices and the directory of its results, relative to the manifest. Run each shard with ``run_shard``, and combine them with ``merge_manifest``.
+
+    Returns the filepath of the manifest."""
+    first, first_metadata = get_map(first_fp, first_field, first_kwargs)
+    second, second_metadata = get_map(second_fp, second_field, second_kwargs)
+    if not dirpath:
+        dirpath = get_appdirs_path("intersections")
+
+    working_crs = get_working_crs(first.crs, second.crs) if projected else None
+    try:
+        _, rtree_index = load_to_map(second_fp, working_crs or '')
+        ids = range(len(first))
+        centers, costs = feature_summary(first_fp, ids, working_crs or '', rtree_index)
+    finally:
+        release_to_map(second_fp)
+    costs = dict(zip(ids, costs.tolist()))
+    ids = spatial_order(first_fp, ids, centers=centers)
+    jobs = partition_jobs(ids, [costs[index] for index in ids], shards)
+
+    manifest = {
+        'first': dict(first_metadata, kwargs=first_kwargs),
+        'second': dict(second_metadata, kwargs=second_kwargs),
+        'options': {
+            'measure_engine': measure_engine,
+            'projected': projected,
+            'early_stop': early_stop,
+            'geometries': geometries,
+            'engine': engine,
+            'feature_timeout': feature_timeout,
+            'max_vertices': max_vertices,
+        },
+        'driver': driver,
+        'compress': compress,
+        'shards': [{
+            'id': index,
+            'cost': cost,
+            'indices': [int(x) for x in chunk],
+            'path': "shard-{:05d}".format(index),
+        } for index, (cost, chunk) in enumerate(jobs)],
+    }
+    filepath = os.path.join(dirpath, "{}.{}.manifest.json".format(
+        first.hash, second.hash
+    ))
+    with open(filepath, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return filepath
+
+
+def load_manifest(filepath):
+    with open(filepath, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def get_shard(manifest, shard_id):
+    """Get shard ``shard_id`` of ``manifest``.
+
+    Raises ``ValueError`` if the manifest has no such shard."""
+    if not 0 <= shard_id < len(manifest['shards']):
+        raise ValueError("No shard {} in the manifest; shards are 0 to {}".format(
+            shard_id, len(manifest['shards']) - 1
+        ))
+    return manifest['shards'][shard_id]
+
+
+def check_input(manifest, key, filepath=None):
+    """Get the filepath of input ``key`` (``first`` or ``second``) of ``manifest``, or ``filepath`` if given, and check that its hash is the one in the manifest.
+
+    Raises ``ValueError`` if the file has changed."""
+    filepath = filepath or manifest[key]['path']
+    if sha256(filepath) != manifest[key]['sha256']:
+        raise ValueError("{} doesn't match the manifest".format(filepath))
+    return filepath
+
+
+def run_shard(manifest_fp, shard_id, cpus=CPU_COUNT, first_fp=None,
+              second_fp=None, output_dir=None, log_dir=None):
+    """Calculate one shard of the manifest at ``manifest_fp``.
+
+    The input files are read from their paths in the manifest, unless ``first_fp`` or ``second_fp`` are given, and must be the same as when the manifest was created. Results are written with ``intersection_dispatcher`` as shards in the shard directory, in ``output_dir`` or the directory of the manifest. Any previous results of the shard are deleted first.
+
+    When finished, writes ``<shard directory>.json`` with the list of shard files and the features which failed; ``merge_manifest`` uses it to check that the shard is complete.
+
+    Raises ``ValueError`` if the manifest has no shard ``shard_id``. Returns the filepath of this file."""
+    manifest = load_manifest(manifest_fp)
+    shard = get_shard(manifest, shard_id)
+    first_fp = check_input(manifest, 'first', first_fp)
+    second_fp = check_input(manifest, 'second', second_fp)
+
+    shard_dir = os.path.join(
+        output_dir or os.path.dirname(os.path.abspath(manifest_fp)),
+        shard['path']
+    )
+    if os.path.exists(shard_dir):
+        shutil.rmtree(shard_dir)
+    if os.path.exists(shard_dir + ".json"):
+        os.remove(shard_dir + ".json")
+    os.makedirs(shard_dir)
+
+    metrics = {}
+    filepaths = intersection_dispatcher(
+        first_fp,
+        second_fp,
+        from_objs=shard['indices'],
+        cpus=cpus,
+        log_dir=log_dir,
+        shard_dir=shard_dir,
+        metrics=metrics,
+        **manifest['options']
+    )
+    with open(shard_dir + ".json", "w", encoding="utf-8") as f:
+        json.dump({
+            'id': shard_id,
+            'shards': [os.path.basename(fp) for fp in filepaths],
+            'failures': metrics.get('failures', []),
+            'when': datetime.datetime.now().isoformat(),
+        }, f)
+    return shard_dir + ".json"
+
+
+def merge_manifest(manifest_fp, shard_dir=None, dirpath=None, first_fp=None,
+                   second_fp=None):
+    """Combine the shards of the manifest at ``manifest_fp`` into the output files of ``intersect``.
+
+    Shards are read from ``shard_dir``, or the directory of the manifest. All shards must be finished. Both input files are needed for the labels of their features, and are checked against the manifest as in ``run_shard``. Output files are written to ``dirpath``, or the directory of the manifest, with the same names, schema and metadata as with ``intersect``, and the same intersections, labels and measures. Features are numbered in order of ``from`` and ``to`` feature index, as with the ``shard_driver`` option of ``intersect``; by default, ``intersect`` numbers them in the order in which its jobs finish, which can differ between runs.
+
+    Returns filepaths of the geospatial file (``None`` without geometries) and of the JSON data file."""
+    manifest = load_manifest(manifest_fp)
+    shard_dir = shard_dir or os.path.dirname(os.path.abspath(manifest_fp))
+    dirpath = dirpath or os.path.dirname(os.path.abspath(manifest_fp))
+
+    filepaths, failures, missing = [], [], []
+    for shard in manifest['shards']:
+        done_fp = os.path.join(shard_dir, shard['path'] + ".json")
+        if not os.path.exists(done_fp):
+            missing.append(shard['id'])
+            continue
+        with open(done_fp, encoding="utf-8") as f:
+            done = json.load(f)
+        filepaths.extend(
+            os.path.join(shard_dir, shard['path'], filename)
+            for filename in done['shards']
+        )
+        failures.extend(done['failures'])
+    if missing:
+        raise ValueError("Shards not finished: {}".format(missing))
+
+    first_fp = check_input(manifest, 'first', first_fp)
+    second_fp = check_input(manifest, 'second', second_fp)
+    first = Map(first_fp, manifest['first']['field'], **manifest['first']['kwargs'])
+    second = Map(second_fp, manifest['second']['field'], **manifest['second']['kwargs'])
+    first_mapping = first.get_fieldnames_dictionary()
+    second_mapping = second.get_fieldnames_dictionary()
+    first_metadata, second_metadata = [
+        {k: v for k, v in manifest[name].items() if k != 'kwargs'}
+        for name in ('first', 'second')
+    ]
+
+    base_filepath = os.path.join(dirpath, "{}.{}.".format(
+        manifest['first']['sha256'], manifest['second']['sha256']
+    ))
+    data_fp = base_filepath + "json"
+    features = shard_features(filepaths, first_mapping, second_mapping)
+    table = JSONStreamWriter(data_fp, manifest['compress'])
+    if manifest['options']['geometries']:
+        fiona_fp = base_filepath + manifest['driver'].lower()
+        if os.path.exists(fiona_fp):
+            os.remove(fiona_fp)
+        with fiona.open(
+                fiona_fp, 'w',
+                crs=WGS84,
+                driver=manifest['driver'],
+                schema=output_schema(first, first.fieldname,
+                                     second, second.fieldname),
+            ) as sink:
+            write_features(features, sink, table)
+    else:
+        fiona_fp = None
+        write_features(features, None, table)
+
+    failures.sort(key=lambda row: row['index'])
+    data_fp = table.close(metadata=output_metadata(
+        first_metadata, second_metadata, first_mapping, failures
+    ))
+    return fiona_fp, data_fp
@@ -1,13 +1,30 @@
 # -*- coding: utf-8 -*-
 from .conversion import check_type
 from .filesystem import sha256
-from .projection import project
+from .projection import project_many
+from collections import OrderedDict
 from fiona import crs as fiona_crs
-from functools import partial
-from shapely.geometry import shape
+from itertools import islice
+from shapely.geometry import GeometryCollection, shape
 import fiona
+import hashlib
 import os
 import rtree
+import threading
+
+
+# Default maximum size of a ``Map`` geometry cache, in bytes
+CACHE_SIZE = 128 * 2 ** 20
+
+# ``Map.feature_hashes`` hash of features without a geometry
+NULL_GEOMETRY_HASH = hashlib.sha256(b"null").hexdigest()
+
+
+def feature_geometry(feature):
+    """Shapely geometry of the fiona ``feature``, or an empty geometry if it has no geometry."""
+    if feature['geometry'] is None:
+        return GeometryCollection()
+    return shape(feature['geometry'])
 
 
 class DuplicateFieldID(Exception):
@@ -15,6 +32,42 @@ class DuplicateFieldID(Exception):
     pass
 
 
+class GeometryCache(object):
+    """A least recently used cache of Shapely geometries.
+
+    The size of each geometry is approximated by the length of its WKB representation. The least recently used geometries are evicted when the total size would be more than ``max_bytes``; geometries larger than ``max_bytes`` are not cached."""
+    def __init__(self, max_bytes=CACHE_SIZE):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = self.misses = 0
+        self._data = OrderedDict()
+
+    def get(self, key):
+        """Get geometry for ``key``, or ``None`` if not in cache."""
+        try:
+            geom, _ = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return geom
+
+    def add(self, key, geom):
+        size = len(geom.wkb)
+        if size > self.max_bytes:
+            return
+        if key in self._data:
+            self.size -= self._data.pop(key)[1]
+        while self._data and self.size + size > self.max_bytes:
+            self.size -= self._data.popitem(last=False)[1][1]
+        self._data[key] = (geom, size)
+        self.size += size
+
+    def __len__(self):
+        return len(self._data)
+
+
 class Map(object):
     """A wrapper around fiona ``open`` that provides some additional functionality.
 
@@ -32,33 +85,92 @@ class Map(object):
         self.filepath = filepath
         self.fieldname = identifying_field
         self.metadata = kwargs
+        self.cache = None
+        # Measures of whole features, filled by ``get_intersection``
+        self.measures = {}
+        # Spatial indices of whole features by CRS, filled by
+        # ``get_intersections_bulk``
+        self.bulk_indices = {}
+        # Guards the fiona file, cache, and indices when a ``Map`` is shared
+        # between threads
+        self.lock = threading.RLock()
 
         assert check_type(filepath) == 'vector', \
             "Must give a vector dataset"
 
+        self.reopen()
+
+    def reopen(self):
+        """Open the underlying fiona file (again).
+
+        Needed when a ``Map`` is inherited by a forked process, as the GDAL file handle can't be shared between processes. ``pid`` is the process which opened the file."""
+        self.pid = os.getpid()
         with fiona.drivers():
             self.file = fiona.open(
                 self.filepath,
-                **kwargs
+                **self.metadata
             )
 
-    def iter_latlong(self, indices=None):
-        """Iterate over dataset as Shapely geometries in WGS 84 CRS."""
-        _ = partial(project, from_proj=self.crs, to_proj='')
+    def iter_latlong(self, indices=None, batch_size=1000):
+        """Iterate over dataset as Shapely geometries in WGS 84 CRS.
+
+        Features are read and projected in batches of ``batch_size``."""
+        return self.iter_projected('', indices, batch_size)
+
+    def enable_cache(self, max_bytes=CACHE_SIZE):
+        """Keep decoded and projected geometries in a ``GeometryCache`` of at most ``max_bytes``.
+
+        Once enabled, ``iter_latlong`` and ``iter_projected`` only read and project features which are not in the cache."""
+        self.cache = GeometryCache(max_bytes)
+        return self.cache
+
+    def iter_projected(self, to_proj, indices=None, batch_size=1000):
+        """Iterate over dataset as Shapely geometries in CRS ``to_proj``.
+
+        Features are read and projected in batches of ``batch_size``. Reading features and using the cache is done under ``lock``, but projection isn't, so a ``Map`` can be shared between threads if ``indices`` are given. Iterating over all features uses the cursor of the fiona file, which can't be shared."""
         if indices is None:
-            for index, feature in enumerate(self):
-                yield (index, _(shape(feature['geometry'])))
+            features = enumerate(self)
         else:
-            for index in indices:
-                yield (index, _(shape(self[index]['geometry'])))
-
-    def create_rtree_index(self):
+            features = ((index, None) for index in indices)
+
+        while True:
+            with self.lock:
+                batch = list(islice(features, batch_size))
+                if not batch:
+                    break
+
+                geoms = {}
+                if self.cache is not None:
+                    for index, _ in batch:
+                        geom = self.cache.get((index, to_proj))
+                        if geom is not None:
+                            geoms[index] = geom
+
+                missing = [(index, feature_geometry(feature or self[index]))
+                           for index, feature in batch if index not in geoms]
+                crs = self.crs if missing else None
+
+            if missing:
+                projected = project_many(
+                    (geom for _, geom in missing), crs, to_proj
+                )
+                with self.lock:
+                    for (index, _), geom in zip(missing, projected):
+                        geoms[index] = geom
+                        if self.cache is not None:
+                            self.cache.add((index, to_proj), geom)
+
+            for index, _ in batch:
+                yield (index, geoms[index])
+
+    def create_rtree_index(self, to_proj=''):
         """Create `rtree <http://toblerity.org/rtree/>`_ index for efficient spatial querying.
 
-        **Note**: Bounds are given in lat/long, not in the native CRS"""
+        **Note**: Bounds are given in lat/long, not in the native CRS, unless another CRS is given in ``to_proj``."""
         self.rtree_index = rtree.Rtree()
-        for index, geom in self.iter_latlong():
-            self.rtree_index.add(index, geom.bounds)
+        for index, geom in self.iter_projected(to_proj):
+            if not geom.is_empty:
+                self.rtree_index.add(index, geom.bounds)
         return self.rtree_index
 
     def get_fieldnames_dictionary(self, fieldname=None):
@@ -74,13 +186,28 @@ class Map(object):
             )
         return fd
 
+    def feature_hashes(self):
+        """SHA 256 hash of the geometry of each feature, from its WKB representation.
+
+        Returns a dictionary of feature index to hash. Only geometries are hashed, so changes to other fields don't change the hash. Features without a geometry have the hash ``NULL_GEOMETRY_HASH``."""
+        return {
+            index: NULL_GEOMETRY_HASH if obj['geometry'] is None
+            else hashlib.sha256(shape(obj['geometry']).wkb).hexdigest()
+            for index, obj in enumerate(self)
+        }
+
     @property
     def geometry(self):
+        """Geometry type of the features. If the schema doesn't give it, the type of all features if they have the same type, or the multi type if they have both single and multi geometries of a type, e.g. ``MultiPolygon`` for polygons and multipolygons; otherwise ``Unknown``."""
         geom = self.file.meta['schema']['geometry']
         if geom == 'Unknown':
             geoms = {obj['geometry']['type'] for obj in self}
             if len(geoms) == 1:
                 return geoms.pop()
+            multi = [g for g in geoms if g.startswith('Multi')]
+            if len(geoms) == 2 and len(multi) == 1 and \
+                    'Multi' + geoms.difference(multi).pop() == multi[0]:
+                return multi[0]
             else:
                 return 'Unknown'
         return geom
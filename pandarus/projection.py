@@ -1,7 +1,9 @@
 # -*- coding: utf-8 -*-
-from functools import partial
-from shapely.ops import transform
+from functools import lru_cache
+from shapely.geometry import Point, Polygon
+import numpy as np
 import pyproj
+import threading
 
 
 WGS84 = "+proj=longlat +ellps=WGS84 +datum=WGS84 +no_defs"
@@ -9,6 +11,14 @@ WGS84 = "+proj=longlat +ellps=WGS84 +datum=WGS84 +no_defs"
 # and http://cegis.usgs.gov/projection/pdf/nmdrs.usery.prn.pdf
 MOLLWEIDE = "+proj=moll +lon_0=0 +x_0=0 +y_0=0 +ellps=WGS84 +datum=WGS84 +units=m +no_defs"
 
+# Lower case fragments of the names of equal-area projection methods; see
+# ``is_equal_area``
+EQUAL_AREA_METHODS = ('equal area', 'mollweide', 'sinusoidal', 'equal earth')
+
+# Transformers of each thread, keyed by (from, to) CRS pair, both as given
+# and normalized. Value is ``None`` if no transformation is needed.
+_LOCAL = threading.local()
+
 
 def wgs84(s):
     """Fix no CRS or fiona giving abbreviated wgs84 definition.
@@ -20,6 +30,65 @@ def wgs84(s):
         return s
 
 
+@lru_cache(maxsize=None)
+def get_crs(s):
+    """Parse ``s`` to a ``pyproj.CRS``. Parsing is only done once per string.
+
+    Returns WGS84 if ``s`` is falsey."""
+    return pyproj.CRS.from_user_input(wgs84(s))
+
+
+def get_transformer(from_proj=None, to_proj=None):
+    """Get a reusable ``pyproj.Transformer`` from ``from_proj`` to ``to_proj``.
+
+    Same defaults as ``project``: WGS84 for input and Mollweide for output. Transformers are stored in a registry keyed by the normalized CRS pair, so different strings for the same CRS share a transformer. Each thread has its own registry, as older versions of ``pyproj`` can't share transformers between threads; it is freed when the thread exits.
+
+    Returns ``None`` if ``from_proj`` and ``to_proj`` are the same CRS, or are both lat/long; in this case no transformation is needed."""
+    transformers = getattr(_LOCAL, 'transformers', None)
+    if transformers is None:
+        transformers = _LOCAL.transformers = {}
+    try:
+        return transformers[(from_proj, to_proj)]
+    except KeyError:
+        pass
+
+    from_crs = get_crs(from_proj)
+    to_crs = get_crs(MOLLWEIDE if to_proj is None else to_proj)
+    key = (from_crs.to_wkt(), to_crs.to_wkt())
+    if key not in transformers:
+        if ((from_crs == to_crs) or
+                (from_crs.is_geographic and to_crs.is_geographic)):
+            transformers[key] = None
+        else:
+            transformers[key] = pyproj.Transformer.from_crs(
+                from_crs, to_crs, always_xy=True
+            )
+    transformers[(from_proj, to_proj)] = transformers[key]
+    return transformers[key]
+
+
+@lru_cache(maxsize=None)
+def is_equal_area(proj):
+    """Whether ``proj`` is a projected CRS with an equal-area projection, such as Mollweide or Lambert azimuthal equal-area, in which areas can be measured directly."""
+    crs = get_crs(proj)
+    if not crs.is_projected or crs.coordinate_operation is None:
+        return False
+    name = crs.coordinate_operation.method_name.lower()
+    return any(method in name for method in EQUAL_AREA_METHODS)
+
+
+def get_working_crs(*projs):
+    """Choose a CRS in which to intersect and measure datasets with CRS ``projs``.
+
+    If all of ``projs`` are the same projected CRS, returns the first of ``projs``; otherwise returns Mollweide, an equal-area projection. The shared CRS isn't necessarily equal-area; see ``is_equal_area``.
+
+    Returns a ``PROJ4`` string."""
+    crs = [get_crs(proj) for proj in projs]
+    if crs and crs[0].is_projected and all(c == crs[0] for c in crs[1:]):
+        return projs[0]
+    return MOLLWEIDE
+
+
 def project(geom, from_proj=None, to_proj=None):
     """
 Project a ``shapely`` geometry, and returns a new geometry of the same type from the transformed coordinates.
@@ -35,17 +104,61 @@ Returns:
     A ``shapely`` geometry.
 
     """
-    from_proj = wgs84(from_proj)
-    if to_proj is None:
-        to_proj = MOLLWEIDE
+    return project_many([geom], from_proj, to_proj)[0]
+
+
+def _sequences(geom):
+    """Yield the coordinate sequences of ``geom``, in the order used by ``_rebuild``."""
+    if geom.is_empty:
+        return
+    if geom.geom_type in ('Point', 'LineString', 'LinearRing'):
+        yield geom.coords
+    elif geom.geom_type == 'Polygon':
+        yield geom.exterior.coords
+        for ring in geom.interiors:
+            yield ring.coords
     else:
-        to_proj = wgs84(to_proj)
+        for part in geom.geoms:
+            yield from _sequences(part)
 
-    to_proj, from_proj = pyproj.Proj(to_proj), pyproj.Proj(from_proj)
 
-    if ((to_proj == from_proj) or
-            (to_proj.is_latlong() and from_proj.is_latlong())):
+def _rebuild(geom, arrays):
+    """Build a new geometry like ``geom``, taking coordinates from the iterator ``arrays``."""
+    if geom.is_empty:
         return geom
+    if geom.geom_type == 'Point':
+        return Point(next(arrays)[0])
+    elif geom.geom_type in ('LineString', 'LinearRing'):
+        return type(geom)(next(arrays))
+    elif geom.geom_type == 'Polygon':
+        exterior = next(arrays)
+        return Polygon(exterior, [next(arrays) for _ in geom.interiors])
+    else:
+        return type(geom)([_rebuild(part, arrays) for part in geom.geoms])
+
+
+def project_many(geoms, from_proj=None, to_proj=None):
+    """Project many ``shapely`` geometries in one call.
+
+    Same defaults as ``project``. The coordinates of all ``geoms`` are gathered in one contiguous array, which is transformed in a single call, and the geometries are then rebuilt from the transformed coordinates. Z values, if present, are not changed.
+
+    Returns a list of ``shapely`` geometries, in the same order as ``geoms``."""
+    geoms = list(geoms)
+    transformer = get_transformer(from_proj, to_proj)
+    if transformer is None:
+        return geoms
+
+    arrays = [np.asarray(seq) for geom in geoms for seq in _sequences(geom)]
+    if not arrays:
+        return geoms
+
+    buffer = np.concatenate([array[:, :2] for array in arrays])
+    xs, ys = transformer.transform(buffer[:, 0], buffer[:, 1])
+    buffer = np.column_stack((xs, ys))
 
-    projection_func = partial(pyproj.transform, from_proj, to_proj)
-    return transform(projection_func, geom)
+    offsets = np.cumsum([len(array) for array in arrays])[:-1]
+    projected = (
+        np.hstack((new, old[:, 2:])) if old.shape[1] > 2 else new
+        for new, old in zip(np.split(buffer, offsets), arrays)
+    )
+    return [_rebuild(geom, projected) for geom in geoms]
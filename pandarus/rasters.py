@@ -179,7 +179,7 @@ def gen_zonal_stats(
         for _, feat in enumerate(features_iter):
             geom = shape(feat['geometry'])
 
-            if 'Point' in geom.type:
+            if 'Point' in geom.geom_type:
                 geom = boxify_points(geom, rast)
                 percent_cover = False
 
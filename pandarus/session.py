@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+from .calculate import CPU_COUNT, intersect
+from .intersections import (
+    BACKENDS,
+    close_pool,
+    create_pool,
+    logger_init,
+    logger_stop,
+    release_to_map,
+    unlink_packed,
+)
+
+
+class Session(object):
+    """Keep workers, loaded datasets, and logging alive across many calculations.
+
+    Each call to ``intersect`` normally starts a new pool of workers and a new log file, and loads the second dataset and its spatial index again. A ``Session`` creates its pools when first needed, and keeps them until ``close`` is called; workers keep the datasets they have loaded, and the session keeps one log file.
+
+    Input parameters:
+
+        * ``cpus``: Integer, default is ``multiprocessing.cpu_count()``. Number of workers in each pool.
+        * ``log_dir``: String, optional. Directory of the session log file.
+        * ``start_method``: String, optional. ``multiprocessing`` start method of the worker processes, such as ``fork``, ``spawn``, or ``forkserver``; see ``create_pool``.
+
+    Use as a context manager, or call ``close`` when finished:
+
+    .. code-block:: python
+
+        with Session(cpus=4) as session:
+            for first_fp, second_fp in pairs:
+                session.intersect(first_fp, 'name', second_fp, 'name')
+
+    """
+    def __init__(self, cpus=CPU_COUNT, log_dir=None, start_method=None):
+        self.cpus = cpus
+        self.start_method = start_method
+        self.queue_listener, self.logging_queue = logger_init(
+            log_dir, start_method
+        )
+        self.pools = {}
+        # Filepaths of ``to`` maps loaded in this process
+        self.to_maps = set()
+        # Shared memory blocks of failed runs, whose jobs can still be running
+        self.shared_blocks = set()
+        self.closed = False
+
+    def get_pool(self, backend='processes'):
+        """Get the pool of workers for ``backend``, creating it if needed."""
+        if self.closed:
+            raise ValueError("Session is closed")
+        if backend not in BACKENDS:
+            raise ValueError("Unknown backend: {}".format(backend))
+        if backend not in self.pools:
+            self.pools[backend] = create_pool(
+                backend, self.cpus, self.logging_queue, self.start_method
+            )
+        return self.pools[backend]
+
+    def intersect(self, *args, **kwargs):
+        """Call ``intersect`` with the workers of this session. Takes the same arguments as ``intersect``, except ``cpus`` and ``log_dir``."""
+        kwargs.setdefault('cpus', self.cpus)
+        return intersect(*args, session=self, **kwargs)
+
+    def close(self, terminate=False):
+        """Stop all workers and logging, unload datasets, and free the shared memory of failed runs. Can be called more than once.
+
+        Idle workers are left to exit on their own; if ``terminate``, they are killed instead (see ``close_pool``)."""
+        if self.closed:
+            return
+        for pool in self.pools.values():
+            close_pool(pool, terminate)
+        self.pools = {}
+        unlink_packed(self.shared_blocks)
+        self.shared_blocks = set()
+        for filepath in self.to_maps:
+            release_to_map(filepath)
+        self.to_maps = set()
+        logger_stop(self.queue_listener)
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *args):
+        self.close(terminate=exc_type is not None)
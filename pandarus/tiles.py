@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+from .intersections import checkpoint_key, intersection_dispatcher, release_to_map
+from .maps import Map
+from .projection import WGS84, get_working_crs
+from fiona.crs import from_string
+from itertools import product
+from shapely.geometry import mapping
+import fiona
+import logging
+import math
+import numpy as np
+import os
+import tempfile
+
+
+# Number of features kept in memory by ``write_tiles`` before they are
+# appended to the tile files
+TILE_BATCH_SIZE = 100000
+
+# Feature bounds of the most recently used tile files, by filepath; see
+# ``tile_bounds``
+_TILE_BOUNDS = {}
+
+TILE_SCHEMA = {
+    'geometry': 'Unknown',
+    'properties': {
+        'index': 'int',
+        'minx': 'float',
+        'miny': 'float',
+        'maxx': 'float',
+        'maxy': 'float',
+    },
+}
+
+
+def tile_range(lower, upper, tile_size):
+    """Indices of the tiles of size ``tile_size`` which touch the interval from ``lower`` to ``upper``."""
+    return range(
+        int(math.floor(lower / tile_size)),
+        int(math.floor(upper / tile_size)) + 1
+    )
+
+
+def tile_path(dirpath, name, tile):
+    """Filepath of the tile file with index ``tile`` for dataset ``name``."""
+    return os.path.join(dirpath, "{}_{}_{}.gpkg".format(name, *tile))
+
+
+def write_tiles(filepath, dirpath, name, tile_size, indices=None,
+                batch_size=TILE_BATCH_SIZE):
+    """Write the features of the vector dataset at ``filepath`` to tiles on disk.
+
+    Tiles are squares of ``tile_size`` degrees, on a grid in WGS84 starting from (0, 0). Each feature is written, in WGS84, to every tile which its bounds touch. Features are read, and written in batches of ``batch_size``, so memory use doesn't depend on the size of the dataset. If ``indices`` are given, only these features are written.
+
+    Each tile is a GeoPackage in ``dirpath``, named with ``name`` and the tile index (see ``tile_path``). Its features have the index of the feature in the dataset, and the bounds of the feature in WGS84.
+
+    Returns a dictionary of tile index to tile filepath."""
+    tiles, batch, count = {}, {}, 0
+
+    def flush():
+        for tile, features in batch.items():
+            if tile in tiles:
+                with fiona.open(tiles[tile], 'a') as sink:
+                    sink.writerecords(features)
+            else:
+                tiles[tile] = tile_path(dirpath, name, tile)
+                with fiona.open(tiles[tile], 'w', driver='GPKG',
+                                crs=from_string(WGS84),
+                                schema=TILE_SCHEMA) as sink:
+                    sink.writerecords(features)
+        batch.clear()
+
+    for index, geom in Map(filepath).iter_latlong(indices):
+        if geom.is_empty:
+            continue
+        minx, miny, maxx, maxy = geom.bounds
+        feature = {
+            'geometry': mapping(geom),
+            'properties': {
+                'index': int(index),
+                'minx': minx,
+                'miny': miny,
+                'maxx': maxx,
+                'maxy': maxy,
+            },
+        }
+        for tile in product(tile_range(minx, maxx, tile_size),
+                            tile_range(miny, maxy, tile_size)):
+            batch.setdefault(tile, []).append(feature)
+            count += 1
+        if count >= batch_size:
+            flush()
+            count = 0
+    flush()
+    return tiles
+
+
+def read_tile(filepath):
+    """Read the dataset feature indices and bounds of the features in a tile file.
+
+    Returns a NumPy array of indices, and an array of bounds with one row per feature."""
+    with fiona.open(filepath) as source:
+        rows = [
+            (f['properties']['index'], f['properties']['minx'],
+             f['properties']['miny'], f['properties']['maxx'],
+             f['properties']['maxy'])
+            for f in source
+        ]
+    rows = np.array(rows, dtype=float).reshape(-1, 5)
+    return rows[:, 0].astype(np.int64), rows[:, 1:]
+
+
+def tile_bounds(filepath):
+    """Bounds of the features of the tile file at ``filepath``, as given by ``read_tile``.
+
+    Only the bounds of the two most recently used tiles, i.e. the ``from`` and ``to`` tiles being calculated, are kept in memory."""
+    if filepath not in _TILE_BOUNDS:
+        if len(_TILE_BOUNDS) >= 2:
+            _TILE_BOUNDS.clear()
+        _TILE_BOUNDS[filepath] = read_tile(filepath)[1]
+    return _TILE_BOUNDS[filepath]
+
+
+def tile_owner(first, second, tile_size):
+    """Index of the tile which owns the pair of features with WGS84 bounds ``first`` and ``second``: the tile which contains the lower left corner of the intersection of both bounds.
+
+    ``first`` and ``second`` are NumPy arrays with one row of bounds per pair. Returns arrays of the ``x`` and ``y`` indices of the tiles."""
+    x = np.maximum(first[:, 0], second[:, 0])
+    y = np.maximum(first[:, 1], second[:, 1])
+    return np.floor(x / tile_size).astype(np.int64), np.floor(y / tile_size).astype(np.int64)
+
+
+class TileOwner(object):
+    """Candidate filter for ``intersection_worker``, which only keeps the pairs of features owned by ``tile`` (see ``tile_owner``), so that pairs found in several tiles are only overlaid once.
+
+    ``from_fp`` and ``to_fp`` are the tile files of ``tile``; the bounds of their features are read by each process which uses the filter, with ``tile_bounds``."""
+    def __init__(self, tile, tile_size, from_fp, to_fp):
+        self.tile = tuple(tile)
+        self.tile_size = tile_size
+        self.from_fp = from_fp
+        self.to_fp = to_fp
+
+    def __call__(self, from_index, candidates):
+        if not candidates:
+            return candidates
+        to_bounds = tile_bounds(self.to_fp)[candidates]
+        from_bounds = np.repeat(
+            tile_bounds(self.from_fp)[[from_index]], len(candidates), axis=0
+        )
+        x, y = tile_owner(from_bounds, to_bounds, self.tile_size)
+        keep = (x == self.tile[0]) & (y == self.tile[1])
+        return [index for index, kept in zip(candidates, keep) if kept]
+
+    def __repr__(self):
+        # Used in checkpoint keys, which shouldn't depend on temporary paths
+        return "TileOwner({}, {})".format(self.tile, self.tile_size)
+
+
+def tiled_dispatcher(from_map, to_map, tile_size, from_objs=None,
+                     tile_dir=None, callback=None, metrics=None, **kwargs):
+    """Calculate the intersections of ``from_map`` and ``to_map`` one spatial tile at a time, for datasets which don't fit in memory.
+
+    Both datasets are first written to tiles of ``tile_size`` degrees in ``tile_dir`` (a temporary directory by default) with ``write_tiles``. Then, for each tile with features from both datasets, the intersections of its features are calculated with ``intersection_dispatcher``, so that only one tile of each dataset is loaded at a time. Tile files are deleted once used.
+
+    Features which span several tiles are in all of them. Each pair of features is only overlaid in the tile which owns it (see ``tile_owner`` and ``TileOwner``), so no pairs are lost or counted twice, and no overlay is repeated; with the ``bulk`` engine, pairs owned by other tiles are dropped after the overlay instead.
+
+    Tiles are in WGS84. If ``projected``, the working CRS is chosen from the CRS of ``from_map`` and ``to_map``, as without tiles, and passed on to the workers.
+
+    Results use the feature indices of ``from_map`` and ``to_map``. If ``callback`` is given, it is called with the results of each tile, and ``None`` is returned; otherwise the results of all tiles are returned in one dictionary, as with ``intersection_dispatcher``.
+
+    With ``checkpoint_dir``, the checkpoints of each tile are keyed by the hashes of ``from_map`` and ``to_map``, the tile and the options, so an interrupted run resumes from the tiles and jobs which finished; see ``intersection_dispatcher``.
+
+    If ``metrics`` is a dictionary, it is updated with the number of tiles, the checkpoint directories which were kept, and the features which failed (see ``intersection_dispatcher``).
+
+    Additional ``kwargs``, such as ``cpus``, are passed to ``intersection_dispatcher``. If ``cpus`` is given, one ``Session`` is used for all tiles, so the same workers calculate every tile; each worker only keeps the ``to`` tile it is working on. ``session``, ``packed`` and ``shard_dir`` aren't supported."""
+    for key in ('session', 'packed', 'shard_dir'):
+        if kwargs.get(key):
+            raise ValueError("``{}`` can't be used with tiles".format(key))
+    kwargs.pop('session', None)
+
+    if kwargs.get('checkpoint_dir'):
+        # Tile files are written again on every run, so checkpoints are keyed
+        # by the datasets instead; the tile is part of the ``candidate_filter``
+        kwargs['checkpoint_source'] = checkpoint_key(from_map, to_map, {
+            'tile_size': tile_size,
+            'from_objs': sorted(from_objs) if from_objs else None,
+        })
+
+    if kwargs.get('projected'):
+        kwargs['working_crs'] = get_working_crs(Map(from_map).crs, Map(to_map).crs)
+
+    session = None
+    if kwargs.get('cpus'):
+        # Imported here, as ``session`` imports ``calculate``, which imports
+        # this module
+        from .session import Session
+        session = Session(
+            kwargs['cpus'], kwargs.pop('log_dir', None), kwargs.pop('start_method', None)
+        )
+
+    results, failures, checkpoints = {}, {}, []
+    try:
+        with tempfile.TemporaryDirectory(dir=tile_dir) as dirpath:
+            from_tiles = write_tiles(from_map, dirpath, 'from', tile_size, from_objs)
+            to_tiles = write_tiles(to_map, dirpath, 'to', tile_size)
+            tiles = sorted(set(from_tiles).intersection(to_tiles))
+            logging.info("Intersecting {} tiles of {} degrees".format(
+                len(tiles), tile_size
+            ))
+
+            for tile in tiles:
+                from_indices, from_bounds = read_tile(from_tiles[tile])
+                to_indices, to_bounds = read_tile(to_tiles[tile])
+                tile_metrics = {}
+                tile_results = intersection_dispatcher(
+                    from_tiles[tile],
+                    to_tiles[tile],
+                    metrics=tile_metrics,
+                    session=session,
+                    candidate_filter=TileOwner(
+                        tile, tile_size, from_tiles[tile], to_tiles[tile]
+                    ),
+                    exclusive=True,
+                    **kwargs
+                )
+                release_to_map(to_tiles[tile])
+
+                kept = {}
+                if tile_results:
+                    pairs = np.array(list(tile_results), dtype=np.int64)
+                    x, y = tile_owner(
+                        from_bounds[pairs[:, 0]], to_bounds[pairs[:, 1]], tile_size
+                    )
+                    for (i, j), owned in zip(
+                            pairs.tolist(), (x == tile[0]) & (y == tile[1])):
+                        if owned:
+                            kept[(int(from_indices[i]), int(to_indices[j]))] = \
+                                tile_results[(i, j)]
+                checkpoints.extend(tile_metrics.get('checkpoints', []))
+                for row in tile_metrics.get('failures', []):
+                    row['index'] = int(from_indices[row['index']])
+                    failures.setdefault(row['index'], row)
+
+                if callback is not None:
+                    callback(kept)
+                else:
+                    results.update(kept)
+                for filepath in (from_tiles[tile], to_tiles[tile]):
+                    os.remove(filepath)
+    except BaseException:
+        if session is not None:
+            session.close(terminate=True)
+        raise
+    finally:
+        if session is not None:
+            session.close()
+        _TILE_BOUNDS.clear()
+
+    if metrics is not None:
+        metrics.update({
+            'tiles': len(tiles),
+            'checkpoints': checkpoints,
+            'failures': [failures[index] for index in sorted(failures)],
+        })
+    return None if callback is not None else results
@@ -5,7 +5,7 @@ requirements = [
     "appdirs",
     "fiona",
     "numpy",
-    "pyproj",
+    "pyproj>=2.2",
     "Rtree",
     "rasterio",
     "rasterstats",
@@ -16,6 +16,9 @@ setup(
     version="1.0.4",
     author="Chris Mutel",
     author_email="cmutel@gmail.com",
+    entry_points={
+        'console_scripts': ['pandarus = pandarus.cli:main'],
+    },
     classifiers=[
         'Development Status :: 5 - Production/Stable',
         'Intended Audience :: End Users/Desktop',
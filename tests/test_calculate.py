@@ -1,12 +1,16 @@
 from pandarus import (
     calculate_remaining,
     intersect,
+    intersect_many,
     intersections_from_intersection,
     Map,
     raster_statistics,
 )
 from pandarus.filesystem import json_importer
-from pandarus.calculate import as_features
+from pandarus.calculate import as_features, feature_writer, write_features
+from queue import Queue
+from shapely.errors import TopologicalError
+from shapely.geometry import Point
 import fiona
 import json
 import numpy as np
@@ -31,9 +35,12 @@ def fake_zonal_stats(vector, *args, **kwargs):
     for i, f in enumerate(Map(vector, 'name')):
         yield i
 
-def fake_intersection(first, second, indices=None, cpus=None, log_dir=None):
+def fake_intersection(first, second, indices=None, cpus=None, log_dir=None, callback=None, **kwargs):
     _, geom = next(Map(second).iter_latlong())
-    return {(0, 0): {'measure': 42, 'geom': geom}}
+    results = {(0, 0): {'measure': 42, 'geom': geom}}
+    if callback is None:
+        return results
+    callback(results)
 
 def test_rasterstats_invalid():
     with pytest.raises(AssertionError):
@@ -124,6 +131,287 @@ def test_as_features(monkeypatch):
     dct = {(1, 2): {'measure': 42, 'geom': 'Foo'}}
     assert next(as_features(dct)) == expected
 
+def test_as_features_start(monkeypatch):
+    monkeypatch.setattr(
+        'pandarus.calculate.mapping',
+        lambda x: x
+    )
+    dct = {(1, 2): {'measure': 42, 'geom': 'Foo'}, (3, 4): {'measure': 1, 'geom': 'Bar'}}
+    assert [f['properties']['id'] for f in as_features(dct, 5)] == [5, 6]
+
+def test_as_features_no_geometries():
+    feature = next(as_features({(1, 2): {'measure': 42}}))
+    assert feature['geometry'] is None
+    assert feature['properties']['measure'] == 42
+
+class FakeSink(object):
+    def __init__(self):
+        self.batches = []
+
+    def writerecords(self, records):
+        self.batches.append(records)
+
+class FakeTable(list):
+    def write(self, rows):
+        self.extend(rows)
+
+def test_write_features():
+    features = [
+        {'geometry': None, 'properties': {'id': i, 'from_label': i, 'to_label': 'a', 'measure': 1.}}
+        for i in range(5)
+    ]
+    sink, table = FakeSink(), FakeTable()
+    assert write_features(iter(features), sink, table, batch_size=2) == 5
+    assert [len(batch) for batch in sink.batches] == [2, 2, 1]
+    assert table == [(i, 'a', 1.) for i in range(5)]
+
+def test_feature_writer(monkeypatch):
+    monkeypatch.setattr(
+        'pandarus.calculate.mapping',
+        lambda x: x
+    )
+    queue, errors = Queue(), []
+    queue.put({(1, 2): {'measure': 42, 'geom': 'Foo'}})
+    queue.put({(3, 4): {'measure': 1, 'geom': 'Bar'}})
+    queue.put(None)
+    sink, table = FakeSink(), FakeTable()
+    feature_writer(queue, sink, table, errors)
+    assert not errors
+    assert [f['properties']['id'] for batch in sink.batches for f in batch] == [0, 1]
+    assert table == [(1, 2, 42), (3, 4, 1)]
+
+def test_feature_writer_error():
+    class BrokenSink(object):
+        def writerecords(self, records):
+            raise IOError
+
+    queue, errors = Queue(), []
+    queue.put({(1, 2): {'measure': 42, 'geom': Point(0, 0)}})
+    queue.put({(3, 4): {'measure': 1, 'geom': Point(0, 0)}})
+    queue.put(None)
+    feature_writer(queue, BrokenSink(), FakeTable(), errors)
+    assert len(errors) == 1
+    assert queue.empty()
+
+def test_intersect_writer_error_stops_calculation(monkeypatch):
+    calls = []
+
+    def many_jobs(first, second, callback=None, **kwargs):
+        _, geom = next(Map(second).iter_latlong())
+        for _ in range(1000):
+            calls.append(1)
+            callback({(0, 0): {'measure': 42, 'geom': geom}})
+
+    def broken(*args, **kwargs):
+        raise IOError("disk full")
+
+    monkeypatch.setattr('pandarus.calculate.intersection_dispatcher', many_jobs)
+    monkeypatch.setattr('pandarus.calculate.write_features', broken)
+    with tempfile.TemporaryDirectory() as dirpath:
+        with pytest.raises(IOError):
+            intersect(grid, 'name', square, 'name', dirpath=dirpath, cpus=None)
+    assert len(calls) < 100
+
+def test_intersect_pool():
+    with tempfile.TemporaryDirectory() as dirpath:
+        vector_fp, data_fp = intersect(grid, 'name', square, 'name', dirpath=dirpath, cpus=2, driver='GPKG')
+        assert data_fp.endswith(".bz2")
+        data = json_importer(data_fp)
+        assert sorted(row[0] for row in data['data']) == ['grid cell {}'.format(i) for i in range(4)]
+        with fiona.open(vector_fp) as source:
+            features = list(source)
+        assert [f['properties']['id'] for f in features] == [0, 1, 2, 3]
+        assert [[f['properties'][key] for key in ('from_label', 'to_label', 'measure')]
+                for f in features] == data['data']
+
+def test_intersect_no_geometries():
+    with tempfile.TemporaryDirectory() as dirpath:
+        _, data_fp = intersect(grid, 'name', square, 'name', dirpath=dirpath, compress=False, cpus=None, driver='GPKG')
+        expected = json.load(open(data_fp))['data']
+
+    with tempfile.TemporaryDirectory() as dirpath:
+        vector_fp, data_fp = intersect(grid, 'name', square, 'name', dirpath=dirpath, compress=False, cpus=2, geometries=False)
+        assert vector_fp is None
+        assert os.listdir(dirpath) == [os.path.basename(data_fp)]
+        data = json.load(open(data_fp))
+        assert sorted(data['data']) == sorted(expected)
+        assert data['metadata'].keys() == {'first', 'second', 'when'}
+
+def test_intersect_failed():
+    with tempfile.TemporaryDirectory() as dirpath:
+        _, data_fp = intersect(grid, 'name', square, 'name', dirpath=dirpath, compress=False, cpus=2, feature_timeout=-1)
+        data = json.load(open(data_fp))
+        assert data['data'] == []
+        assert data['metadata'].keys() == {'first', 'second', 'when', 'failed'}
+        assert [row['id'] for row in data['metadata']['failed']] == \
+            ['grid cell 0', 'grid cell 1', 'grid cell 2', 'grid cell 3']
+        assert data['metadata']['failed'][0]['error'].startswith('FeatureTimeout')
+
+def test_intersect_incremental(monkeypatch):
+    from pandarus import calculate
+    calls = []
+
+    def spy(*args, **kwargs):
+        calls.append(kwargs.get('from_objs'))
+        return calculate_dispatcher(*args, **kwargs)
+
+    calculate_dispatcher = calculate.intersection_dispatcher
+    monkeypatch.setattr('pandarus.calculate.intersection_dispatcher', spy)
+
+    def edit(fp, name, offset):
+        with open(fp) as f:
+            data = json.load(f)
+        for feature in data['features']:
+            if feature['properties']['name'] == name:
+                feature['geometry']['coordinates'] = [
+                    [[x + offset, y] for x, y in ring]
+                    for ring in feature['geometry']['coordinates']
+                ]
+        with open(fp, 'w') as f:
+            json.dump(data, f)
+
+    def results(data_fp):
+        return sorted((row[0], row[1], round(row[2])) for row in json_importer(data_fp)['data'])
+
+    with tempfile.TemporaryDirectory() as inputs, tempfile.TemporaryDirectory() as outputs:
+        first, second = os.path.join(inputs, 'grid.geojson'), os.path.join(inputs, 'square.geojson')
+        shutil.copy(grid, first)
+        shutil.copy(square, second)
+        kwargs = dict(dirpath=outputs, cpus=None, incremental=True)
+
+        _, data_fp = intersect(first, 'name', second, 'name', **kwargs)
+        assert calls == [None]
+        assert len(os.listdir(outputs)) == 3
+
+        edit(first, 'grid cell 1', 0.25)
+        vector_fp, data_fp = intersect(first, 'name', second, 'name', **kwargs)
+        assert calls[-1] == [1]
+        assert len(os.listdir(outputs)) == 3
+        with tempfile.TemporaryDirectory() as dirpath:
+            expected = results(intersect(first, 'name', second, 'name', dirpath=dirpath, cpus=None)[1])
+        assert results(data_fp) == expected
+        with fiona.open(vector_fp) as source:
+            assert sorted(f['properties']['id'] for f in source) == [0, 1, 2, 3]
+
+        del calls[:]
+        intersect(first, 'name', second, 'name', **kwargs)
+        assert calls == []
+
+        edit(second, 'single', 0.1)
+        _, data_fp = intersect(first, 'name', second, 'name', **kwargs)
+        assert calls == [[0, 1, 2, 3]]
+
+        _, data_fp = intersect(first, 'name', second, 'name', geometries=False, **kwargs)
+        assert calls[-1] is None
+        edit(first, 'grid cell 3', 0.1)
+        _, data_fp = intersect(first, 'name', second, 'name', geometries=False, **kwargs)
+        assert calls[-1] == [3]
+        with tempfile.TemporaryDirectory() as dirpath:
+            expected = results(intersect(first, 'name', second, 'name', dirpath=dirpath, cpus=None)[1])
+        assert results(data_fp) == expected
+
+def test_intersect_incremental_null_geometry():
+    with tempfile.TemporaryDirectory() as inputs, tempfile.TemporaryDirectory() as outputs:
+        first = os.path.join(inputs, 'grid.geojson')
+        with open(grid) as f:
+            data = json.load(f)
+        data['features'].append({
+            'type': 'Feature', 'properties': {'name': 'no geometry'}, 'geometry': None
+        })
+        with open(first, 'w') as f:
+            json.dump(data, f)
+
+        kwargs = dict(dirpath=outputs, cpus=None, incremental=True)
+        _, data_fp = intersect(first, 'name', square, 'name', **kwargs)
+        expected = sorted(row[:2] for row in json_importer(data_fp)['data'])
+        assert [row[0] for row in expected] == ['grid cell {}'.format(i) for i in range(4)]
+        _, data_fp = intersect(first, 'name', square, 'name', **kwargs)
+        assert sorted(row[:2] for row in json_importer(data_fp)['data']) == expected
+
+def test_intersect_checkpoints_kept_until_written(monkeypatch):
+    from pandarus import calculate
+    write_features = calculate.write_features
+
+    def failing(*args, **kwargs):
+        raise OSError("disk full")
+
+    with tempfile.TemporaryDirectory() as dirpath, \
+            tempfile.TemporaryDirectory() as checkpoint_dir:
+        kwargs = dict(dirpath=dirpath, cpus=1, geometries=False,
+                      checkpoint_dir=checkpoint_dir, log_dir=dirpath)
+        monkeypatch.setattr('pandarus.calculate.write_features', failing)
+        with pytest.raises(OSError):
+            intersect(grid, 'name', square, 'name', **kwargs)
+        run_dir, = os.listdir(checkpoint_dir)
+        assert os.listdir(os.path.join(checkpoint_dir, run_dir))
+
+        monkeypatch.setattr('pandarus.calculate.write_features', write_features)
+        _, data_fp = intersect(grid, 'name', square, 'name', **kwargs)
+        assert len(json_importer(data_fp)['data']) == 4
+        assert os.listdir(checkpoint_dir) == []
+
+
+def test_intersect_many():
+    with tempfile.TemporaryDirectory() as dirpath:
+        vector_fp, data_fp = intersect_many(
+            [(grid, 'name'), (square, 'name'), (grid, 'name', {})],
+            dirpath=dirpath, cpus=None, driver='GPKG'
+        )
+        assert os.path.basename(data_fp).count('.') == 4
+        data = json_importer(data_fp)
+        assert [row['filename'] for row in data['metadata']['datasets']] == [
+            'grid.geojson', 'square.geojson', 'grid.geojson'
+        ]
+        assert [row[:3] for row in data['data']] == [
+            ['grid cell {}'.format(index), 'single', 'grid cell {}'.format(index)]
+            for index in range(4)
+        ]
+        with fiona.open(vector_fp) as src:
+            assert src.schema['geometry'] == 'MultiPolygon'
+            assert list(src.schema['properties']) == [
+                'id', 'label_1', 'label_2', 'label_3', 'measure'
+            ]
+            assert [f['properties']['measure'] for f in src] == [
+                row[3] for row in data['data']
+            ]
+
+
+def test_intersect_many_same_as_intersect():
+    with tempfile.TemporaryDirectory() as dirpath:
+        vector_fp, data_fp = intersect_many(
+            [(grid, 'name'), (square, 'name')], dirpath=dirpath, cpus=None,
+            geometries=False
+        )
+        assert vector_fp is None
+        result = json_importer(data_fp)['data']
+        _, data_fp = intersect(grid, 'name', square, 'name', dirpath=dirpath,
+                               cpus=None, geometries=False)
+        expected = json_importer(data_fp)['data']
+        assert sorted(row[:2] for row in result) == sorted(row[:2] for row in expected)
+        assert sorted(row[2] for row in result) == pytest.approx(
+            sorted(row[2] for row in expected)
+        )
+
+
+def test_intersect_many_failed(monkeypatch):
+    def broken(*args, **kwargs):
+        raise TopologicalError("broken")
+
+    monkeypatch.setattr('pandarus.cascade.get_intersection', broken)
+    with tempfile.TemporaryDirectory() as dirpath:
+        _, data_fp = intersect_many([(grid, 'name'), (square, 'name')],
+                                    dirpath=dirpath, cpus=None)
+        data = json_importer(data_fp)
+        assert data['data'] == []
+        assert [row['id'] for row in data['metadata']['failed']] == [
+            'grid cell {}'.format(index) for index in range(4)
+        ]
+
+
+def test_intersect_many_one_dataset():
+    with pytest.raises(ValueError):
+        intersect_many([(grid, 'name')])
+
 def test_intersect(monkeypatch):
     monkeypatch.setattr(
         'pandarus.calculate.intersection_dispatcher',
@@ -187,6 +475,24 @@ def test_intersect_overwrite_existing(monkeypatch):
 
         assert len(fiona.open(vector_fp)) == 1
 
+def test_intersect_shards():
+    with tempfile.TemporaryDirectory() as dirpath:
+        vector_fp, data_fp = intersect(grid, 'name', square, 'name', dirpath=dirpath, compress=False, cpus=None, driver='GPKG')
+        expected = json.load(open(data_fp))['data']
+
+        vector_fp, data_fp = intersect(grid, 'name', square, 'name', dirpath=dirpath, compress=False, cpus=2, driver='GPKG', shard_driver='GPKG')
+        data = json.load(open(data_fp))['data']
+        assert [row[:2] for row in data] == [
+            ['grid cell {}'.format(index), 'single'] for index in range(4)
+        ]
+        assert sorted(data) == sorted(expected)
+        with fiona.open(vector_fp) as source:
+            assert [f['properties']['id'] for f in source] == [0, 1, 2, 3]
+            assert [f['properties']['from_label'] for f in source] == [row[0] for row in data]
+        assert sorted(os.listdir(dirpath)) == sorted(
+            os.path.basename(fp) for fp in (vector_fp, data_fp)
+        )
+
 def test_calculate_remaining():
     # Remaining area is 0.5°  by 1°.
     # Circumference of earth is 40.000 km
@@ -204,6 +510,24 @@ def test_calculate_remaining():
     assert data['metadata']['intersections'].keys() == {'field', 'filename', 'path', 'sha256'}
     assert data['metadata']['source'].keys() == {'field', 'filename', 'path', 'sha256'}
 
+def test_calculate_remaining_geodesic():
+    area = 1/2 * (4e7 / 360) ** 2
+
+    with tempfile.TemporaryDirectory() as dirpath:
+        data_fp = calculate_remaining(outside, 'name', remain_result, dirpath=dirpath, compress=False, measure_engine='geodesic')
+        data = json.load(open(data_fp))
+
+    assert data['data'][0][0] == 'by-myself'
+    assert np.isclose(area, data['data'][0][1], rtol=1e-2)
+
+def test_intersect_wrong_measure_engine():
+    with pytest.raises(ValueError):
+        intersect(grid, 'name', square, 'name', cpus=None, measure_engine='foo')
+
+def test_intersect_wrong_engine():
+    with pytest.raises(ValueError):
+        intersect(grid, 'name', square, 'name', cpus=None, engine='foo')
+
 def test_calculate_remaining_copmressed_fp():
     with tempfile.TemporaryDirectory() as dirpath:
         data_fp = calculate_remaining(outside, 'name', remain_result, dirpath=dirpath, compress=False)
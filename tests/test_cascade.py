@@ -0,0 +1,78 @@
+from pandarus.cascade import cascade_dispatcher, cascade_worker
+from pandarus.intersections import intersection_worker
+from shapely.errors import TopologicalError
+import os
+import pytest
+import tempfile
+
+dirpath = os.path.abspath(os.path.join(os.path.dirname(__file__), "data"))
+grid = os.path.join(dirpath, "grid.geojson")
+square = os.path.join(dirpath, "square.geojson")
+lines = os.path.join(dirpath, "lines.geojson")
+
+
+def test_cascade_worker_one_stage():
+    expected = intersection_worker(grid, None, square)
+    result = cascade_worker(grid, None, [square])
+    assert result.keys() == expected.keys()
+    for key, value in expected.items():
+        assert abs(result[key]['measure'] - value['measure']) < 1e-6 * value['measure']
+        assert result[key]['geom'].equals(value['geom'])
+
+
+def test_cascade_worker_releases_to_maps():
+    from pandarus.intersections import _TO_MAPS
+    cascade_worker(grid, None, [square, grid])
+    assert not any(key[0] in (square, grid) for key in _TO_MAPS)
+
+
+def test_cascade_worker_stages():
+    result = cascade_worker(grid, None, [square, grid], geometries=False)
+    # Cells of the grid only share edges, which aren't polygons
+    assert sorted(result) == [(0, 0, 0), (1, 0, 1), (2, 0, 2), (3, 0, 3)]
+    expected = intersection_worker(grid, None, square, geometries=False)
+    for (i, j, k), value in result.items():
+        assert 'geom' not in value
+        assert abs(value['measure'] - expected[(i, j)]['measure']) < 1e-3
+
+
+def test_cascade_worker_lines():
+    result = cascade_worker(lines, None, [grid, square])
+    expected = intersection_worker(lines, None, grid)
+    assert {(i, j) for i, j, _ in result} == set(expected)
+    for (i, j, _), value in result.items():
+        assert value['geom'].geom_type == 'MultiLineString'
+
+
+def test_cascade_dispatcher():
+    metrics = {}
+    with tempfile.TemporaryDirectory() as dirpath:
+        result = cascade_dispatcher(grid, [square, grid], cpus=2, log_dir=dirpath,
+                                    metrics=metrics, geometries=False)
+    assert result == cascade_worker(grid, None, [square, grid], geometries=False)
+    assert metrics['jobs'] == 1
+
+
+def test_cascade_failures(monkeypatch):
+    from pandarus import cascade
+    get_intersection = cascade.get_intersection
+
+    def invalid(geom, kind, collection, *args, **kwargs):
+        # Fails on the second stage only
+        if collection.filepath == grid:
+            raise TopologicalError("invalid")
+        return get_intersection(geom, kind, collection, *args, **kwargs)
+
+    monkeypatch.setattr('pandarus.cascade.get_intersection', invalid)
+    failures = []
+    assert cascade_worker(grid, None, [square, grid], failures=failures) == {}
+    assert [row['index'] for row in failures] == [0, 1, 2, 3]
+    with pytest.raises(TopologicalError):
+        cascade_worker(grid, None, [square, grid])
+
+    for cpus in (None, 2):
+        metrics = {}
+        with tempfile.TemporaryDirectory() as dirpath:
+            assert cascade_dispatcher(grid, [square, grid], cpus=cpus,
+                                      log_dir=dirpath, metrics=metrics) == {}
+        assert [row['index'] for row in metrics['failures']] == [0, 1, 2, 3]
@@ -1,4 +1,10 @@
-from pandarus.filesystem import sha256, json_exporter, get_appdirs_path, json_importer
+from pandarus.filesystem import (
+    get_appdirs_path,
+    json_exporter,
+    json_importer,
+    JSONStreamWriter,
+    sha256,
+)
 import tempfile
 import os
 
@@ -42,6 +48,23 @@ def test_json_roundtrip():
         fp = json_exporter(data, new_fp)
         assert json_importer(fp) == data
 
+def test_json_stream_writer():
+    with tempfile.TemporaryDirectory() as dirpath:
+        new_fp = os.path.join(dirpath, 'testfile')
+        for compress in (False, True):
+            writer = JSONStreamWriter(new_fp, compress)
+            writer.write([(1, 'a'), (2, 'b')])
+            writer.write(iter([(3, 'ü')]))
+            fp = writer.close(metadata={'foo': 'bar'})
+            assert fp.endswith(".bz2") == compress
+            assert json_importer(fp) == {
+                'data': [[1, 'a'], [2, 'b'], [3, 'ü']],
+                'metadata': {'foo': 'bar'}
+            }
+
+        fp = JSONStreamWriter(new_fp, False).close()
+        assert json_importer(fp) == {'data': []}
+
 def test_appdirs_path():
     dp = get_appdirs_path("test-dir")
     assert os.path.exists(dp)
@@ -1,12 +1,22 @@
 from pandarus import Map
 from pandarus.projection import project, WGS84, MOLLWEIDE
 from pandarus.geometry import (
+    _as_kind,
+    BULK_AVAILABLE,
     clean,
+    count_vertices,
+    FeatureTimeout,
+    get_geodesic_measures,
     get_intersection as _get_intersection,
+    get_intersections_bulk,
     get_measure,
+    get_measures,
     get_remaining,
     IncompatibleTypes,
     recursive_geom_finder,
+    simplify,
+    subdivide,
+    _bounds_contain,
 )
 from shapely.geometry import (
     GeometryCollection,
@@ -18,13 +28,17 @@ from shapely.geometry import (
     Point,
     Polygon,
     mapping,
+    shape,
 )
 import numpy as np
 import os
 import pytest
+import time
 
 dirpath = os.path.abspath(os.path.join(os.path.dirname(__file__), "data"))
 grid = os.path.join(dirpath, "grid.geojson")
+lines = os.path.join(dirpath, "lines.geojson")
+points = os.path.join(dirpath, "points.geojson")
 
 to_mollweide = lambda x: project(x, WGS84, MOLLWEIDE)
 
@@ -297,6 +311,73 @@ def test_polygon_geometry_collection():
     }
     assert get_intersection(pg, 'polygon', Map(grid, 'name'), (0, 1), to_meters=False) == expected
 
+def test_polygon_within_collection():
+    pg = Polygon([(0.2, 0.2), (0.2, 0.4), (0.4, 0.4), (0.4, 0.2), (0.2, 0.2)])
+    result = _get_intersection(pg, 'polygon', Map(grid, 'name'), (0, 1, 2, 3), to_meters=False)
+    assert result.keys() == {0}
+    assert np.isclose(result[0]['measure'], 0.04)
+    assert result[0]['geom'].equals(MultiPolygon([pg]))
+
+def test_polygon_contains_collection():
+    pg = Polygon([(-1, -1), (-1, 3), (3, 3), (3, -1), (-1, -1)])
+    m = Map(grid, 'name')
+    result = _get_intersection(pg, 'polygon', m, (0, 1, 2, 3), to_meters=False)
+    assert result.keys() == {0, 1, 2, 3}
+    assert all(v['measure'] == 1 for v in result.values())
+    assert result[2]['geom'].equals(shape(m[2]['geometry']))
+    assert m.measures[(2, None, None)] == 1
+
+    # Precomputed measures are reused
+    m.measures[(2, None, None)] = 42
+    result = _get_intersection(pg, 'polygon', m, (0, 1, 2, 3), to_meters=False)
+    assert result[2]['measure'] == 42
+
+def test_polygon_early_stop(monkeypatch):
+    tested = []
+
+    def fake_bounds_contain(outer, inner):
+        tested.append(outer)
+        return _bounds_contain(outer, inner)
+
+    monkeypatch.setattr(
+        'pandarus.geometry._bounds_contain',
+        fake_bounds_contain
+    )
+
+    pg = Polygon([(0.2, 0.2), (0.2, 0.4), (0.4, 0.4), (0.4, 0.2), (0.2, 0.2)])
+    m = Map(grid, 'name')
+    result = _get_intersection(pg, 'polygon', m, (0, 0), to_meters=False)
+    assert result.keys() == {0}
+    assert len(tested) == 2
+
+    tested.clear()
+    result = _get_intersection(pg, 'polygon', m, (0, 0), to_meters=False, early_stop=True)
+    assert result.keys() == {0}
+    assert len(tested) == 1
+
+    pg = Polygon([(0.5, 0.5), (1.5, 0.5), (1.5, 1.5), (0.5, 1.5), (0.5, 0.5)])
+    expected = _get_intersection(pg, 'polygon', m, (0, 1, 2, 3), to_meters=False)
+    result = _get_intersection(pg, 'polygon', m, (0, 1, 2, 3), to_meters=False, early_stop=True)
+    assert {k: v['measure'] for k, v in result.items()} == \
+        {k: v['measure'] for k, v in expected.items()}
+
+def test_line_early_stop():
+    ls = LineString([(0.2, 0.5), (0.4, 0.5)])
+    result = _get_intersection(ls, 'line', Map(grid, 'name'), (0, 1, 2, 3), to_meters=False, early_stop=True)
+    assert list(result) == [0]
+    assert np.isclose(result[0]['measure'], 0.2)
+
+def test_early_stop_empty():
+    assert get_intersection(GeometryCollection(), 'polygon', Map(grid, 'name'), (0, 1), early_stop=True) == {}
+
+def test_get_intersection_deadline():
+    pg = Polygon([(0.5, 0.5), (1.5, 0.5), (1.5, 1.5), (0.5, 1.5), (0.5, 0.5)])
+    m = Map(grid, 'name')
+    with pytest.raises(FeatureTimeout):
+        _get_intersection(pg, 'polygon', m, (0, 1, 2, 3), deadline=time.time() - 1)
+    result = _get_intersection(pg, 'polygon', m, (0, 1, 2, 3), deadline=time.time() + 60)
+    assert len(result) == 4
+
 def test_polygon_wrong_geometry():
     mp = Point((0.5, 1))
     assert get_intersection(mp, 'polygon', Map(grid, 'name'), (0, 1, 2, 3)) == {}
@@ -310,6 +391,55 @@ def test_clean():
     assert not p.is_valid
     assert pp.is_valid
 
+def test_simplify():
+    coords = [(x / 1e3, 1e-9 * (x % 2)) for x in range(1001)]
+    pg = Polygon(coords + [(1, 1), (0, 1)])
+    simplified = simplify(pg)
+    assert simplified.is_valid
+    assert count_vertices(simplified) == 5
+    assert np.isclose(simplified.area, pg.area)
+    assert simplify(Point(1, 2)).equals(Point(1, 2))
+    assert simplify(GeometryCollection()).is_empty
+
+def test_subdivide():
+    pg = Point(0, 0).buffer(1, 256)
+    pieces = subdivide(pg, 'polygon', 100)
+    assert len(pieces) == 16
+    assert all(count_vertices(piece) <= 100 for piece in pieces)
+    assert all(isinstance(piece, MultiPolygon) for piece in pieces)
+    assert np.isclose(sum(piece.area for piece in pieces), pg.area)
+    assert subdivide(pg, 'polygon', 2000) == [pg]
+    assert len(subdivide(pg, 'polygon', 10, max_depth=1)) == 4
+
+def test_subdivide_lines():
+    ls = LineString([(0, i / 100) for i in range(500)])
+    pieces = subdivide(ls, 'line', 50)
+    assert all(count_vertices(piece) <= 50 for piece in pieces)
+    assert np.isclose(sum(piece.length for piece in pieces), ls.length)
+
+def test_subdivide_lines_empty_quadrant():
+    # L shaped line, which misses the upper right quadrant of its bounds
+    ls = LineString(
+        [(i / 10, 0) for i in range(100, 0, -1)] +
+        [(0, i / 10) for i in range(101)]
+    )
+    pieces = subdivide(ls, 'line', 20)
+    assert all(isinstance(piece, MultiLineString) for piece in pieces)
+    assert all(not piece.is_empty for piece in pieces)
+    assert all(count_vertices(piece) <= 20 for piece in pieces)
+    assert np.isclose(sum(piece.length for piece in pieces), ls.length)
+
+def test_count_vertices():
+    holed = Polygon(
+        [(0, 0), (0, 2), (2, 2), (2, 0), (0, 0)],
+        [[(0.5, 0.5), (0.5, 1.5), (1.5, 1.5), (1.5, 0.5), (0.5, 0.5)]]
+    )
+    assert count_vertices(holed) == 10
+    assert count_vertices(GeometryCollection([
+        MultiPoint([(0, 0), (1, 1)]), LineString([(0, 0), (0, 1)])
+    ])) == 4
+    assert count_vertices(GeometryCollection()) == 0
+
 # Get measure
 
 def test_get_measure_point():
@@ -370,6 +500,56 @@ def test_get_measure_wrong_type():
     with pytest.raises(ValueError):
         get_measure(geom, 'foo')
 
+def test_get_measures_planar():
+    geom = Polygon([(0, 0), (0, 1), (1, 1), (1, 0), (0, 0)])
+    assert get_measures([geom, geom], 'polygon', None) == [1, 1]
+
+def test_get_measures_mollweide():
+    area = (4e7 / 360) ** 2
+    geoms = [
+        Polygon([(0, 0), (0, 1), (1, 1), (1, 0), (0, 0)]),
+        Polygon([(10, 0), (10, 1), (11, 1), (11, 0), (10, 0)]),
+    ]
+    assert np.allclose(get_measures(geoms, 'polygon'), area, rtol=1e-2)
+
+def test_get_measures_points():
+    geoms = [MultiPoint([(0, 0), (0, 1)]), Point((0, 0))]
+    assert get_measures(geoms, 'point', 'geodesic') == [2, 1]
+    assert get_measures(geoms, 'point', 'mollweide') == [2, 1]
+
+def test_get_measures_wrong_engine():
+    with pytest.raises(ValueError):
+        get_measures([Point((0, 0))], 'point', 'foo')
+
+def test_geodesic_lines():
+    geoms = [
+        LineString([(0, 0), (0, 1)]),
+        MultiLineString([[(0, 0), (0, 1)], [(0, 1), (0, 2)]]),
+        MultiLineString([]),
+    ]
+    result = get_measures(geoms, 'line', 'geodesic')
+    # Length of one degree of latitude at the equator on WGS84
+    assert np.isclose(result[0], 110574.4, rtol=1e-5)
+    assert np.isclose(result[1], 2 * 110574.4, rtol=1e-3)
+    assert result[2] == 0
+
+def test_geodesic_polygons():
+    area = (4e7 / 360) ** 2
+    holed = Polygon(
+        [(0, 0), (0, 2), (2, 2), (2, 0), (0, 0)],
+        [[(0.5, 0.5), (0.5, 1.5), (1.5, 1.5), (1.5, 0.5), (0.5, 0.5)]]
+    )
+    result = get_geodesic_measures([
+        Polygon([(0, 0), (0, 1), (1, 1), (1, 0), (0, 0)]),
+        MultiPolygon([holed]),
+    ], 'polygon')
+    assert np.isclose(result[0], area, rtol=1e-2)
+    assert np.isclose(result[1], 3 * area, rtol=1e-2)
+
+def test_geodesic_wrong_kind():
+    with pytest.raises(ValueError):
+        get_geodesic_measures([Point((0, 0))], 'point')
+
 # Remaining calculations
 
 def test_get_remaining_wrong_type():
@@ -400,6 +580,13 @@ def test_remaining_polygons_projection():
     half = Polygon([(0, 0), (0, .5), (1, .5), (1, 0), (0, 0)])
     assert np.isclose(get_remaining(geom, [half]), area, 1e-2)
 
+def test_remaining_polygons_geodesic():
+    area = 1/2 * (4e7 / 360) ** 2
+    geom = Polygon([(0, 0), (0, 1), (1, 1), (1, 0), (0, 0)])
+    half = Polygon([(0, 0), (0, .5), (1, .5), (1, 0), (0, 0)])
+    result = get_remaining(geom, [half], measure_engine='geodesic')
+    assert np.isclose(result, area, 1e-2)
+
 def test_remaining_polygons_no_geoms():
     geom = Polygon([(0, 0), (0, 1), (1, 1), (1, 0), (0, 0)])
     assert get_remaining(geom, [], False) == 1
@@ -453,3 +640,55 @@ def test_remaining_points_projection():
 def test_remaining_points_no_geoms():
     geom = MultiPoint([(0, 0), (0, 1)])
     assert get_remaining(geom, [], False) == 2
+
+needs_bulk = pytest.mark.skipif(not BULK_AVAILABLE, reason="requires shapely 2")
+
+@pytest.mark.skipif(BULK_AVAILABLE, reason="requires shapely < 2")
+def test_bulk_unavailable():
+    with pytest.raises(ValueError):
+        get_intersections_bulk([(0, Point(0.5, 0.5))], 'point', Map(grid))
+
+@needs_bulk
+def test_as_kind():
+    geoms = np.array([
+        Polygon([(0, 0), (1, 0), (1, 1)]),
+        MultiPolygon([Polygon([(0, 0), (1, 0), (1, 1)])]),
+        LineString([(0, 0), (1, 1)]),
+        GeometryCollection([Point(0, 0), Polygon([(0, 0), (1, 0), (1, 1)])]),
+        Polygon(),
+    ], dtype=object)
+    result = _as_kind(geoms, 'polygon')
+    assert [g.geom_type if g is not None else None for g in result] == \
+        ['MultiPolygon', 'MultiPolygon', None, 'MultiPolygon', None]
+    assert result[0].equals(geoms[0])
+    assert result[3].equals(geoms[0])
+    assert _as_kind(geoms, 'line')[2].geom_type == 'MultiLineString'
+
+@needs_bulk
+def test_get_intersections_bulk():
+    collection = Map(grid)
+    for fp in (grid, lines, points):
+        source = Map(fp)
+        kind = {'Polygon': 'polygon', 'LineString': 'line', 'Point': 'point'}[source.geometry]
+        objs = list(source.iter_latlong())
+        for kwargs in ({}, {'measure_engine': 'geodesic'}, {'to_meters': False}):
+            result = get_intersections_bulk(objs, kind, collection, **kwargs)
+            expected = {
+                (index, k): v
+                for index, geom in objs
+                for k, v in _get_intersection(geom, kind, collection, range(len(collection)), **kwargs).items()
+            }
+            assert result.keys() == expected.keys()
+            for key, value in result.items():
+                assert np.allclose(value['measure'], expected[key]['measure'])
+                assert value['geom'].equals(expected[key]['geom'])
+                assert value['geom'].geom_type == expected[key]['geom'].geom_type
+
+@needs_bulk
+def test_get_intersections_bulk_no_geoms():
+    objs = [(0, Point(0.5, 0.5)), (1, Point(10, 10))]
+    collection = Map(grid)
+    result = get_intersections_bulk(objs, 'point', collection, return_geoms=False)
+    assert result == {(0, 0): {'measure': 1.}}
+    assert '' in collection.bulk_indices
+    assert get_intersections_bulk([], 'point', collection) == {}
@@ -1,22 +1,71 @@
 from pandarus import Map
 from pandarus.intersections import (
+    checkpoint_key,
+    checkpoint_path,
     chunker,
+    feature_summary,
     get_jobs,
+    hilbert_index,
     intersection_worker,
     intersection_dispatcher,
+    load_checkpoint,
+    load_to_map,
+    load_packed,
     logger_init,
+    logger_stop,
+    merge_packed,
+    merge_shards,
+    pack_results,
+    partition_jobs,
+    release_to_map,
+    save_checkpoint,
+    shard_path,
+    spatial_order,
+    unlink_packed,
+    unpack_results,
     worker_init,
+    write_shard,
 )
+from pandarus.geometry import BULK_AVAILABLE
+from shapely.errors import ShapelyError, TopologicalError
+from shapely.geometry import Point
+from logging.handlers import QueueHandler
+import fiona
+import logging
+import multiprocessing
+import pandarus.intersections
 import os
 import numpy as np
 import pytest
 import tempfile
+import time
 
 dirpath = os.path.abspath(os.path.join(os.path.dirname(__file__), "data"))
 grid = os.path.join(dirpath, "grid.geojson")
 square = os.path.join(dirpath, "square.geojson")
+pgrid = os.path.join(dirpath, "grid-3410.geojson")
 point = os.path.join(dirpath, "point.geojson")
 gc = os.path.join(dirpath, "gc.geojson")
+lines = os.path.join(dirpath, "lines.geojson")
+
+
+def is_loaded(fp):
+    return any(key[0] == fp for key in pandarus.intersections._TO_MAPS)
+
+def assert_same_results(result, expected, rtol=1e-5, tolerance=None):
+    """Compare ``intersection_worker`` results. Geometries must be equal, or if ``tolerance`` is given, of the same type and differ by at most this fraction of their area."""
+    assert result.keys() == expected.keys()
+    for key, value in result.items():
+        assert value.keys() == expected[key].keys()
+        assert np.isclose(value['measure'], expected[key]['measure'], rtol=rtol)
+        if 'geom' not in value:
+            continue
+        geom = expected[key]['geom']
+        if tolerance is None:
+            assert value['geom'].equals(geom)
+        else:
+            assert value['geom'].geom_type == geom.geom_type
+            assert value['geom'].symmetric_difference(geom).area <= tolerance * geom.area
 
 
 def test_chunker():
@@ -28,12 +77,103 @@ def test_chunker():
     ]
     assert list(chunker(numbers, 4)) == expected
 
-def test_worker_init():
+def test_hilbert_index():
+    assert hilbert_index([0, 0, 1, 1], [0, 1, 1, 0], 1).tolist() == [0, 1, 2, 3]
+    x, y = np.meshgrid(np.arange(4), np.arange(4))
+    keys = hilbert_index(x.ravel(), y.ravel(), 2)
+    assert sorted(keys.tolist()) == list(range(16))
+    # Consecutive positions along the curve are neighbours
+    points = np.column_stack((x.ravel(), y.ravel()))[np.argsort(keys)]
+    assert (np.abs(np.diff(points, axis=0)).sum(axis=1) == 1).all()
+
+def test_spatial_order():
+    assert spatial_order(grid, range(4)) == [0, 1, 3, 2]
+    assert spatial_order(grid, [3, 2, 0]) == [0, 3, 2]
+    assert spatial_order(grid, []) == []
+
+def test_feature_summary():
+    centers, costs = feature_summary(grid, [2, 0])
+    assert centers.tolist() == [[1.5, 0.5], [0.5, 0.5]]
+    # Five vertices per cell
+    assert costs.tolist() == [6, 6]
+
+    try:
+        _, index = load_to_map(square)
+        _, costs = feature_summary(grid, range(4), rtree_index=index)
+        assert costs.tolist() == [11, 11, 11, 11]
+    finally:
+        release_to_map(square)
+
+def test_partition_jobs():
+    assert partition_jobs([0, 1, 2, 3], [1, 1, 1, 1], 2) == [(2, [0, 1]), (2, [2, 3])]
+    assert partition_jobs([0, 1, 2, 3], [1, 10, 1, 1], 2) == [
+        (10, [1]), (2, [2, 3]), (1, [0])
+    ]
+    assert partition_jobs([], [], 2) == []
+
+def test_intersection_dispatcher_metrics():
+    metrics = {}
+    with tempfile.TemporaryDirectory() as dirpath:
+        result = intersection_dispatcher(grid, square, None, 2, dirpath, metrics=metrics)
+    assert len(result) == 4
+    assert metrics['jobs'] == len(metrics['estimated_costs']) == len(metrics['job_times'])
+    assert all(t >= 0 for t in metrics['job_times'])
+    assert metrics['imbalance'] >= 1
+    assert len(metrics['worker_startup']) == 1
+    assert metrics['worker_startup'][0] >= 0
+
+def test_intersection_dispatcher_start_methods():
+    for start_method in multiprocessing.get_all_start_methods():
+        metrics = {}
+        with tempfile.TemporaryDirectory() as dirpath:
+            result = intersection_dispatcher(grid, square, None, 2, dirpath, metrics=metrics,
+                                             start_method=start_method)
+        assert sorted(result) == [(0, 0), (1, 0), (2, 0), (3, 0)]
+        assert len(metrics['worker_startup']) == 1
+
+def test_intersection_dispatcher_threads_no_startup():
+    metrics = {}
+    intersection_dispatcher(grid, square, None, 2, backend='threads', metrics=metrics)
+    assert metrics['worker_startup'] == []
+
+def test_worker_init_preload(monkeypatch):
+    monkeypatch.setattr('pandarus.intersections._POOL_WORKER', False)
+    with tempfile.TemporaryDirectory() as dirpath:
+        ql, lq = logger_init(dirpath)
+        try:
+            worker_init(lq, time.time(), [(square, '')])
+            assert is_loaded(square)
+            assert pandarus.intersections._WORKER_STARTUP >= 0
+        finally:
+            release_to_map(square)
+            logging.getLogger().handlers = [
+                handler for handler in logging.getLogger().handlers
+                if not isinstance(handler, QueueHandler)
+            ]
+            logger_stop(ql)
+
+def test_intersection_dispatcher_unsorted():
+    with tempfile.TemporaryDirectory() as dirpath:
+        result = intersection_dispatcher(grid, square, [3, 1], 1, dirpath, spatial_sort=False)
+        assert result.keys() == {(3, 0), (1, 0)}
+
+def test_worker_init(monkeypatch):
+    # ``worker_init`` marks this process as a pool worker
+    monkeypatch.setattr('pandarus.intersections._POOL_WORKER', False)
     with tempfile.TemporaryDirectory() as dirpath:
         ql, lq = logger_init(dirpath)
         worker_init(lq)
         assert os.listdir(dirpath)
 
+def test_logger_stop():
+    handlers = len(logging.getLogger().handlers)
+    with tempfile.TemporaryDirectory() as dirpath:
+        for _ in range(3):
+            ql, _ = logger_init(dirpath)
+            assert len(logging.getLogger().handlers) == handlers + 1
+            logger_stop(ql)
+        assert len(logging.getLogger().handlers) == handlers
+
 def test_get_jobs():
     assert get_jobs(10) == (20, 1)
     assert get_jobs(100) == (20, 5)
@@ -44,11 +184,55 @@ def test_intersection_worker_indices():
     area = 1/4 * (4e7 / 360) ** 2
     result = intersection_worker(grid, [0], square)
     assert result.keys() == {(0, 0)}
-    key, value = list(result.keys())[0], list(result.values())[0]
+    value = result[(0, 0)]
     expected = 'MULTIPOLYGON (((0.5 1, 1 1, 1 0.5, 0.5 0.5, 0.5 1)))'
     assert value['geom'].wkt == expected
     assert np.isclose(value['measure'], area, rtol=1e-2)
 
+def test_intersection_worker_geodesic():
+    area = 1/4 * (4e7 / 360) ** 2
+    result = intersection_worker(grid, [0], square, measure_engine='geodesic')
+    assert np.isclose(result[(0, 0)]['measure'], area, rtol=1e-2)
+
+def test_intersection_worker_projected():
+    expected = intersection_worker(grid, None, square)
+    result = intersection_worker(grid, None, square, projected=True)
+    assert_same_results(result, expected, rtol=1e-4, tolerance=1e-4)
+
+def test_intersection_worker_projected_native_crs():
+    result = intersection_worker(pgrid, None, pgrid, projected=True)
+    assert len(result) == 4
+    for key, value in result.items():
+        assert value['geom'].bounds[2] <= 180
+
+def test_intersection_worker_projected_not_equal_area():
+    # Web Mercator areas are about four times too large at 60 degrees north
+    ring = [(0, 0), (0, 1), (1, 1), (1, 0), (0, 0)]
+    schema = {'geometry': 'Polygon', 'properties': {'name': 'str'}}
+    with tempfile.TemporaryDirectory() as tmp:
+        fp = os.path.join(tmp, "mercator.geojson")
+        with fiona.open(fp, 'w', driver='GeoJSON', schema=schema,
+                        crs=fiona.crs.from_epsg(3857)) as sink:
+            sink.write({
+                'geometry': {'type': 'Polygon', 'coordinates': [[
+                    (x * 1e5 + 1e6, y * 1e5 + 8.4e6) for x, y in ring
+                ]]},
+                'properties': {'name': 'north'},
+            })
+        expected = intersection_worker(fp, None, fp)
+        for engine in ('rtree', 'bulk'):
+            if engine == 'bulk' and not BULK_AVAILABLE:
+                continue
+            result = intersection_worker(fp, None, fp, projected=True, engine=engine)
+            assert np.isclose(result[(0, 0)]['measure'],
+                              expected[(0, 0)]['measure'], rtol=1e-6)
+    assert np.isclose(expected[(0, 0)]['measure'], 1e10 / 4, rtol=0.05)
+
+def test_intersection_worker_early_stop():
+    expected = intersection_worker(grid, None, square)
+    result = intersection_worker(grid, None, square, early_stop=True)
+    assert result.keys() == expected.keys()
+
 def test_intersection_worker_no_indices():
     result = intersection_worker(grid, None, square)
     assert len(result) == 4
@@ -69,3 +253,458 @@ def test_intersection_dispatcher_indices():
     with tempfile.TemporaryDirectory() as dirpath:
         result = intersection_dispatcher(grid, square, [0, 1], 1, dirpath)
         assert len(result) == 2
+
+def test_load_to_map():
+    try:
+        to_map, index = load_to_map(square)
+        assert to_map.cache is not None
+        assert list(index.intersection((0, 0, 1, 1))) == [0]
+        assert load_to_map(square) == (to_map, index)
+        assert load_to_map(square, None) == (to_map, None)
+    finally:
+        release_to_map(square)
+    assert not is_loaded(square)
+
+def test_load_to_map_reopen_in_other_process():
+    try:
+        to_map, _ = load_to_map(square)
+        original = to_map.file
+        to_map.pid = -1
+        load_to_map(square)
+        assert to_map.file is not original
+    finally:
+        release_to_map(square)
+
+def test_load_to_map_wrong_type():
+    with pytest.raises(ValueError):
+        load_to_map(point)
+    assert not is_loaded(point)
+
+def test_intersection_dispatcher_releases_to_map():
+    with tempfile.TemporaryDirectory() as dirpath:
+        intersection_dispatcher(grid, square, [0, 1], 1, dirpath)
+    assert not is_loaded(square)
+    intersection_dispatcher(grid, square)
+    assert not is_loaded(square)
+
+def test_intersection_worker_releases_own_to_map():
+    intersection_worker(grid, None, square)
+    assert not is_loaded(square)
+    # Maps loaded by the caller, e.g. a dispatcher or a session, are kept
+    try:
+        to_map, _ = load_to_map(square, None)
+        intersection_worker(grid, None, square)
+        assert is_loaded(square)
+        assert load_to_map(square, None)[0] is to_map
+    finally:
+        release_to_map(square)
+
+def test_intersection_worker_exclusive(monkeypatch):
+    try:
+        load_to_map(grid, None)
+        intersection_worker(grid, None, square, exclusive=True)
+        assert is_loaded(grid)
+        monkeypatch.setattr('pandarus.intersections._POOL_WORKER', True)
+        intersection_worker(grid, None, square, exclusive=True)
+        assert not is_loaded(grid) and is_loaded(square)
+    finally:
+        release_to_map(grid)
+        release_to_map(square)
+
+def test_pack_results():
+    results = {
+        (0, 1): {'measure': 1., 'geom': Point(0, 1)},
+        (2, 3): {'measure': 2., 'geom': Point(2, 3)},
+    }
+    packed = pack_results(results)
+    assert packed['from'].tolist() == [0, 2]
+    assert packed['to'].tolist() == [1, 3]
+    assert packed['measure'].tolist() == [1, 2]
+    assert packed['offsets'].tolist() == [0, 21, 42]
+    unpacked = unpack_results(packed)
+    assert unpacked.keys() == results.keys()
+    assert unpacked[(2, 3)]['measure'] == 2
+    assert unpacked[(2, 3)]['geom'].equals(Point(2, 3))
+
+def test_pack_results_no_geoms():
+    packed = pack_results({(0, 1): {'measure': 1.}}, geoms=False)
+    assert 'wkb' not in packed
+    assert unpack_results(packed) == {(0, 1): {'measure': 1.}}
+
+def test_pack_results_shared_memory():
+    packed = pack_results({(0, 1): {'measure': 1., 'geom': Point(0, 1)}}, shared=True)
+    if pandarus.intersections.shared_memory is None:
+        assert packed['wkb']
+    else:
+        assert packed['wkb'] is None and packed['shm']
+    assert load_packed(packed)['wkb'] == Point(0, 1).wkb
+    assert 'shm' not in packed
+
+def shared_blocks():
+    return {name for name in os.listdir('/dev/shm') if name.startswith('pandarus_')}
+
+@pytest.mark.skipif(
+    pandarus.intersections.shared_memory is None or not os.path.isdir('/dev/shm'),
+    reason="No POSIX shared memory"
+)
+def test_unlink_packed():
+    packed = pack_results({(0, 1): {'measure': 1., 'geom': Point(0, 1)}},
+                          shared='pandarus_test')
+    assert packed['shm'] == 'pandarus_test'
+    assert 'pandarus_test' in shared_blocks()
+    unlink_packed(['pandarus_test', 'pandarus_missing'])
+    assert 'pandarus_test' not in shared_blocks()
+
+@pytest.mark.skipif(
+    pandarus.intersections.shared_memory is None or not os.path.isdir('/dev/shm'),
+    reason="No POSIX shared memory"
+)
+def test_intersection_dispatcher_frees_shared_memory(monkeypatch):
+    # One job per feature
+    monkeypatch.setattr('pandarus.intersections.get_jobs',
+                        lambda map_size: (1, map_size))
+
+    def callback(results):
+        # Lets the other jobs finish, so that their results are never loaded
+        time.sleep(1)
+        raise ValueError
+
+    before = shared_blocks()
+    with pytest.raises(ValueError):
+        intersection_dispatcher(grid, square, None, 2, callback=callback,
+                                start_method='fork')
+    assert shared_blocks() == before
+
+def test_merge_packed():
+    first = pack_results({(0, 1): {'measure': 1., 'geom': Point(0, 1)}})
+    second = pack_results({
+        (2, 3): {'measure': 2., 'geom': Point(2, 3)},
+        (4, 5): {'measure': 3., 'geom': Point(4, 5)},
+    })
+    merged = merge_packed([first, pack_results({}), second])
+    assert merged['from'].tolist() == [0, 2, 4]
+    assert merged['offsets'].tolist() == [0, 21, 42, 63]
+    result = unpack_results(merged)
+    assert result[(4, 5)]['geom'].equals(Point(4, 5))
+    assert unpack_results(merge_packed([])) == {}
+
+def test_intersection_dispatcher_packed():
+    with tempfile.TemporaryDirectory() as dirpath:
+        packed = intersection_dispatcher(grid, square, None, 2, dirpath, packed=True)
+    assert sorted(packed['from'].tolist()) == [0, 1, 2, 3]
+    assert len(packed['offsets']) == 5
+    assert len(intersection_dispatcher(grid, square, packed=True)['from']) == 4
+
+def test_shard_path():
+    assert shard_path('foo', 3) == os.path.join('foo', 'shard-00003.gpkg')
+    assert shard_path('foo', 3, 'FlatGeobuf').endswith('.fgb')
+
+def test_merge_shards():
+    first = {
+        (4, 0): {'measure': 3., 'geom': Point(4, 0)},
+        (0, 1): {'measure': 1., 'geom': Point(0, 1)},
+    }
+    second = {
+        (2, 3): {'measure': 2., 'geom': Point(2, 3)},
+        (5, 0): {'measure': 4., 'geom': Point(5, 0)},
+    }
+    for driver in ('GPKG', 'FlatGeobuf'):
+        with tempfile.TemporaryDirectory() as dirpath:
+            shards = [
+                write_shard(first, shard_path(dirpath, 0, driver), driver),
+                write_shard(second, shard_path(dirpath, 1, driver), driver),
+            ]
+            assert write_shard({}, shard_path(dirpath, 2, driver), driver) is None
+            assert len(os.listdir(dirpath)) == 2
+            with fiona.open(shards[0]) as source:
+                assert source.schema['properties'].keys() == {'from', 'to', 'measure'}
+            rows = list(merge_shards(shards))
+        assert [row[:3] for row in rows] == [
+            (0, 1, 1.), (2, 3, 2.), (4, 0, 3.), (5, 0, 4.)
+        ]
+        assert rows[1][3]['coordinates'] == (2, 3)
+
+def test_intersection_dispatcher_shards():
+    with tempfile.TemporaryDirectory() as dirpath:
+        shards = intersection_dispatcher(grid, square, None, 2, shard_dir=dirpath)
+        assert all(os.path.dirname(fp) == dirpath for fp in shards)
+        rows = list(merge_shards(shards))
+        assert [row[:2] for row in rows] == [(0, 0), (1, 0), (2, 0), (3, 0)]
+
+        expected = intersection_dispatcher(grid, square, None, 2)
+        for from_index, to_index, measure, _ in rows:
+            assert np.allclose(measure, expected[(from_index, to_index)]['measure'])
+
+        shards = intersection_dispatcher(grid, square, shard_dir=dirpath,
+                                         shard_driver='FlatGeobuf')
+        assert len(shards) == 1
+        assert len(list(merge_shards(shards))) == 4
+
+def test_intersection_worker_no_geometries():
+    result = intersection_worker(grid, None, square, geometries=False)
+    expected = intersection_worker(grid, None, square)
+    assert_same_results(result, {
+        key: {'measure': value['measure']} for key, value in expected.items()
+    })
+
+    result = intersection_worker(grid, None, square, projected=True, geometries=False)
+    assert all(value.keys() == {'measure'} for value in result.values())
+
+def test_intersection_dispatcher_no_geometries():
+    with tempfile.TemporaryDirectory() as dirpath:
+        packed = intersection_dispatcher(grid, square, None, 2, dirpath,
+                                         packed=True, geometries=False)
+    assert 'wkb' not in packed and 'offsets' not in packed
+    assert sorted(packed['from'].tolist()) == [0, 1, 2, 3]
+    results = intersection_dispatcher(grid, square, None, 2, geometries=False)
+    assert all(value.keys() == {'measure'} for value in results.values())
+    packed = intersection_dispatcher(grid, square, packed=True, geometries=False)
+    assert 'wkb' not in packed
+
+@pytest.mark.skipif(not BULK_AVAILABLE, reason="requires shapely 2")
+def test_intersection_worker_bulk():
+    for kwargs in ({}, {'projected': True}, {'geometries': False}):
+        result = intersection_worker(grid, None, square, engine='bulk', **kwargs)
+        expected = intersection_worker(grid, None, square, **kwargs)
+        assert_same_results(result, expected, tolerance=1e-5)
+
+@pytest.mark.skipif(not BULK_AVAILABLE, reason="requires shapely 2")
+def test_intersection_worker_bulk_fallback(monkeypatch):
+    def broken(*args, **kwargs):
+        raise ShapelyError
+    monkeypatch.setattr('pandarus.intersections.get_intersections_bulk', broken)
+    assert len(intersection_worker(grid, None, square, engine='bulk')) == 4
+
+@pytest.mark.skipif(not BULK_AVAILABLE, reason="requires shapely 2")
+def test_intersection_dispatcher_bulk():
+    with tempfile.TemporaryDirectory() as dirpath:
+        result = intersection_dispatcher(grid, square, None, 2, dirpath, engine='bulk')
+    assert sorted(result) == [(0, 0), (1, 0), (2, 0), (3, 0)]
+
+def test_intersection_dispatcher_threads():
+    expected = intersection_dispatcher(grid, square)
+    metrics = {}
+    with tempfile.TemporaryDirectory() as dirpath:
+        result = intersection_dispatcher(grid, square, None, 3, dirpath,
+                                         backend='threads', metrics=metrics)
+    assert_same_results(result, expected)
+    assert metrics['jobs'] == 1
+    assert not is_loaded(square)
+
+    packed = intersection_dispatcher(grid, square, None, 2, backend='threads', packed=True)
+    assert sorted(packed['from'].tolist()) == [0, 1, 2, 3]
+    assert len(packed['offsets']) == 5
+
+    blocks = []
+    assert intersection_dispatcher(grid, square, None, 2, backend='threads',
+                                   callback=blocks.append) is None
+    assert sorted(key for block in blocks for key in block) == sorted(expected)
+
+def test_intersection_dispatcher_threads_error():
+    with pytest.raises(ValueError):
+        intersection_dispatcher(gc, square, None, 2, backend='threads')
+
+def test_intersection_dispatcher_wrong_backend():
+    with pytest.raises(ValueError):
+        intersection_dispatcher(grid, square, None, 2, backend='foo')
+
+def test_checkpoint_key():
+    key = checkpoint_key(grid, square, {'projected': False})
+    assert key == checkpoint_key(grid, square, {'projected': False, 'cache_size': 1})
+    assert key != checkpoint_key(grid, square, {'projected': True})
+    assert key != checkpoint_key(square, grid, {'projected': False})
+    assert checkpoint_path('foo', [1, 2]) != checkpoint_path('foo', [2, 1])
+    assert checkpoint_key('foo', 'bar', {}, key) == checkpoint_key(grid, square, {}, key)
+
+def test_save_checkpoint():
+    results = {
+        (0, 1): {'measure': 1., 'geom': Point(0, 1)},
+        (2, 3): {'measure': 2., 'geom': Point(2, 3)},
+    }
+    with tempfile.TemporaryDirectory() as dirpath:
+        filepath = save_checkpoint(results, os.path.join(dirpath, "job.npz"))
+        assert os.listdir(dirpath) == ["job.npz"]
+        loaded = unpack_results(load_checkpoint(filepath)[0])
+        assert loaded.keys() == results.keys()
+        assert loaded[(2, 3)]['geom'].equals(Point(2, 3))
+
+        save_checkpoint(results, filepath, geoms=False)
+        assert unpack_results(load_checkpoint(filepath)[0])[(0, 1)] == {'measure': 1.}
+
+def test_intersection_dispatcher_checkpoint(monkeypatch):
+    expected = intersection_dispatcher(grid, square)
+    monkeypatch.setattr('pandarus.intersections.get_jobs', lambda size: (1, size))
+    worker = pandarus.intersections.intersection_worker
+
+    def failing(from_map, from_objs, *args, **kwargs):
+        if 2 in from_objs:
+            raise ValueError
+        return worker(from_map, from_objs, *args, **kwargs)
+
+    with tempfile.TemporaryDirectory() as dirpath:
+        monkeypatch.setattr('pandarus.intersections.intersection_worker', failing)
+        with pytest.raises(ValueError):
+            intersection_dispatcher(grid, square, None, 1, backend='threads',
+                                    checkpoint_dir=dirpath)
+        run_dir, = os.listdir(dirpath)
+        finished = len(os.listdir(os.path.join(dirpath, run_dir)))
+        assert 0 < finished < 4
+
+        monkeypatch.setattr('pandarus.intersections.intersection_worker', worker)
+        metrics = {}
+        result = intersection_dispatcher(grid, square, None, 1, backend='threads',
+                                         checkpoint_dir=dirpath, metrics=metrics)
+        assert metrics['resumed'] == finished
+        assert os.listdir(dirpath) == []
+    assert_same_results(result, expected)
+
+def test_intersection_dispatcher_keep_checkpoints():
+    with tempfile.TemporaryDirectory() as dirpath:
+        metrics = {}
+        intersection_dispatcher(grid, square, None, 1, backend='threads',
+                                checkpoint_dir=dirpath, keep_checkpoints=True,
+                                metrics=metrics)
+        run_dir, = os.listdir(dirpath)
+        assert metrics['checkpoints'] == [os.path.join(dirpath, run_dir)]
+        assert os.listdir(os.path.join(dirpath, run_dir))
+
+def test_intersection_dispatcher_checkpoint_processes():
+    expected = intersection_dispatcher(grid, square)
+    with tempfile.TemporaryDirectory() as dirpath:
+        run_dir = os.path.join(dirpath, checkpoint_key(grid, square, {}))
+        os.makedirs(run_dir)
+        save_checkpoint(
+            {key: value for key, value in expected.items() if key[0] < 2},
+            checkpoint_path(run_dir, [0, 1, 2, 3])
+        )
+        metrics = {}
+        result = intersection_dispatcher(grid, square, None, 2, spatial_sort=False,
+                                         checkpoint_dir=dirpath, metrics=metrics)
+        assert metrics['resumed'] == 1 and metrics['job_times'] == [None]
+        assert not os.path.exists(run_dir)
+    assert sorted(result) == [(0, 0), (1, 0)]
+
+def test_intersection_worker_failures(monkeypatch):
+    expected = intersection_worker(grid, None, square)
+    get_intersection = pandarus.intersections.get_intersection
+    calls = []
+
+    def flaky(geom, *args, **kwargs):
+        calls.append(geom)
+        if len(calls) == 1:
+            raise ShapelyError("broken")
+        return get_intersection(geom, *args, **kwargs)
+
+    monkeypatch.setattr('pandarus.intersections.get_intersection', flaky)
+    failures = []
+    result = intersection_worker(grid, None, square, failures=failures)
+    assert result.keys() == expected.keys() and failures == []
+    assert len(calls) == 5
+
+    def broken(geom, *args, **kwargs):
+        raise ShapelyError("broken")
+
+    monkeypatch.setattr('pandarus.intersections.get_intersection', broken)
+    with pytest.raises(ShapelyError):
+        intersection_worker(grid, None, square)
+    result = intersection_worker(grid, None, square, worker_id=3, failures=failures)
+    assert result == {}
+    assert [row['index'] for row in failures] == [0, 1, 2, 3]
+    assert failures[0]['error'] == failures[0]['retry_error'] == "ShapelyError: broken"
+    assert failures[0]['vertices'] == 5 and failures[0]['valid']
+    assert failures[0]['worker'] == 3
+
+    def bug(geom, *args, **kwargs):
+        raise TypeError("bug")
+
+    # Programming errors aren't failures of a feature
+    monkeypatch.setattr('pandarus.intersections.get_intersection', bug)
+    with pytest.raises(TypeError):
+        intersection_worker(grid, None, square, failures=[])
+
+def test_intersection_worker_topological_error(monkeypatch):
+    def invalid(geom, *args, **kwargs):
+        raise TopologicalError("invalid")
+
+    monkeypatch.setattr('pandarus.intersections.get_intersection', invalid)
+    failures = []
+    assert intersection_worker(grid, None, square, failures=failures) == {}
+    assert [row['index'] for row in failures] == [0, 1, 2, 3]
+    assert failures[0]['error'].startswith("TopologicalError")
+    assert failures[0]['retry_error'].startswith("TopologicalError")
+
+def test_intersection_worker_feature_timeout():
+    failures = []
+    result = intersection_worker(grid, None, square, feature_timeout=-1,
+                                 failures=failures)
+    assert result == {}
+    assert failures[0]['error'].startswith("FeatureTimeout")
+    assert len(intersection_worker(grid, None, square, feature_timeout=60)) == 4
+
+def test_intersection_dispatcher_failures():
+    for cpus in (None, 2):
+        metrics = {}
+        with tempfile.TemporaryDirectory() as dirpath:
+            result = intersection_dispatcher(grid, square, None, cpus, dirpath,
+                                             metrics=metrics, feature_timeout=-1)
+        assert result == {}
+        assert [row['index'] for row in metrics['failures']] == [0, 1, 2, 3]
+
+    metrics = {}
+    intersection_dispatcher(grid, square, None, 2, metrics=metrics)
+    assert metrics['failures'] == []
+
+def test_intersection_dispatcher_stops_stalled_workers(monkeypatch):
+    expected = intersection_dispatcher(grid, square)
+    get_intersection = pandarus.intersections.get_intersection
+
+    def stalling(geom, *args, **kwargs):
+        # Stands for a single overlay which never finishes
+        if geom.bounds[:2] == (1, 1):
+            time.sleep(600)
+        return get_intersection(geom, *args, **kwargs)
+
+    monkeypatch.setattr('pandarus.intersections.get_intersection', stalling)
+    metrics = {}
+    start = time.time()
+    with tempfile.TemporaryDirectory() as dirpath:
+        result = intersection_dispatcher(grid, square, None, 2, dirpath,
+                                         metrics=metrics, start_method='fork',
+                                         feature_timeout=0.5)
+    assert time.time() - start < 60
+    assert result.keys() == {key for key in expected if key[0] != 3}
+    failure, = metrics['failures']
+    assert failure['index'] == 3 and failure['vertices'] == 5
+    assert failure['error'].startswith("FeatureTimeout")
+
+def test_intersection_dispatcher_checkpoint_failures():
+    with tempfile.TemporaryDirectory() as dirpath:
+        run_dir = os.path.join(
+            dirpath, checkpoint_key(grid, square, {'feature_timeout': -1})
+        )
+        os.makedirs(run_dir)
+        save_checkpoint({}, checkpoint_path(run_dir, [0, 1, 2, 3]),
+                        failures=[{'index': 2, 'error': 'foo'}])
+        assert load_checkpoint(checkpoint_path(run_dir, [0, 1, 2, 3]))[1] == \
+            [{'index': 2, 'error': 'foo'}]
+        metrics = {}
+        intersection_dispatcher(grid, square, None, 2, spatial_sort=False,
+                                checkpoint_dir=dirpath, metrics=metrics,
+                                feature_timeout=-1)
+    assert metrics['failures'] == [{'index': 2, 'error': 'foo'}]
+
+def test_intersection_worker_max_vertices():
+    for from_map, to_map in ((grid, square), (square, grid), (lines, grid)):
+        for kwargs in ({}, {'projected': True}):
+            expected = intersection_worker(from_map, None, to_map, **kwargs)
+            result = intersection_worker(from_map, None, to_map, max_vertices=4, **kwargs)
+            assert_same_results(result, expected, tolerance=1e-5)
+
+    result = intersection_worker(grid, None, square, max_vertices=4, geometries=False)
+    assert all(value.keys() == {'measure'} for value in result.values())
+
+@pytest.mark.skipif(not BULK_AVAILABLE, reason="requires shapely 2")
+def test_intersection_worker_bulk_max_vertices():
+    expected = intersection_worker(square, None, grid)
+    result = intersection_worker(square, None, grid, engine='bulk', max_vertices=4)
+    assert_same_results(result, expected, tolerance=1e-5)
@@ -0,0 +1,131 @@
+from pandarus import intersect
+from pandarus.cli import main
+from pandarus.filesystem import json_importer
+from pandarus.manifest import (
+    create_manifest,
+    load_manifest,
+    merge_manifest,
+    run_shard,
+)
+import fiona
+import json
+import os
+import pytest
+import shutil
+import tempfile
+
+dirpath = os.path.abspath(os.path.join(os.path.dirname(__file__), "data"))
+grid = os.path.join(dirpath, "grid.geojson")
+square = os.path.join(dirpath, "square.geojson")
+
+
+def results(data_fp):
+    return sorted((row[0], row[1], round(row[2])) for row in json_importer(data_fp)['data'])
+
+
+def test_create_manifest():
+    with tempfile.TemporaryDirectory() as dirpath:
+        fp = create_manifest(grid, 'name', square, 'name', 2, dirpath=dirpath)
+        manifest = load_manifest(fp)
+        assert os.path.dirname(fp) == dirpath
+        assert manifest['first']['field'] == 'name'
+        assert manifest['options']['geometries']
+        assert len(manifest['shards']) == 2
+        assert sorted(
+            index for shard in manifest['shards'] for index in shard['indices']
+        ) == [0, 1, 2, 3]
+        assert [shard['path'] for shard in manifest['shards']] == [
+            'shard-00000', 'shard-00001'
+        ]
+
+
+def test_manifest_same_as_intersect():
+    with tempfile.TemporaryDirectory() as dirpath, tempfile.TemporaryDirectory() as single:
+        fp = create_manifest(grid, 'name', square, 'name', 2, dirpath=dirpath, driver='GPKG')
+        for shard in range(2):
+            run_shard(fp, shard, cpus=None)
+        vector_fp, data_fp = merge_manifest(fp)
+
+        expected_vector, expected_data = intersect(
+            grid, 'name', square, 'name', dirpath=single, cpus=None,
+            driver='GPKG', shard_driver='GPKG'
+        )
+        assert os.path.basename(vector_fp) == os.path.basename(expected_vector)
+        assert os.path.basename(data_fp) == os.path.basename(expected_data)
+        assert results(data_fp) == results(expected_data)
+        metadata = json_importer(data_fp)['metadata']
+        expected = json_importer(expected_data)['metadata']
+        metadata.pop('when'), expected.pop('when')
+        assert metadata == expected
+        with fiona.open(vector_fp) as src, fiona.open(expected_vector) as other:
+            assert src.schema == other.schema
+            assert len(src) == len(other) == 4
+
+
+def test_manifest_same_as_default_intersect():
+    with tempfile.TemporaryDirectory() as dirpath, tempfile.TemporaryDirectory() as single:
+        fp = create_manifest(grid, 'name', square, 'name', 2, dirpath=dirpath,
+                             geometries=False)
+        for shard in range(2):
+            run_shard(fp, shard, cpus=None)
+        _, data_fp = merge_manifest(fp)
+        _, expected = intersect(grid, 'name', square, 'name', dirpath=single,
+                                cpus=2, log_dir=single, geometries=False)
+        assert os.path.basename(data_fp) == os.path.basename(expected)
+        # Same rows, but not necessarily in the same order
+        assert results(data_fp) == results(expected)
+
+
+def test_manifest_no_geometries():
+    with tempfile.TemporaryDirectory() as dirpath:
+        fp = create_manifest(grid, 'name', square, 'name', 2, dirpath=dirpath,
+                             geometries=False)
+        for shard in range(2):
+            run_shard(fp, shard, cpus=None)
+        vector_fp, data_fp = merge_manifest(fp)
+        assert vector_fp is None
+        assert len(results(data_fp)) == 4
+
+
+def test_merge_manifest_missing_shard():
+    with tempfile.TemporaryDirectory() as dirpath:
+        fp = create_manifest(grid, 'name', square, 'name', 2, dirpath=dirpath)
+        run_shard(fp, 0, cpus=None)
+        with pytest.raises(ValueError):
+            merge_manifest(fp)
+
+
+def test_run_shard_changed_input():
+    with tempfile.TemporaryDirectory() as dirpath:
+        first = os.path.join(dirpath, 'grid.geojson')
+        shutil.copy(grid, first)
+        fp = create_manifest(first, 'name', square, 'name', 2, dirpath=dirpath)
+        with open(first) as f:
+            data = json.load(f)
+        data['features'] = data['features'][:2]
+        with open(first, 'w') as f:
+            json.dump(data, f)
+        with pytest.raises(ValueError):
+            run_shard(fp, 0, cpus=None)
+
+
+def test_cli(capsys):
+    with tempfile.TemporaryDirectory() as dirpath:
+        main(['manifest', grid, 'name', square, 'name', '--shards', '2',
+              '--dirpath', dirpath, '--no-geometries'])
+        fp = capsys.readouterr().out.strip()
+        assert os.path.exists(fp)
+        for shard in ('0', '1'):
+            main(['run-shard', fp, shard, '--cpus', '0'])
+        capsys.readouterr()
+        main(['merge', fp])
+        data_fp, = capsys.readouterr().out.split()
+        assert len(results(data_fp)) == 4
+
+        for shard in ('2', '-1'):
+            with pytest.raises(SystemExit):
+                main(['run-shard', fp, shard, '--cpus', '0'])
+            assert "No shard {} in the manifest; shards are 0 to 1".format(shard) in \
+                capsys.readouterr().err
+        with pytest.raises(ValueError):
+            run_shard(fp, 2, cpus=None)
@@ -1,9 +1,11 @@
-from pandarus.maps import Map, DuplicateFieldID
+from pandarus.maps import Map, DuplicateFieldID, GeometryCache, NULL_GEOMETRY_HASH
+from shapely.geometry import MultiPolygon, Point, mapping
 from rtree import Rtree
 import fiona
 import os
 import pandarus
 import pytest
+import threading
 
 
 dirpath = os.path.abspath(os.path.join(os.path.dirname(__file__), "data"))
@@ -129,3 +131,87 @@ def test_rtree():
     r = m.create_rtree_index()
     assert r == m.rtree_index
     assert isinstance(r, Rtree)
+
+def test_iter_latlong_batches():
+    m = Map(grid, 'name')
+    expected = [(i, g.wkt) for i, g in m.iter_latlong()]
+    assert len(expected) == 4
+    assert [(i, g.wkt) for i, g in m.iter_latlong(batch_size=3)] == expected
+    assert [i for i, _ in m.iter_latlong([3, 1], batch_size=1)] == [3, 1]
+
+def test_geometry_cache_eviction():
+    size = len(Point(0, 0).wkb)
+    cache = GeometryCache(2 * size)
+    cache.add(0, Point(0, 0))
+    cache.add(1, Point(1, 1))
+    assert cache.get(0).wkt == 'POINT (0 0)'
+    cache.add(2, Point(2, 2))
+    assert len(cache) == 2
+    assert cache.size == 2 * size
+    assert cache.get(1) is None
+    assert cache.get(0) and cache.get(2)
+    assert (cache.hits, cache.misses) == (3, 1)
+
+def test_geometry_cache_too_large():
+    cache = GeometryCache(1)
+    cache.add(0, Point(0, 0))
+    assert not len(cache)
+
+def test_iter_latlong_cache():
+    m = Map(grid, 'name')
+    expected = [(i, g.wkt) for i, g in m.iter_latlong([2, 0])]
+
+    cache = m.enable_cache()
+    assert [(i, g.wkt) for i, g in m.iter_latlong([2, 0])] == expected
+    assert len(cache) == 2 and cache.hits == 0
+
+    m.file = None  # Cached geometries are not read again
+    assert [(i, g.wkt) for i, g in m.iter_latlong([2, 0, 2])] == expected + [expected[0]]
+    assert cache.hits == 3
+
+def test_iter_projected_threads():
+    m = Map(countries)
+    m.enable_cache(10000)
+    expected = [geom.wkb for _, geom in Map(countries).iter_latlong()]
+    results, errors = [], []
+
+    def run():
+        try:
+            for _ in range(5):
+                results.append([geom.wkb for _, geom in m.iter_latlong(range(len(m)), batch_size=1)])
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    assert results == [expected] * 20
+
+def test_feature_hashes():
+    hashes = Map(grid).feature_hashes()
+    assert sorted(hashes) == [0, 1, 2, 3]
+    assert len(set(hashes.values())) == 4
+    assert hashes == Map(grid).feature_hashes()
+
+def test_null_geometry(tmp_path):
+    filepath = str(tmp_path / "null.gpkg")
+    schema = {'geometry': 'Polygon', 'properties': {'name': 'str'}}
+    with fiona.open(filepath, 'w', driver='GPKG', schema=schema) as sink:
+        sink.write({'geometry': mapping(Point(0, 0).buffer(1)), 'properties': {'name': 'a'}})
+        sink.write({'geometry': None, 'properties': {'name': 'b'}})
+    m = Map(filepath)
+    hashes = m.feature_hashes()
+    assert hashes[1] == NULL_GEOMETRY_HASH != hashes[0]
+    assert [geom.is_empty for _, geom in m.iter_latlong()] == [False, True]
+    assert list(m.create_rtree_index().intersection((-2, -2, 2, 2))) == [0]
+
+def test_geometry_mixed_single_and_multi(tmp_path):
+    filepath = str(tmp_path / "mixed.gpkg")
+    schema = {'geometry': 'Unknown', 'properties': {'name': 'str'}}
+    with fiona.open(filepath, 'w', driver='GPKG', schema=schema) as sink:
+        sink.write({'geometry': mapping(Point(0, 0).buffer(1)), 'properties': {'name': 'a'}})
+        sink.write({'geometry': mapping(MultiPolygon([Point(3, 0).buffer(1)])), 'properties': {'name': 'b'}})
+    assert Map(filepath).geometry == 'MultiPolygon'
@@ -1,10 +1,26 @@
-from pandarus.projection import MOLLWEIDE, WGS84, project, wgs84
+from pandarus.projection import (
+    MOLLWEIDE,
+    WGS84,
+    _LOCAL,
+    get_transformer,
+    get_working_crs,
+    is_equal_area,
+    project,
+    project_many,
+    wgs84,
+)
 from shapely.geometry import (
     GeometryCollection,
+    LineString,
     MultiLineString,
     MultiPoint,
     MultiPolygon,
+    Point,
+    Polygon,
 )
+import numpy as np
+import pyproj
+import threading
 
 
 def test_projection():
@@ -31,3 +47,82 @@ def test_wgs84():
     assert wgs84(None) == WGS84
     assert wgs84("+no_defs") == WGS84
     assert wgs84(1) == 1
+
+
+def test_get_transformer_cached():
+    first = get_transformer(WGS84, MOLLWEIDE)
+    assert first is not None
+    assert get_transformer(WGS84, MOLLWEIDE) is first
+    assert get_transformer(None, None) is first
+    assert get_transformer('', MOLLWEIDE) is first
+
+
+def test_get_transformer_per_thread():
+    first = get_transformer(WGS84, MOLLWEIDE)
+    other = []
+    thread = threading.Thread(target=lambda: other.append(get_transformer(WGS84, MOLLWEIDE)))
+    thread.start()
+    thread.join()
+    assert other[0] is not None
+    assert other[0] is not first
+    assert all(value is not other[0] for value in _LOCAL.transformers.values())
+
+def test_get_transformer_no_op():
+    assert get_transformer(WGS84, WGS84) is None
+    assert get_transformer(MOLLWEIDE, MOLLWEIDE) is None
+    assert get_transformer('+init=epsg:4326', WGS84) is None
+
+
+def test_project_many():
+    given = [
+        MultiPoint([(1, 2), (3, 4)]),
+        LineString([(20, 30), (40, 50), (60, 70)]),
+        Polygon(
+            [(0, 0), (0, 10), (10, 10), (10, 0), (0, 0)],
+            [[(2, 2), (2, 4), (4, 4), (4, 2), (2, 2)]]
+        ),
+        GeometryCollection([Point(5, 6), GeometryCollection()]),
+    ]
+    result = project_many(given, WGS84, MOLLWEIDE)
+    assert [g.geom_type for g in result] == [g.geom_type for g in given]
+    transformer = pyproj.Transformer.from_crs(WGS84, MOLLWEIDE, always_xy=True)
+
+    def expected(coords):
+        return np.column_stack(transformer.transform(*np.asarray(coords).T))
+
+    assert np.allclose([p.coords[0] for p in result[0].geoms],
+                       expected([(1, 2), (3, 4)]))
+    assert np.allclose(result[1].coords, expected(given[1].coords))
+    assert np.allclose(result[2].exterior.coords, expected(given[2].exterior.coords))
+    assert len(result[2].interiors) == 1
+    assert np.allclose(result[2].interiors[0].coords,
+                       expected(given[2].interiors[0].coords))
+    assert np.allclose(result[3].geoms[0].coords, expected([(5, 6)]))
+    assert result[3].geoms[1].is_empty
+
+
+def test_project_many_z_values():
+    result = project_many([LineString([(1, 2, 3), (4, 5, 6)])])[0]
+    assert result.has_z
+    assert [c[2] for c in result.coords] == [3, 6]
+
+
+def test_project_many_no_op():
+    given = [Point(1, 2), GeometryCollection()]
+    assert project_many(given, WGS84, WGS84) == given
+    assert project_many([]) == []
+
+
+def test_get_working_crs():
+    utm = "+proj=utm +zone=31 +datum=WGS84 +units=m +no_defs"
+    assert get_working_crs(WGS84, WGS84) == MOLLWEIDE
+    assert get_working_crs(utm, WGS84) == MOLLWEIDE
+    assert get_working_crs(utm, MOLLWEIDE) == MOLLWEIDE
+    assert get_working_crs(utm, utm) == utm
+
+def test_is_equal_area():
+    assert is_equal_area(MOLLWEIDE)
+    assert is_equal_area('EPSG:3410')
+    assert is_equal_area('+proj=laea +lat_0=52 +lon_0=10')
+    assert not is_equal_area('EPSG:3857')
+    assert not is_equal_area(WGS84)
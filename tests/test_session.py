@@ -0,0 +1,95 @@
+from pandarus import Session
+from pandarus.intersections import intersection_dispatcher, _TO_MAPS
+import json
+import logging
+import os
+import pytest
+import tempfile
+
+dirpath = os.path.abspath(os.path.join(os.path.dirname(__file__), "data"))
+grid = os.path.join(dirpath, "grid.geojson")
+square = os.path.join(dirpath, "square.geojson")
+
+
+def is_loaded(fp):
+    return any(key[0] == fp for key in _TO_MAPS)
+
+def test_session_intersect():
+    with tempfile.TemporaryDirectory() as dirpath:
+        handlers = len(logging.getLogger().handlers)
+        with Session(cpus=2, log_dir=dirpath) as session:
+            _, first = session.intersect(grid, 'name', square, 'name', dirpath=dirpath, compress=False, driver='GPKG')
+            pool = session.get_pool()
+            assert is_loaded(square)
+            _, second = session.intersect(grid, 'name', square, 'name', dirpath=dirpath, compress=False, driver='GPKG')
+            assert session.get_pool() is pool
+            assert sorted(json.load(open(first))['data']) == \
+                sorted(json.load(open(second))['data'])
+        assert session.closed
+        assert not session.pools
+        assert not is_loaded(square)
+        assert len(logging.getLogger().handlers) == handlers
+        assert any(fp.endswith(".log") for fp in os.listdir(dirpath))
+
+def test_session_dispatcher():
+    expected = intersection_dispatcher(grid, square)
+    session = Session(cpus=2)
+    try:
+        for backend in ('processes', 'threads'):
+            result = intersection_dispatcher(grid, square, None, 2, session=session, backend=backend)
+            assert result.keys() == expected.keys()
+        assert session.pools.keys() == {'processes', 'threads'}
+        assert intersection_dispatcher(grid, square, session=session).keys() == expected.keys()
+        assert is_loaded(square)
+    finally:
+        session.close()
+    assert not is_loaded(square)
+
+def test_session_closed():
+    session = Session(cpus=1)
+    session.close()
+    session.close()
+    with pytest.raises(ValueError):
+        session.get_pool()
+
+def test_session_wrong_backend():
+    with Session(cpus=1) as session:
+        with pytest.raises(ValueError):
+            session.get_pool('foo')
+
+def test_session_start_method():
+    with Session(cpus=2, start_method='spawn') as session:
+        result = intersection_dispatcher(grid, square, None, 2, session=session)
+        assert len(result) == 4
+
+def test_session_worker_startup_reported_once():
+    with tempfile.TemporaryDirectory() as dirpath:
+        with Session(cpus=1, log_dir=dirpath) as session:
+            first, second = {}, {}
+            intersection_dispatcher(grid, square, None, 1, session=session, metrics=first)
+            intersection_dispatcher(grid, square, None, 1, session=session, metrics=second)
+            assert len(first['worker_startup']) == 1
+            assert second['worker_startup'] == []
+
+@pytest.mark.skipif(not os.path.isdir('/dev/shm'), reason="No POSIX shared memory")
+def test_session_frees_shared_memory(monkeypatch):
+    # One job per feature
+    monkeypatch.setattr('pandarus.intersections.get_jobs',
+                        lambda map_size: (1, map_size))
+
+    def callback(results):
+        raise ValueError
+
+    def shared_blocks():
+        return {name for name in os.listdir('/dev/shm') if name.startswith('pandarus_')}
+
+    before = shared_blocks()
+    session = Session(cpus=1, start_method='fork')
+    with pytest.raises(ValueError):
+        intersection_dispatcher(grid, square, None, 1, session=session,
+                                callback=callback)
+    # The other jobs are still running
+    assert session.shared_blocks
+    session.close()
+    assert not session.shared_blocks
+    assert shared_blocks() == before
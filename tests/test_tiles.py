@@ -0,0 +1,198 @@
+from pandarus import intersect
+from pandarus.filesystem import json_importer
+from pandarus.intersections import intersection_dispatcher
+from pandarus.tiles import (
+    TileOwner,
+    read_tile,
+    tile_path,
+    tile_range,
+    tiled_dispatcher,
+    write_tiles,
+)
+import numpy as np
+import os
+import pytest
+import subprocess
+import sys
+import tempfile
+
+dirpath = os.path.abspath(os.path.join(os.path.dirname(__file__), "data"))
+grid = os.path.join(dirpath, "grid.geojson")
+square = os.path.join(dirpath, "square.geojson")
+lines = os.path.join(dirpath, "lines.geojson")
+grid_3410 = os.path.join(dirpath, "grid-3410.geojson")
+
+
+def test_tile_range():
+    assert list(tile_range(0.5, 1.5, 1)) == [0, 1]
+    assert list(tile_range(-0.5, 0.5, 1)) == [-1, 0]
+    assert list(tile_range(0.2, 0.3, 1)) == [0]
+    assert list(tile_range(0, 10, 5)) == [0, 1, 2]
+
+def test_write_tiles():
+    with tempfile.TemporaryDirectory() as tmp:
+        tiles = write_tiles(grid, tmp, 'from', 1.5, batch_size=2)
+        assert sorted(tiles) == [(0, 0), (0, 1), (1, 0), (1, 1)]
+        assert tiles[(0, 1)] == tile_path(tmp, 'from', (0, 1))
+        indices, bounds = read_tile(tiles[(0, 0)])
+        assert indices.tolist() == [0, 1, 2, 3]
+        assert bounds[1].tolist() == [0, 1, 1, 2]
+        assert read_tile(tiles[(1, 1)])[0].tolist() == [3]
+
+        tiles = write_tiles(grid, tmp, 'only', 1.5, indices=[0])
+        assert list(tiles) == [(0, 0)]
+
+def test_tiled_dispatcher():
+    expected = intersection_dispatcher(grid, square)
+    for tile_size, cpus in ((0.3, None), (1, None), (10, 1)):
+        metrics = {}
+        with tempfile.TemporaryDirectory() as tmp:
+            result = tiled_dispatcher(grid, square, tile_size, tile_dir=tmp,
+                                      cpus=cpus, metrics=metrics)
+            assert os.listdir(tmp) == []
+        assert result.keys() == expected.keys()
+        for key, value in result.items():
+            assert np.allclose(value['measure'], expected[key]['measure'])
+            assert value['geom'].equals(expected[key]['geom'])
+        assert metrics['failures'] == []
+    assert metrics['tiles'] == 1
+
+    blocks = []
+    assert tiled_dispatcher(lines, grid, 0.5, callback=blocks.append) is None
+    result = {key: value for block in blocks for key, value in block.items()}
+    assert result.keys() == intersection_dispatcher(lines, grid).keys()
+
+    assert tiled_dispatcher(grid, square, 1, from_objs=[1]).keys() == {(1, 0)}
+
+def test_tiled_dispatcher_pools_dont_hang():
+    # Pools used to be terminated while workers were still logging, which
+    # could leave the logging queue locked forever
+    script = """
+import tempfile
+from pandarus.tiles import tiled_dispatcher
+for _ in range(5):
+    with tempfile.TemporaryDirectory() as tmp:
+        tiled_dispatcher({!r}, {!r}, 0.3, cpus=2, geometries=False, log_dir=tmp)
+""".format(grid, square)
+    subprocess.run(
+        [sys.executable, '-c', script], check=True, timeout=300,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    )
+
+def test_tile_owner():
+    with tempfile.TemporaryDirectory() as tmp:
+        from_tiles = write_tiles(grid, tmp, 'from', 1)
+        to_tiles = write_tiles(square, tmp, 'to', 1)
+        owned = []
+        for tile in set(from_tiles).intersection(to_tiles):
+            owner = TileOwner(tile, 1, from_tiles[tile], to_tiles[tile])
+            from_indices, _ = read_tile(from_tiles[tile])
+            owned.extend(
+                int(from_indices[i]) for i in range(len(from_indices))
+                if owner(i, [0]) == [0]
+            )
+        # Cells are in several tiles, but each pair has one owner
+        assert sorted(owned) == [0, 1, 2, 3]
+        assert repr(owner) == "TileOwner({}, 1)".format(tile)
+
+def test_tiled_dispatcher_overlays_pairs_once(monkeypatch):
+    import pandarus.intersections
+    get_intersection = pandarus.intersections.get_intersection
+    overlays = []
+
+    def spy(obj, kind, collection, indices, *args, **kwargs):
+        overlays.append(len(indices))
+        return get_intersection(obj, kind, collection, indices, *args, **kwargs)
+
+    monkeypatch.setattr('pandarus.intersections.get_intersection', spy)
+    intersection_dispatcher(grid, square)
+    expected, overlays[:] = sum(overlays), []
+    tiled_dispatcher(grid, square, 0.3)
+    assert sum(overlays) == expected
+
+def test_tiled_dispatcher_projected():
+    expected = intersection_dispatcher(grid_3410, grid_3410, projected=True)
+    result = tiled_dispatcher(grid_3410, grid_3410, 1, projected=True)
+    assert result.keys() == expected.keys()
+    for key, value in result.items():
+        assert np.allclose(value['measure'], expected[key]['measure'], rtol=1e-9)
+
+def test_tiled_dispatcher_one_pool(monkeypatch):
+    import pandarus.intersections
+    create_pool = pandarus.intersections.create_pool
+    pools = []
+
+    def spy(*args, **kwargs):
+        pools.append(args)
+        return create_pool(*args, **kwargs)
+
+    monkeypatch.setattr('pandarus.session.create_pool', spy)
+    monkeypatch.setattr('pandarus.intersections.create_pool', spy)
+    expected = intersection_dispatcher(grid, square)
+    with tempfile.TemporaryDirectory() as tmp:
+        metrics = {}
+        result = tiled_dispatcher(grid, square, 0.3, cpus=2, log_dir=tmp,
+                                  metrics=metrics)
+    assert metrics['tiles'] > 1
+    assert len(pools) == 1
+    assert result.keys() == expected.keys()
+
+def test_tiled_dispatcher_checkpoint(monkeypatch):
+    import pandarus.intersections
+    expected = intersection_dispatcher(grid, square)
+    worker = pandarus.intersections.intersection_worker
+    calls = []
+
+    def counting(*args, **kwargs):
+        calls.append(args)
+        return worker(*args, **kwargs)
+
+    def failing(*args, **kwargs):
+        if len(calls) == 2:
+            raise ValueError
+        return counting(*args, **kwargs)
+
+    options = dict(cpus=1, backend='threads', keep_checkpoints=True)
+    with tempfile.TemporaryDirectory() as tmp:
+        monkeypatch.setattr('pandarus.intersections.intersection_worker', counting)
+        tiled_dispatcher(grid, square, 0.3, **options)
+        total, calls[:] = len(calls), []
+
+        monkeypatch.setattr('pandarus.intersections.intersection_worker', failing)
+        with pytest.raises(ValueError):
+            tiled_dispatcher(grid, square, 0.3, checkpoint_dir=tmp, **options)
+        assert len(os.listdir(tmp)) == 3
+        calls[:] = []
+
+        monkeypatch.setattr('pandarus.intersections.intersection_worker', counting)
+        metrics = {}
+        result = tiled_dispatcher(grid, square, 0.3, checkpoint_dir=tmp,
+                                  metrics=metrics, **options)
+        assert len(calls) == total - 2
+        assert sorted(metrics['checkpoints']) == sorted(
+            os.path.join(tmp, name) for name in os.listdir(tmp)
+        )
+    assert result.keys() == expected.keys()
+    for key, value in result.items():
+        assert np.allclose(value['measure'], expected[key]['measure'])
+
+def test_tiled_dispatcher_failures():
+    metrics = {}
+    assert tiled_dispatcher(grid, square, 1, metrics=metrics, feature_timeout=-1) == {}
+    assert [row['index'] for row in metrics['failures']] == [0, 1, 2, 3]
+
+def test_tiled_dispatcher_unsupported():
+    with pytest.raises(ValueError):
+        tiled_dispatcher(grid, square, 1, packed=True)
+
+def test_intersect_tiles():
+    with tempfile.TemporaryDirectory() as tmp:
+        _, data_fp = intersect(grid, 'name', square, 'name', dirpath=tmp, cpus=None)
+        expected = sorted(json_importer(data_fp)['data'])
+    with tempfile.TemporaryDirectory() as tmp:
+        _, data_fp = intersect(grid, 'name', square, 'name', dirpath=tmp, cpus=None,
+                               tile_size=0.7, shard_driver='GPKG')
+        result = sorted(json_importer(data_fp)['data'])
+        assert len(os.listdir(tmp)) == 2
+    assert [row[:2] for row in result] == [row[:2] for row in expected]
+    assert np.allclose([row[2] for row in result], [row[2] for row in expected])